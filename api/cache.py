@@ -0,0 +1,116 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from api.models import ReportCacheEntry
+from medical_report_generator.crew import MedicalReportGenerator
+
+
+def normalize_prompt(prompt_text: str) -> str:
+    """Unicode NFC, surrounding and repeated whitespace removed."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", prompt_text)).strip()
+
+
+class ReportCache:
+    """Content-addressed cache of generated report texts, stored in the reports database.
+
+    Entries are keyed on the normalized prompt and the agent/task
+    configuration version, expire after ``ttl`` and are evicted least
+    recently used first beyond ``max_entries``. Hit and miss counters are
+    kept for the lifetime of the process.
+    """
+
+    def __init__(self, ttl: Optional[timedelta] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl or timedelta(
+            seconds=int(os.getenv("REPORT_CACHE_TTL", str(7 * 24 * 3600)))
+        )
+        self.max_entries = max_entries or int(os.getenv("REPORT_CACHE_MAX_ENTRIES", "1000"))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def config_version(self) -> str:
+        # Relu à chaque appel : une modification des YAML invalide le cache sans redémarrage
+        return MedicalReportGenerator.config_version()
+
+    def key(self, prompt_text: str) -> str:
+        content = f"{self.config_version}\n{normalize_prompt(prompt_text)}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, db: Session, prompt_text: str) -> Optional[str]:
+        """Returns the cached report text for the prompt, or None."""
+        entry = db.get(ReportCacheEntry, self.key(prompt_text))
+        now = datetime.utcnow()
+        if entry is not None and now - entry.created_at > self.ttl:
+            db.delete(entry)
+            db.commit()
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        entry.hits += 1
+        entry.last_used_at = now
+        db.commit()
+        return entry.report_text
+
+    def put(self, db: Session, prompt_text: str, report_text: str) -> None:
+        now = datetime.utcnow()
+        entry = {
+            "key": self.key(prompt_text),
+            "config_version": self.config_version,
+            "report_text": report_text,
+            "hits": 0,
+            "created_at": now,
+            "last_used_at": now,
+        }
+        # Upsert : deux jobs de la même dictée peuvent écrire la même clé en même temps
+        db.execute(
+            insert(ReportCacheEntry)
+            .values(**entry)
+            .on_conflict_do_update(
+                index_elements=[ReportCacheEntry.key],
+                set_={name: value for name, value in entry.items() if name != "key"},
+            )
+        )
+        db.query(ReportCacheEntry).filter(
+            ReportCacheEntry.created_at < now - self.ttl
+        ).delete(synchronize_session=False)
+        excess = db.query(ReportCacheEntry).count() - self.max_entries
+        if excess > 0:
+            least_recently_used = (
+                db.query(ReportCacheEntry.key)
+                .order_by(ReportCacheEntry.last_used_at)
+                .limit(excess)
+            )
+            db.query(ReportCacheEntry).filter(
+                ReportCacheEntry.key.in_(least_recently_used.scalar_subquery())
+            ).delete(synchronize_session=False)
+        db.commit()
+
+    def stats(self, db: Session) -> Dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": db.query(ReportCacheEntry).count(),
+            "max_entries": self.max_entries,
+            "ttl_seconds": int(self.ttl.total_seconds()),
+            "config_version": self.config_version,
+        }
+
+
+report_cache = ReportCache()
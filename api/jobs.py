@@ -0,0 +1,466 @@
+import asyncio
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session, aliased
+
+from api.cache import report_cache
+from api.database import SessionLocal
+from api.metrics import save_metrics
+from api.models import Job, Report
+from medical_report_generator.errors import GenerationResult, ReportGenerationError
+from medical_report_generator.main import run, save_report_document
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue holds ``max_queued`` jobs."""
+
+
+def save_report(db: Session, prompt_text: str, result: GenerationResult) -> Report:
+    """Stores the outcome of a generation as a Report row, its error and metrics included."""
+    report = Report(prompt_text=prompt_text)
+    if result.is_generated:
+        report.generated_report_path = str(result.filename)
+    else:
+        report.error_message = result.error_message or "Error generating report"
+
+    report.created_at = datetime.utcnow()
+    report.updated_at = datetime.utcnow()
+
+    db.add(report)
+    db.commit()
+    db.refresh(report)
+    save_metrics(db, report, result)
+    return report
+
+
+def job_finished_event(job: Job) -> Dict:
+    return {
+        "event": "job_finished",
+        "time": (job.finished_at or datetime.utcnow()).isoformat(),
+        "status": job.status,
+        "report_id": job.report_id,
+        "error_message": job.error_message,
+    }
+
+
+class JobQueue:
+    """Persistent queue of report generations, drained by a pool of worker threads.
+
+    Jobs are rows of the ``jobs`` table, so queued jobs survive a restart.
+    A running job records the process that claimed it, which refreshes its
+    ``heartbeat_at`` every ``heartbeat`` seconds: a job whose heartbeat is
+    older than ``stale_after`` was left by a crashed process and is queued
+    again, so that several API processes can share one database. At most
+    ``workers`` crews run at once, and at most ``batch_concurrency`` of the
+    jobs of a batch; :meth:`submit` and :meth:`submit_batch` refuse new jobs
+    while ``max_queued`` are waiting.
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_queued: Optional[int] = None,
+        heartbeat: Optional[timedelta] = None,
+        stale_after: Optional[timedelta] = None,
+    ):
+        self.workers = workers or int(os.getenv("JOB_WORKERS", "2"))
+        self.max_queued = max_queued or int(os.getenv("JOB_QUEUE_MAX", "20"))
+        self.heartbeat = heartbeat or timedelta(seconds=int(os.getenv("JOB_HEARTBEAT", "15")))
+        self.stale_after = stale_after or timedelta(
+            seconds=int(os.getenv("JOB_STALE_AFTER", "60"))
+        )
+        # Les jobs d'un autre processus ne sont vus que par la base : relue à cet intervalle
+        self.poll_interval = float(os.getenv("JOB_POLL_INTERVAL", "2"))
+        self.wait_timeout = float(os.getenv("JOB_WAIT_TIMEOUT", "600"))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._running: set = set()
+        self._stopping = False
+        # Distinct de _condition : un notify() destiné aux workers ne doit pas le réveiller
+        self._heartbeat_stop = threading.Event()
+        self._waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+        # Événements des jobs en cours, rejoués aux abonnés arrivés en retard
+        self._events: Dict[str, List[Dict]] = {}
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+
+    def start(self) -> None:
+        recovered = self._recover_stale()
+        db = SessionLocal()
+        try:
+            queued = db.query(Job).filter(Job.status == JOB_QUEUED).count()
+        finally:
+            db.close()
+        if queued:
+            print(f"{queued} tâche(s) en attente reprise(s), dont {recovered} interrompue(s)")
+
+        self._stopping = False
+        self._heartbeat_stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"report-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._beat, name="report-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Stops the workers once their current job is done; queued jobs stay queued."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._heartbeat_stop.set()
+        self._threads.clear()
+
+    def submit(self, db: Session, prompt_text: str, no_cache: bool = False) -> Job:
+        """Queues a generation, or completes it at once from the report cache.
+
+        Raises QueueFullError when ``max_queued`` jobs are already waiting.
+        """
+        return self._submit(db, [(None, prompt_text)], no_cache)[0]
+
+    def submit_batch(
+        self,
+        db: Session,
+        batch_inputs: List[Tuple[Optional[str], str]],
+        concurrency: int,
+        no_cache: bool = False,
+    ) -> List[Job]:
+        """Queues one job per (name, prompt) pair, run at most concurrency at a time.
+
+        Prompts found in the report cache are completed at once. Raises
+        QueueFullError, before any job is created, when the others do not fit
+        in the queue.
+        """
+        return self._submit(db, batch_inputs, no_cache, uuid.uuid4().hex, concurrency)
+
+    def _submit(
+        self,
+        db: Session,
+        batch_inputs: List[Tuple[Optional[str], str]],
+        no_cache: bool,
+        batch_id: Optional[str] = None,
+        batch_concurrency: Optional[int] = None,
+    ) -> List[Job]:
+        cached_report_texts = [
+            None if no_cache else report_cache.get(db, prompt_text)
+            for _, prompt_text in batch_inputs
+        ]
+        to_queue = cached_report_texts.count(None)
+        if to_queue and (
+            db.query(Job).filter(Job.status == JOB_QUEUED).count() + to_queue > self.max_queued
+        ):
+            raise QueueFullError(f"{self.max_queued} rapports au plus en attente")
+
+        jobs = []
+        for (name, prompt_text), cached_report_text in zip(batch_inputs, cached_report_texts):
+            job = Job(
+                id=uuid.uuid4().hex,
+                prompt_text=prompt_text,
+                no_cache=no_cache,
+                batch_id=batch_id,
+                batch_concurrency=batch_concurrency,
+                name=name,
+                created_at=datetime.utcnow(),
+            )
+            if cached_report_text is not None:
+                # Même dictée, même configuration : seul le .docx est régénéré, sans file d'attente
+                report = save_report(db, prompt_text, save_report_document(cached_report_text))
+                job.status = JOB_SUCCEEDED if report.generated_report_path else JOB_FAILED
+                job.report_id = report.id
+                job.error_message = report.error_message
+                job.started_at = job.finished_at = datetime.utcnow()
+            else:
+                job.status = JOB_QUEUED
+            db.add(job)
+            jobs.append(job)
+        db.commit()
+        if to_queue:
+            with self._condition:
+                self._condition.notify_all()
+        return jobs
+
+    def queue_position(self, db: Session, job: Job) -> Optional[int]:
+        """1-based position of a queued job, None once it has started."""
+        if job.status != JOB_QUEUED:
+            return None
+        return (
+            db.query(Job)
+            .filter(Job.status == JOB_QUEUED, Job.created_at <= job.created_at)
+            .count()
+        )
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> bool:
+        """Waits until the job has succeeded or failed, at most ``timeout`` seconds
+        (``wait_timeout`` by default); returns whether it has finished.
+
+        A job run by this process wakes the waiter as soon as it finishes; the
+        status is also read again every ``poll_interval`` seconds, for the
+        jobs claimed by another process.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        deadline = loop.time() + (self.wait_timeout if timeout is None else timeout)
+        with self._condition:
+            self._waiters.setdefault(job_id, []).append(waiter)
+        try:
+            while True:
+                # Le job a pu se terminer avant l'enregistrement de l'attente
+                if future.done() or await asyncio.to_thread(self._is_finished, job_id):
+                    return True
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return False
+                try:
+                    await asyncio.wait_for(
+                        asyncio.shield(future), min(self.poll_interval, remaining)
+                    )
+                    return True
+                except asyncio.TimeoutError:
+                    continue
+        finally:
+            with self._condition:
+                waiters = self._waiters.get(job_id, [])
+                if waiter in waiters:
+                    waiters.remove(waiter)
+                if not waiters:
+                    self._waiters.pop(job_id, None)
+
+    async def events(self, job_id: str) -> AsyncIterator[Dict]:
+        """Events of a job as they happen, ending with ``job_finished``.
+
+        The events already emitted by a running job are replayed first. The
+        crew events are those of MedicalReportGenerator.emit (task_started,
+        task_completed with the task output and duration, agent_step, ...).
+        Only ``job_finished`` is seen for a job run by another process, from
+        the status read every ``poll_interval`` seconds.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        subscriber = (loop, queue)
+        with self._condition:
+            for event in self._events.get(job_id, []):
+                queue.put_nowait(event)
+            self._subscribers.setdefault(job_id, []).append(subscriber)
+        try:
+            finished = await asyncio.to_thread(self._finished_event, job_id)
+            if finished is not None:
+                yield finished
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    finished = await asyncio.to_thread(self._finished_event, job_id)
+                    if finished is None or not queue.empty():
+                        continue
+                    event = finished
+                yield event
+                if event["event"] == "job_finished":
+                    return
+        finally:
+            with self._condition:
+                subscribers = self._subscribers.get(job_id, [])
+                if subscriber in subscribers:
+                    subscribers.remove(subscriber)
+                if not subscribers:
+                    self._subscribers.pop(job_id, None)
+
+    def _publish(self, job_id: str, event: Dict) -> None:
+        with self._condition:
+            self._events.setdefault(job_id, []).append(event)
+            subscribers = list(self._subscribers.get(job_id, []))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    def _finished_event(self, job_id: str) -> Optional[Dict]:
+        db = SessionLocal()
+        try:
+            job = db.get(Job, job_id)
+            if job is None or job.status not in FINISHED_STATUSES:
+                return None
+            return job_finished_event(job)
+        finally:
+            db.close()
+
+    def _is_finished(self, job_id: str) -> bool:
+        db = SessionLocal()
+        try:
+            job = db.get(Job, job_id)
+            return job is None or job.status in FINISHED_STATUSES
+        finally:
+            db.close()
+
+    def _notify(self, job_id: str) -> None:
+        with self._condition:
+            waiters = self._waiters.pop(job_id, [])
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(
+                lambda future=future: future.done() or future.set_result(None)
+            )
+
+    def _claim(self) -> Optional[str]:
+        running = aliased(Job)
+        running_in_batch = (
+            select(func.count(running.id))
+            .where(running.batch_id == Job.batch_id, running.status == JOB_RUNNING)
+            .correlate(Job)
+            .scalar_subquery()
+        )
+        db = SessionLocal()
+        try:
+            while True:
+                # Le plus ancien job en attente dont le lot n'a pas atteint sa concurrence
+                candidate = (
+                    db.query(Job.id)
+                    .filter(
+                        Job.status == JOB_QUEUED,
+                        or_(
+                            Job.batch_concurrency.is_(None),
+                            running_in_batch < Job.batch_concurrency,
+                        ),
+                    )
+                    .order_by(Job.created_at)
+                    .first()
+                )
+                if candidate is None:
+                    return None
+                now = datetime.utcnow()
+                # Ne passe à running que si le job est toujours en attente : un autre
+                # processus qui l'a pris entre-temps laisse rowcount à 0
+                claimed = (
+                    db.query(Job)
+                    .filter(Job.id == candidate.id, Job.status == JOB_QUEUED)
+                    .update(
+                        {
+                            Job.status: JOB_RUNNING,
+                            Job.started_at: now,
+                            Job.worker: self.worker_id,
+                            Job.heartbeat_at: now,
+                        },
+                        synchronize_session=False,
+                    )
+                )
+                db.commit()
+                if claimed:
+                    self._running.add(candidate.id)
+                    return candidate.id
+        finally:
+            db.close()
+
+    def _recover_stale(self) -> int:
+        """Queues again the running jobs whose process stopped beating; returns their number."""
+        db = SessionLocal()
+        try:
+            recovered = (
+                db.query(Job)
+                .filter(
+                    Job.status == JOB_RUNNING,
+                    or_(
+                        Job.heartbeat_at.is_(None),
+                        Job.heartbeat_at < datetime.utcnow() - self.stale_after,
+                    ),
+                )
+                .update(
+                    {Job.status: JOB_QUEUED, Job.started_at: None, Job.worker: None},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            return recovered
+        finally:
+            db.close()
+
+    def _beat(self) -> None:
+        while not self._heartbeat_stop.wait(self.heartbeat.total_seconds()):
+            with self._condition:
+                running = list(self._running)
+            db = SessionLocal()
+            try:
+                if running:
+                    db.query(Job).filter(
+                        Job.id.in_(running), Job.worker == self.worker_id
+                    ).update({Job.heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+                    db.commit()
+            finally:
+                db.close()
+            # Jobs d'un processus arrêté en cours de route : repris par les workers restants
+            if self._recover_stale():
+                with self._condition:
+                    self._condition.notify_all()
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                job_id = None if self._stopping else self._claim()
+                while job_id is None and not self._stopping:
+                    self._condition.wait()
+                    job_id = self._claim()
+            if job_id is None:
+                return
+            self._execute(job_id)
+
+    def _execute(self, job_id: str) -> None:
+        db = SessionLocal()
+        job = None
+        try:
+            job = db.get(Job, job_id)
+            self._publish(job_id, {"event": "job_started", "time": datetime.utcnow().isoformat()})
+            try:
+                # Jobs concurrents : replay reste celui de la ligne de commande
+                result = run(
+                    job.prompt_text,
+                    job.no_cache,
+                    event_listener=partial(self._publish, job_id),
+                    save_inputs=False,
+                )
+            except Exception as e:
+                # Erreur imprévue (bogue) : enregistrée comme les autres, le worker continue
+                result = GenerationResult(error=ReportGenerationError(f"{type(e).__name__}: {e}"))
+            try:
+                report = save_report(db, job.prompt_text, result)
+                job.report_id = report.id
+                job.status = JOB_SUCCEEDED if report.generated_report_path else JOB_FAILED
+                job.error_message = report.error_message
+            except Exception as e:
+                # Rapport généré mais non enregistré : le job ne doit pas rester running
+                db.rollback()
+                job.status = JOB_FAILED
+                job.error_message = f"Enregistrement du rapport impossible : {type(e).__name__}: {e}"
+            job.finished_at = datetime.utcnow()
+            db.commit()
+            # Seul un rapport enregistré est mis en cache ; un échec du cache n'échoue pas le job
+            if job.status == JOB_SUCCEEDED:
+                try:
+                    report_cache.put(db, job.prompt_text, result.report_text)
+                except Exception as e:
+                    db.rollback()
+                    print(f"Attention : rapport non mis en cache : {type(e).__name__}: {e}")
+        finally:
+            with self._condition:
+                self._running.discard(job_id)
+                # Un job de lot terminé peut débloquer le suivant pour un worker en attente
+                self._condition.notify_all()
+            if job is not None:
+                self._publish(job_id, job_finished_event(job))
+            with self._condition:
+                self._events.pop(job_id, None)
+            db.close()
+            self._notify(job_id)
+
+
+job_queue = JobQueue()
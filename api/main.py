@@ -1,22 +1,52 @@
+import json
+import os
+import time
+from contextlib import asynccontextmanager
 from fastapi import Depends, FastAPI, APIRouter, HTTPException, Response, status
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from api.models import Report
+from api.models import Job, Report
 from api import schemas
 from sqlalchemy.orm import Session
-from datetime import datetime
-from typing import List
+from typing import List, Union
 from pathlib import Path
 
-from medical_report_generator.main import run
+from medical_report_generator.crew import MedicalReportGenerator
+from medical_report_generator.crew_pool import crew_pool
+from medical_report_generator.rate_limit import rate_limiter
+from medical_report_generator.tools.knowledge_base import get_knowledge_base
+from .cache import report_cache
+from .jobs import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, QueueFullError, job_queue
+from .metrics import prometheus_text
 from .database import Base, get_db, engine
 
 Base.metadata.create_all(bind=engine)
 
 project_root = Path(__file__).resolve().parent.parent
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the shared RAG knowledge base once, before the first request needs it
+    started = time.perf_counter()
+    knowledge_base = get_knowledge_base(MedicalReportGenerator.knowledge_base_path)
+    await run_in_threadpool(knowledge_base.load)
+    knowledge_base_loaded = time.perf_counter()
+    # Équipes construites d'avance : les requêtes n'en paient plus la construction
+    await run_in_threadpool(crew_pool.warm)
+    print(
+        f"API prête en {time.perf_counter() - started:.2f} s (base de connaissances "
+        f"{knowledge_base_loaded - started:.2f} s, pool de {crew_pool.size} équipe(s) "
+        f"{time.perf_counter() - knowledge_base_loaded:.2f} s)"
+    )
+    # Reprend les rapports restés en file d'attente avant l'arrêt du serveur
+    job_queue.start()
+    yield
+    job_queue.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -48,24 +78,155 @@ async def get_reports(db: Session = Depends(get_db)):
     return reports
 
 
-@api_router.post("/generate", response_model=schemas.ReportResponse)
-async def generate_report(prompt_text: str, db: Session = Depends(get_db)):
-    report = Report(prompt_text=prompt_text)
-    generate_report_result = await run_in_threadpool(run, prompt_text)
-    if generate_report_result["is_generated"]:
-        report.generated_report_path = str(generate_report_result["filename"])
-    else:
-        report.error_message = generate_report_result.get(
-            "error", "Error generating report"
+def job_response(db: Session, job: Job) -> schemas.JobResponse:
+    response = schemas.JobResponse.model_validate(job)
+    response.queue_position = job_queue.queue_position(db, job)
+    return response
+
+
+def batch_response(db: Session, jobs: List[Job]) -> schemas.BatchResponse:
+    statuses = [job.status for job in jobs]
+    return schemas.BatchResponse(
+        batch_id=jobs[0].batch_id,
+        count=len(jobs),
+        queued=statuses.count(JOB_QUEUED),
+        running=statuses.count(JOB_RUNNING),
+        succeeded=statuses.count(JOB_SUCCEEDED),
+        failed=statuses.count(JOB_FAILED),
+        concurrency=jobs[0].batch_concurrency,
+        jobs=[job_response(db, job) for job in jobs],
+    )
+
+
+async def submit_job(db: Session, submit, *args) -> Union[Job, List[Job]]:
+    try:
+        # Un succès du cache écrit le .docx immédiatement : hors de la boucle d'événements
+        return await run_in_threadpool(submit, db, *args)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"File d'attente pleine : {e}",
+            headers={"Retry-After": "30"},
         )
 
-    report.created_at = datetime.utcnow()
-    report.updated_at = datetime.utcnow()
 
-    db.add(report)
-    db.commit()
-    db.refresh(report)
-    return report
+@api_router.post(
+    "/generate", response_model=Union[schemas.ReportResponse, schemas.JobResponse]
+)
+async def generate_report(
+    prompt_text: str,
+    no_cache: bool = False,
+    wait: bool = True,
+    db: Session = Depends(get_db),
+):
+    job = await submit_job(db, job_queue.submit, prompt_text, no_cache)
+    if not wait:
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=job_response(db, job).model_dump(mode="json"),
+        )
+
+    if not await job_queue.wait(job.id):
+        # Toujours en cours après JOB_WAIT_TIMEOUT : le client suit le job comme avec wait=false
+        db.refresh(job)
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=job_response(db, job).model_dump(mode="json"),
+        )
+    db.refresh(job)
+    report = db.get(Report, job.report_id) if job.report_id is not None else None
+    if report is None:
+        raise HTTPException(status_code=500, detail=job.error_message or "Error generating report")
+    return schemas.ReportResponse.model_validate(report)
+
+
+@api_router.post(
+    "/generate/batch",
+    response_model=schemas.BatchResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+async def generate_report_batch(
+    batch_request: schemas.BatchRequest, db: Session = Depends(get_db)
+):
+    batch_inputs = [
+        (f"{position:03d}", item)
+        if isinstance(item, str)
+        else (item.name or f"{position:03d}", item.prompt_text)
+        for position, item in enumerate(batch_request.prompts, start=1)
+    ]
+    if not batch_inputs:
+        raise HTTPException(status_code=422, detail="Empty batch")
+
+    # Les jobs du lot passent par les workers : jamais plus de JOB_WORKERS à la fois
+    concurrency = min(
+        batch_request.concurrency or int(os.getenv("BATCH_CONCURRENCY", "4")),
+        job_queue.workers,
+    )
+    jobs = await submit_job(
+        db, job_queue.submit_batch, batch_inputs, concurrency, batch_request.no_cache
+    )
+    return batch_response(db, jobs)
+
+
+@api_router.get("/batches/{batch_id}", response_model=schemas.BatchResponse)
+async def get_batch(batch_id: str, db: Session = Depends(get_db)):
+    jobs = db.query(Job).filter(Job.batch_id == batch_id).order_by(Job.created_at).all()
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch_response(db, jobs)
+
+
+@api_router.post(
+    "/jobs", response_model=schemas.JobResponse, status_code=status.HTTP_202_ACCEPTED
+)
+async def create_job(
+    prompt_text: str, no_cache: bool = False, db: Session = Depends(get_db)
+):
+    return job_response(db, await submit_job(db, job_queue.submit, prompt_text, no_cache))
+
+
+@api_router.get("/jobs/{job_id}", response_model=schemas.JobResponse)
+async def get_job(job_id: str, db: Session = Depends(get_db)):
+    job = db.get(Job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(db, job)
+
+
+@api_router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, db: Session = Depends(get_db)):
+    """Server-Sent Events of a job: one ``event:`` per task start, agent step and task output."""
+    if not db.get(Job, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        async for event in job_queue.events(job_id):
+            data = json.dumps(event, ensure_ascii=False, default=str)
+            yield f"event: {event['event']}\ndata: {data}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@api_router.get("/cache/stats", response_model=schemas.CacheStatsResponse)
+async def get_cache_stats(db: Session = Depends(get_db)):
+    return report_cache.stats(db)
+
+
+@api_router.get("/llm/stats", response_model=schemas.RateLimitStatsResponse)
+async def get_llm_stats():
+    return rate_limiter.stats()
+
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(db: Session = Depends(get_db)):
+    # Format d'exposition texte de Prometheus
+    return PlainTextResponse(
+        prometheus_text(db), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @api_router.get("/reports/{report_id}/download")
@@ -0,0 +1,220 @@
+import bisect
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from api.cache import report_cache
+from api.models import Job, Report, ReportMetric
+from medical_report_generator.crew_pool import crew_pool
+from medical_report_generator.errors import GenerationResult
+from medical_report_generator.rate_limit import rate_limiter
+
+# Bornes (secondes) des histogrammes de durée : outils en millisecondes, tâches en minutes
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class GenerationMetrics:
+    """Counters and duration histograms of the generations saved by this process.
+
+    They only ever grow, as Prometheus expects of counters: deleting a
+    report does not change them, and a restart resets them to zero. Each
+    scrape reads them as they are, without querying the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (kind, name) -> [compte par borne de DURATION_BUCKETS, compte total, somme]
+        self.durations: Dict[Tuple[str, str], List] = {}
+        # (tâche, agent) -> [appels, tokens de prompt, tokens de complétion]
+        self.llm_calls: Dict[Tuple[str, str], List[int]] = {}
+        self.reports = {"generated": 0, "failed": 0}
+
+    def record(self, result: GenerationResult) -> None:
+        measurements = [("stage", stage, duration) for stage, duration in result.timings.items()]
+        measurements += [
+            (record["kind"], record["name"], record["duration"]) for record in result.metrics
+        ]
+        with self._lock:
+            self.reports["generated" if result.is_generated else "failed"] += 1
+            for kind, name, duration in measurements:
+                histogram = self.durations.setdefault(
+                    (kind, name), [[0] * len(DURATION_BUCKETS), 0, 0.0]
+                )
+                # Compte non cumulé par intervalle ; cumulé à l'exposition
+                position = bisect.bisect_left(DURATION_BUCKETS, duration)
+                if position < len(DURATION_BUCKETS):
+                    histogram[0][position] += 1
+                histogram[1] += 1
+                histogram[2] += duration
+            for record in result.metrics:
+                if record["kind"] != "llm":
+                    continue
+                calls = self.llm_calls.setdefault((record["name"], record["agent"]), [0, 0, 0])
+                calls[0] += 1
+                calls[1] += record["prompt_tokens"] or 0
+                calls[2] += record["completion_tokens"] or 0
+
+    def snapshot(self) -> Tuple[Dict, Dict, Dict]:
+        """Copies of the durations, LLM calls and report counts, taken under the lock."""
+        with self._lock:
+            durations = {
+                key: (list(buckets), count, total)
+                for key, (buckets, count, total) in self.durations.items()
+            }
+            llm_calls = {key: list(calls) for key, calls in self.llm_calls.items()}
+            return durations, llm_calls, dict(self.reports)
+
+
+generation_metrics = GenerationMetrics()
+
+
+def save_metrics(db: Session, report: Report, result: GenerationResult) -> None:
+    """Stores the stage timings and the run metrics of a generation, linked to its report,
+    and adds them to the process counters of :data:`generation_metrics`."""
+    generation_metrics.record(result)
+    rows = [
+        ReportMetric(report_id=report.id, kind="stage", name=stage, duration=duration)
+        for stage, duration in result.timings.items()
+    ]
+    rows += [
+        ReportMetric(
+            report_id=report.id,
+            kind=record["kind"],
+            name=record["name"],
+            agent=record["agent"],
+            duration=record["duration"],
+            prompt_tokens=record["prompt_tokens"],
+            completion_tokens=record["completion_tokens"],
+        )
+        for record in result.metrics
+    ]
+    if rows:
+        db.add_all(rows)
+        db.commit()
+
+
+def _escape(value: Optional[str]) -> str:
+    return (value or "").replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels: Optional[str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _bucket_label(bound: float) -> str:
+    return f"{bound:g}"
+
+
+class _Exposition:
+    """Lines of a Prometheus text exposition, one HELP and TYPE header per metric."""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def metric(self, name: str, metric_type: str, help_text: str) -> None:
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {metric_type}")
+
+    def sample(self, metric: str, value: float, **labels: Optional[str]) -> None:
+        text = str(value) if isinstance(value, int) else repr(float(value))
+        self.lines.append(f"{metric}{_labels(**labels)} {text}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def prometheus_text(db: Session) -> str:
+    """All the metrics of the service, in the Prometheus text exposition format 0.0.4.
+
+    Durations, tokens and reports are the counters of :data:`generation_metrics`,
+    since the start of the process; the rate limiter, report cache and crew
+    pool figures are those of the running process too, and the job counts
+    those of the database.
+    """
+    exposition = _Exposition()
+    durations, llm_calls, reports = generation_metrics.snapshot()
+
+    name = "medical_report_duration_seconds"
+    exposition.metric(
+        name,
+        "histogram",
+        "Duration of the generation stages, crew tasks, LLM calls, tool calls and retrievals.",
+    )
+    for (kind, stage), (buckets, count, total) in sorted(durations.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+            cumulative += bucket_count
+            exposition.sample(
+                f"{name}_bucket", cumulative, kind=kind, name=stage, le=_bucket_label(bound)
+            )
+        exposition.sample(f"{name}_bucket", count, kind=kind, name=stage, le="+Inf")
+        exposition.sample(f"{name}_sum", total, kind=kind, name=stage)
+        exposition.sample(f"{name}_count", count, kind=kind, name=stage)
+
+    llm_rows = sorted(llm_calls.items(), key=lambda item: (item[0][0], item[0][1] or ""))
+    exposition.metric("medical_report_llm_calls_total", "counter", "LLM calls per task and agent.")
+    for (task_name, agent), (calls, _, _) in llm_rows:
+        exposition.sample("medical_report_llm_calls_total", calls, task=task_name, agent=agent)
+    exposition.metric(
+        "medical_report_llm_tokens_total", "counter", "LLM tokens per task, agent and type."
+    )
+    for (task_name, agent), (_, prompt_tokens, completion_tokens) in llm_rows:
+        exposition.sample(
+            "medical_report_llm_tokens_total",
+            prompt_tokens,
+            task=task_name,
+            agent=agent,
+            type="prompt",
+        )
+        exposition.sample(
+            "medical_report_llm_tokens_total",
+            completion_tokens,
+            task=task_name,
+            agent=agent,
+            type="completion",
+        )
+
+    exposition.metric("medical_report_reports_total", "counter", "Reports saved, by outcome.")
+    exposition.sample("medical_report_reports_total", reports["generated"], status="generated")
+    exposition.sample("medical_report_reports_total", reports["failed"], status="failed")
+
+    exposition.metric("medical_report_jobs", "gauge", "Jobs in the database, by status.")
+    jobs = db.query(Job.status, func.count(Job.id)).group_by(Job.status).order_by(Job.status)
+    for job_status, count in jobs:
+        exposition.sample("medical_report_jobs", count, status=job_status)
+
+    limiter = rate_limiter.stats()
+    for key, name, metric_type, help_text in (
+        ("calls", "calls_total", "counter", "LLM calls that went through the rate limiter."),
+        ("retries", "retries_total", "counter", "LLM calls retried after a transient error."),
+        ("failures", "failures_total", "counter", "LLM calls failed after the last retry."),
+        ("tokens", "tokens_total", "counter", "LLM tokens used, reported or estimated."),
+        ("waits", "waits_total", "counter", "LLM calls delayed by the rate limiter."),
+        ("wait_seconds_total", "wait_seconds_total", "counter", "Time spent waiting for quota."),
+        ("available_requests", "available_requests", "gauge", "Requests left in the bucket."),
+        ("available_tokens", "available_tokens", "gauge", "Tokens left in the bucket."),
+    ):
+        name = f"medical_report_rate_limiter_{name}"
+        exposition.metric(name, metric_type, help_text)
+        exposition.sample(name, limiter[key])
+
+    cache = report_cache.stats(db)
+    exposition.metric(
+        "medical_report_cache_lookups_total", "counter", "Report cache lookups, by result."
+    )
+    exposition.sample("medical_report_cache_lookups_total", cache["hits"], result="hit")
+    exposition.sample("medical_report_cache_lookups_total", cache["misses"], result="miss")
+    exposition.metric("medical_report_cache_entries", "gauge", "Entries in the report cache.")
+    exposition.sample("medical_report_cache_entries", cache["entries"])
+
+    pool = crew_pool.stats()
+    exposition.metric("medical_report_crew_pool_idle", "gauge", "Idle crews in the pool.")
+    exposition.sample("medical_report_crew_pool_idle", pool["idle"])
+    exposition.metric("medical_report_crew_pool_builds_total", "counter", "Crews built by the pool.")
+    exposition.sample("medical_report_crew_pool_builds_total", pool["builds"])
+
+    return exposition.text()
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Boolean, Column, Float, ForeignKey, Integer, String, DateTime, Text
+from sqlalchemy.orm import relationship
 from datetime import datetime
 
 from .database import Base
@@ -16,5 +17,72 @@ class Report(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Supprimées avec le rapport (SQLite n'applique pas les clés étrangères par défaut)
+    metrics = relationship("ReportMetric", cascade="all, delete-orphan")
+
     def __repr__(self):
         return f"<Report(id={self.id}, created_at={self.created_at}, updated_at={self.updated_at})>"
+
+
+class ReportCacheEntry(Base):
+    __tablename__ = "report_cache"
+
+    # Empreinte du prompt normalisé et de la version de configuration
+    key = Column(String, primary_key=True)
+    config_version = Column(String, nullable=False)
+    report_text = Column(Text, nullable=False)
+    hits = Column(Integer, default=0, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<ReportCacheEntry(key={self.key}, hits={self.hits}, last_used_at={self.last_used_at})>"
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True)
+
+    prompt_text = Column(Text, nullable=False)
+    no_cache = Column(Boolean, default=False, nullable=False)
+    # Lot soumis par /generate/batch, et nombre de ses jobs exécutés à la fois
+    batch_id = Column(String, nullable=True, index=True)
+    batch_concurrency = Column(Integer, nullable=True)
+    name = Column(String, nullable=True)
+    # queued, running, succeeded ou failed
+    status = Column(String, nullable=False, index=True)
+    report_id = Column(Integer, ForeignKey("reports.id", ondelete="SET NULL"), nullable=True)
+    error_message = Column(Text, nullable=True)
+    # Processus qui exécute le job, et dernier signe de vie de ce processus
+    worker = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Job(id={self.id}, status={self.status}, created_at={self.created_at})>"
+
+
+class ReportMetric(Base):
+    __tablename__ = "report_metrics"
+
+    id = Column(Integer, primary_key=True)
+
+    report_id = Column(Integer, ForeignKey("reports.id", ondelete="CASCADE"), nullable=False, index=True)
+    # stage, task, llm, tool ou retrieval
+    kind = Column(String, nullable=False, index=True)
+    # Étape, tâche ou outil mesuré
+    name = Column(String, nullable=False)
+    agent = Column(String, nullable=True)
+    duration = Column(Float, nullable=False)
+    prompt_tokens = Column(Integer, nullable=True)
+    completion_tokens = Column(Integer, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ReportMetric(report_id={self.report_id}, kind={self.kind}, name={self.name}, duration={self.duration})>"
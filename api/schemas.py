@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional, Union
 from datetime import datetime
 
 class ReportBase(BaseModel):
@@ -14,3 +14,63 @@ class ReportResponse(ReportBase):
 
     class Config:
         from_attributes = True
+
+class CacheStatsResponse(BaseModel):
+    hits: int
+    misses: int
+    hit_rate: float
+    entries: int
+    max_entries: int
+    ttl_seconds: int
+    config_version: str
+
+class RateLimitStatsResponse(BaseModel):
+    calls: int
+    retries: int
+    failures: int
+    tokens: int
+    waits: int
+    wait_seconds_total: float
+    wait_seconds_max: float
+    requests_per_minute: float
+    tokens_per_minute: float
+    available_requests: float
+    available_tokens: float
+
+# Borne de BatchRequest.concurrency, ramenée ensuite au nombre de workers
+MAX_BATCH_CONCURRENCY = 32
+
+class JobResponse(BaseModel):
+    id: str
+    status: str
+    prompt_text: str
+    name: Optional[str] = None
+    batch_id: Optional[str] = None
+    report_id: Optional[int] = None
+    error_message: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    queue_position: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class BatchItem(BaseModel):
+    prompt_text: str
+    name: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    prompts: List[Union[str, BatchItem]]
+    concurrency: Optional[int] = Field(None, ge=1, le=MAX_BATCH_CONCURRENCY)
+    no_cache: bool = False
+
+class BatchResponse(BaseModel):
+    batch_id: str
+    count: int
+    queued: int
+    running: int
+    succeeded: int
+    failed: int
+    concurrency: int
+    jobs: List[JobResponse]
@@ -0,0 +1,350 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from medical_report_generator.crew import MedicalReportGenerator
+from medical_report_generator.crew_pool import crew_pool
+from medical_report_generator.errors import GenerationResult
+from medical_report_generator.main import extract_test_prompt, generate_report
+from medical_report_generator.metrics import (
+    compare_measures,
+    distribution,
+    print_regressions,
+)
+from medical_report_generator.rate_limit import rate_limiter
+from medical_report_generator.stub_llm import STUB_MODEL, StubLLMServer, load_responses
+from medical_report_generator.task_cache import TaskOutputCache
+from medical_report_generator.tools import (
+    MedicalReportClassifierTool,
+    RAGMedicalReportsTool,
+)
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+TEST_REPORTS_PATH = PROJECT_ROOT / "knowledge" / "reports" / "testing"
+BENCHMARKS_PATH = PROJECT_ROOT / "generated" / "benchmarks"
+
+# Mesures comparées d'un benchmark à l'autre : (chemin dans les résultats, plus grand = mieux)
+COMPARED_MEASURES = [
+    (("pipeline", "reports_per_minute"), True),
+    (("pipeline", "stages", "total", "p50"), False),
+    (("pipeline", "stages", "total", "p95"), False),
+    (("pipeline", "stages", "crew", "p50"), False),
+    (("pipeline", "stages", "classification", "p50"), False),
+    (("pipeline", "stages", "document", "p50"), False),
+    (("pipeline", "retrieval", "p50"), False),
+    (("pipeline", "tokens", "total", "mean"), False),
+    (("micro", "retrieval", "p50"), False),
+    (("micro", "retrieval", "p95"), False),
+    (("micro", "classification", "p50"), False),
+    (("micro", "classification", "p95"), False),
+]
+
+
+def load_test_cases(test_reports_path: Path = TEST_REPORTS_PATH) -> List[Tuple[str, str, str]]:
+    """(name, prompt, ground truth) of each test report, the prompt being the one of test()."""
+    cases = []
+    for test_file in sorted(Path(test_reports_path).glob("*.txt")):
+        report_text = test_file.read_text(encoding="utf-8")
+        cases.append((test_file.stem, extract_test_prompt(report_text), report_text))
+    return cases
+
+
+def _grouped(records: List[Dict], kind: str) -> Dict[str, Dict]:
+    durations: Dict[str, List[float]] = {}
+    for record in records:
+        if record["kind"] == kind:
+            durations.setdefault(record["name"], []).append(record["duration"])
+    return {name: distribution(values) for name, values in sorted(durations.items())}
+
+
+def summarize_pipeline(results: List[GenerationResult], duration: float) -> Dict:
+    """Throughput, per-stage latency percentiles and tokens of a set of generations."""
+    records = [record for result in results for record in result.metrics]
+    stages = sorted({stage for result in results for stage in result.timings})
+    tokens_per_report = [
+        (
+            sum(r["prompt_tokens"] or 0 for r in result.metrics if r["kind"] == "llm"),
+            sum(r["completion_tokens"] or 0 for r in result.metrics if r["kind"] == "llm"),
+        )
+        for result in results
+    ]
+    succeeded = sum(1 for result in results if result.is_generated)
+    return {
+        "count": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "duration": duration,
+        "reports_per_minute": succeeded * 60 / duration if duration > 0 else 0.0,
+        "stages": {
+            stage: distribution(
+                result.timings[stage] for result in results if stage in result.timings
+            )
+            for stage in stages
+        },
+        "tasks": _grouped(records, "task"),
+        "llm_calls": _grouped(records, "llm"),
+        "llm_calls_per_report": distribution(
+            sum(1 for r in result.metrics if r["kind"] == "llm") for result in results
+        ),
+        "tools": _grouped(records, "tool"),
+        "retrieval": distribution(r["duration"] for r in records if r["kind"] == "retrieval"),
+        "tokens": {
+            "prompt": distribution(prompt for prompt, _ in tokens_per_report),
+            "completion": distribution(completion for _, completion in tokens_per_report),
+            "total": distribution(sum(tokens) for tokens in tokens_per_report),
+        },
+        "errors": sorted({result.error_message for result in results if result.error}),
+    }
+
+
+def benchmark_pipeline(
+    cases: List[Tuple[str, str, str]], concurrency: int, output_directory: Path
+) -> Dict:
+    """Runs the full pipeline on every case, ``concurrency`` crews at a time."""
+    # Cache de tâches jetable : chaque génération est réellement exécutée
+    task_cache_directory = Path(tempfile.mkdtemp(prefix="task_cache_", dir=output_directory))
+
+    def generate_one(case: Tuple[str, str, str]) -> GenerationResult:
+        name, prompt, _ = case
+        result = generate_report(
+            {"raw_input": prompt},
+            TaskOutputCache(task_cache_directory, read=False),
+            document_path=output_directory / f"{name}.docx",
+        )
+        print(
+            f"{name} : {'généré' if result.is_generated else 'échec'} "
+            f"en {result.timings['total']:.2f} s"
+        )
+        return result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(generate_one, cases))
+    return summarize_pipeline(results, time.perf_counter() - started)
+
+
+def benchmark_retrieval(cases: List[Tuple[str, str, str]], repeat: int) -> Optional[Dict]:
+    """Latency of the RAG tool on the test prompts, whole reports and sections.
+
+    The testing set covers other exam types than the knowledge base, so each
+    prompt is searched in one of the knowledge base types, in turn.
+    """
+    rag_tool = RAGMedicalReportsTool(
+        knowledge_base_path=str(PROJECT_ROOT / MedicalReportGenerator.knowledge_base_path)
+    )
+    report_types = sorted({report["type"] for report in rag_tool._knowledge_base.reports})
+    if not report_types:
+        return None
+    queries = [
+        (prompt, report_types[position % len(report_types)], section)
+        for position, (_, prompt, _) in enumerate(cases)
+        for section in (None, "Conclusion")
+    ]
+    # Premier passage hors mesure : chargement et vectorisation de la base
+    for query, report_type, section in queries:
+        rag_tool._run(query, report_type, section=section)
+    durations = []
+    for _ in range(repeat):
+        for query, report_type, section in queries:
+            started = time.perf_counter()
+            rag_tool._run(query, report_type, section=section)
+            durations.append(time.perf_counter() - started)
+    return distribution(durations)
+
+
+def benchmark_classification(cases: List[Tuple[str, str, str]], repeat: int) -> Dict:
+    """Latency of the keyword classifier on the test prompts and ground truth reports."""
+    classifier = MedicalReportClassifierTool(
+        vocabulary_path=PROJECT_ROOT / "knowledge" / "report_type_keywords.yaml"
+    )
+    texts = [text for _, prompt, report_text in cases for text in (prompt, report_text)]
+    classifier._run(texts[0])
+    durations = []
+    for _ in range(repeat):
+        for text in texts:
+            started = time.perf_counter()
+            classifier._run(text)
+            durations.append(time.perf_counter() - started)
+    return distribution(durations)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROJECT_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(
+    latency: float = 0.0,
+    latency_per_token: float = 0.0,
+    concurrency: int = 1,
+    limit: Optional[int] = None,
+    repeat: int = 20,
+    responses: Optional[Dict[str, str]] = None,
+    output: Optional[Path] = None,
+) -> Dict:
+    """
+    Benchmarks the pipeline on the testing set against the local stand-in LLM.
+
+    Every test report is generated by a full crew whose agents call a
+    :class:`StubLLMServer` (no network, fixed latency), with the rate
+    limiter disabled; the retrieval and classification tools are then
+    measured on their own. The LLM settings, the rate limits and the crew
+    pool are restored afterwards. The results are written as JSON to
+    ``output`` (by default generated/benchmarks/<date>.json) and returned.
+    """
+    cases = load_test_cases()[:limit]
+    if not cases:
+        raise ValueError(f"Aucun rapport de test dans {TEST_REPORTS_PATH}")
+    started_at = datetime.now()
+    output = Path(output or BENCHMARKS_PATH / f"{started_at.strftime('%Y-%m-%d-%H-%M-%S')}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    previous_settings = [
+        (MedicalReportGenerator, "llm_model"),
+        (MedicalReportGenerator, "llm_base_url"),
+        (MedicalReportGenerator, "llm_api_key"),
+        (rate_limiter, "requests_per_minute"),
+        (rate_limiter, "tokens_per_minute"),
+        (crew_pool, "size"),
+    ]
+    previous_settings = [(owner, name, getattr(owner, name)) for owner, name in previous_settings]
+    with StubLLMServer(
+        latency=latency, latency_per_token=latency_per_token, responses=responses
+    ) as stub, tempfile.TemporaryDirectory(prefix="benchmark_") as work_directory:
+        try:
+            MedicalReportGenerator.llm_model = STUB_MODEL
+            MedicalReportGenerator.llm_base_url = stub.base_url
+            MedicalReportGenerator.llm_api_key = "stub"
+            # Le quota protège le fournisseur réel, pas le serveur local
+            rate_limiter.requests_per_minute = 0
+            rate_limiter.tokens_per_minute = 0
+            crew_pool.size = max(crew_pool.size, concurrency)
+            # Les équipes déjà construites appellent le vrai LLM
+            crew_pool.drain()
+            warm_started = time.perf_counter()
+            crew_pool.warm()
+            warm_duration = time.perf_counter() - warm_started
+
+            print(f"\n## Pipeline complet : {len(cases)} rapport(s), concurrence {concurrency}")
+            pipeline = benchmark_pipeline(cases, concurrency, Path(work_directory))
+            pipeline["crew_pool_warm_duration"] = warm_duration
+            pipeline["llm_requests"] = stub.requests
+        finally:
+            # Équipes liées au serveur local, arrêté à la sortie du bloc
+            crew_pool.drain()
+            for owner, name, value in previous_settings:
+                setattr(owner, name, value)
+
+    print("\n## Micro-benchmarks : recherche RAG et classification")
+    results = {
+        "started_at": started_at.isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "reports": len(cases),
+            "concurrency": concurrency,
+            "latency": latency,
+            "latency_per_token": latency_per_token,
+            "repeat": repeat,
+            "rag_backend": RAGMedicalReportsTool(
+                knowledge_base_path=str(PROJECT_ROOT / MedicalReportGenerator.knowledge_base_path)
+            ).backend,
+        },
+        "pipeline": pipeline,
+        "micro": {
+            "retrieval": benchmark_retrieval(cases, repeat),
+            "classification": benchmark_classification(cases, repeat),
+        },
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    results["output"] = str(output)
+    return results
+
+
+def compare_benchmarks(current: Dict, baseline: Dict, tolerance: float = 0.10) -> List[Dict]:
+    """The measures of COMPARED_MEASURES that got worse than the baseline by more than tolerance."""
+    return compare_measures(current, baseline, COMPARED_MEASURES, tolerance)
+
+
+def print_summary(results: Dict) -> None:
+    pipeline = results["pipeline"]
+    print(
+        f"\n{pipeline['succeeded']}/{pipeline['count']} rapports en {pipeline['duration']:.2f} s "
+        f"({pipeline['reports_per_minute']:.1f} par minute), {pipeline['llm_requests']} requêtes LLM"
+    )
+    print(f"{'étape':<40} {'p50':>9} {'p95':>9} {'p99':>9}")
+    rows = [(f"étape {name}", stats) for name, stats in pipeline["stages"].items()]
+    rows += [(f"tâche {name}", stats) for name, stats in pipeline["tasks"].items()]
+    rows += [(f"outil {name}", stats) for name, stats in pipeline["tools"].items()]
+    rows += [("recherche dans l'index", pipeline["retrieval"])]
+    rows += [(f"micro {name}", stats) for name, stats in results["micro"].items()]
+    for name, stats in rows:
+        if stats:
+            print(f"{name:<40} {stats['p50']:9.4f} {stats['p95']:9.4f} {stats['p99']:9.4f}")
+    tokens = pipeline["tokens"]["total"]
+    if tokens:
+        print(f"Tokens par rapport : {tokens['mean']:.0f} en moyenne, {tokens['max']:.0f} au plus")
+    for error in pipeline["errors"]:
+        print(f"Erreur : {error}")
+    print(f"Résultats : {results['output']}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark hors ligne du pipeline contre un LLM local de substitution."
+    )
+    parser.add_argument("--latency", type=float, default=0.0, help="secondes par réponse LLM")
+    parser.add_argument(
+        "--latency-per-token", type=float, default=0.0, help="secondes par token de réponse"
+    )
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--limit", type=int, help="nombre maximal de rapports de test")
+    parser.add_argument("--repeat", type=int, default=20, help="passages des micro-benchmarks")
+    parser.add_argument("--responses", help="réponses LLM fixes, JSON {extrait du prompt: réponse}")
+    parser.add_argument("--output", help="fichier JSON des résultats")
+    parser.add_argument("--baseline", help="résultats JSON de référence à comparer")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.10, help="dégradation relative tolérée (0.10 = 10 %%)"
+    )
+    args = parser.parse_args(argv)
+
+    print("## Benchmark du Générateur de Compte Rendu Médical")
+    print("-------------------------------")
+    results = run_benchmark(
+        args.latency,
+        args.latency_per_token,
+        args.concurrency,
+        args.limit,
+        args.repeat,
+        load_responses(args.responses),
+        args.output,
+    )
+    print_summary(results)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_benchmarks(results, json.load(f), args.tolerance)
+        print_regressions(regressions, args.baseline, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,58 @@
-from crewai import Agent, Crew, Process, Task
+import hashlib
+import os
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from crewai import LLM, Agent, Crew, Process, Task
+from crewai.agents.parser import AgentAction, AgentFinish
 from crewai.project import CrewBase, agent, crew, task
+from crewai.tasks.task_output import TaskOutput
+from medical_report_generator.metrics import RunMetrics
+from medical_report_generator.rate_limit import rate_limited
+from medical_report_generator.task_cache import CachedAgent, TaskOutputCache
 from medical_report_generator.tools import (
     MedicalReportClassifierTool,
     RAGMedicalReportsTool,
 )
 
+# Valeur de {report_type} quand le type est laissé à la tâche classify_report_type
+CLASSIFIER_TASK_REPORT_TYPE = (
+    "celui produit par la tâche `classify_report_type`, fourni dans le contexte"
+)
+
+
+def schedule_tasks(tasks: List[Task]) -> List[Task]:
+    """Runs independent tasks concurrently, following the tasks' ``context`` DAG.
+
+    A task without an explicit ``context`` depends on all the previous tasks
+    (the sequential semantics), and that context is made explicit. A task is
+    made asynchronous when it depends on none of the asynchronous tasks still
+    running and another task can run alongside it; crewAI starts consecutive
+    asynchronous tasks together and the next synchronous task waits for all
+    of them.
+    """
+    for i, task in enumerate(tasks):
+        if not isinstance(task.context, list):
+            task.context = tasks[:i]
+
+    running = set()
+    for i, task in enumerate(tasks):
+        depends_on_running = any(id(t) in running for t in task.context)
+        next_is_independent = i + 1 < len(tasks) and task not in tasks[i + 1].context
+        task.async_execution = (
+            not depends_on_running
+            and i + 1 < len(tasks)
+            and (bool(running) or next_is_independent)
+        )
+        if task.async_execution:
+            running.add(id(task))
+        else:
+            running.clear()
+    return tasks
+
+
 # If you want to run a snippet of code before or after the crew starts,
 # you can use the @before_kickoff and @after_kickoff decorators
 # https://docs.crewai.com/concepts/crews#example-crew-class-with-decorators
@@ -17,17 +65,143 @@ class MedicalReportGenerator:
     agents_config = "config/agents.yaml"
     tasks_config = "config/tasks.yaml"
     knowledge_base_path = "knowledge/reports/training"
+    # Marge minimale du classifieur par mots-clés pour se passer de l'agent LLM
+    classification_margin_threshold = float(
+        os.getenv("CLASSIFIER_MARGIN_THRESHOLD", "0.5")
+    )
+    # Occurrences de mots-clés minimales du meilleur type : un mot isolé ne suffit pas
+    classification_min_score = int(os.getenv("CLASSIFIER_MIN_SCORE", "2"))
+    # Type de rapport déterminé avant le lancement de l'équipe (None : l'agent LLM classe)
+    report_type: Optional[str] = None
+    # Cache disque des sorties de tâches, à définir avant crew() (None : pas de cache)
+    task_cache: Optional[TaskOutputCache] = None
+    # Reçoit les événements de l'exécution (tâches, étapes des agents), à définir avant crew()
+    event_listener: Optional[Callable[[Dict], None]] = None
+    # Modèle et serveur remplaçant le LLM de agents.yaml pour tous les agents (None : celui du YAML),
+    # par exemple un serveur compatible OpenAI local ou le LLM de substitution des benchmarks
+    llm_model: Optional[str] = os.getenv("LLM_MODEL") or None
+    llm_base_url: Optional[str] = os.getenv("LLM_BASE_URL") or None
+    llm_api_key: Optional[str] = os.getenv("LLM_API_KEY") or None
+    # Mesures de la dernière exécution (tâches, appels LLM, outils), créées par build_crew()
+    metrics: Optional[RunMetrics] = None
+
+    @staticmethod
+    def config_version() -> str:
+        """Hash of the agent and task configuration files (LLMs, roles and prompts)."""
+        config_dir = Path(__file__).resolve().parent / "config"
+        digest = hashlib.sha256()
+        for config_file in ("agents.yaml", "tasks.yaml"):
+            digest.update((config_dir / config_file).read_bytes())
+        return digest.hexdigest()[:16]
+
+    def prepare_inputs(self, inputs: Dict) -> Dict:
+        """Classifies the raw input with the keyword classifier before the crew is built.
+
+        When the margin between the two best report types reaches
+        ``classification_margin_threshold`` and the best type has at least
+        ``classification_min_score`` keyword occurrences, the type is injected
+        in the task inputs and the ``classify_report_type`` task is left out
+        of the crew; otherwise the LLM classifier agent runs as before. Must
+        be called before :meth:`crew`.
+        """
+        report_type, margin, scores = MedicalReportClassifierTool().classify(
+            inputs["raw_input"]
+        )
+        if (
+            margin >= self.classification_margin_threshold
+            and scores.get(report_type, 0) >= self.classification_min_score
+        ):
+            self.report_type = report_type
+            print(f"Type de rapport classé sans LLM : {report_type} (marge {margin:.2f})")
+            self.emit("report_type_classified", report_type=report_type, margin=margin)
+        else:
+            self.report_type = None
+            print(
+                f"Classification par mots-clés incertaine (marge {margin:.2f}, scores {scores}), "
+                "classification par l'agent LLM"
+            )
+        return dict(inputs, report_type=self.report_type or CLASSIFIER_TASK_REPORT_TYPE)
+
+    def emit(self, event: str, **fields: Any) -> None:
+        """Sends an event of the run to ``metrics`` and to ``event_listener``, if any.
+
+        Events are dicts with an ``event`` name and a ``time`` (ISO 8601); they
+        may come from the threads of concurrent tasks.
+        """
+        if self.metrics is None and self.event_listener is None:
+            return
+        payload = {"event": event, "time": datetime.now().isoformat(), **fields}
+        if self.metrics is not None:
+            self.metrics.observe(payload)
+        if self.event_listener is not None:
+            self.event_listener(payload)
+
+    def _agent_step(self, role: str, step: Any) -> None:
+        """crewAI step callback: a tool call or the final answer of an agent."""
+        if isinstance(step, AgentAction):
+            self.emit("agent_step", agent=role, tool=step.tool)
+        elif isinstance(step, AgentFinish):
+            self.emit("agent_step", agent=role, tool=None)
+
+    def _task_completed(self, crew_task: Task, output: TaskOutput) -> None:
+        """crewAI task callback: the output of a task, available to the client at once."""
+        self.emit(
+            "task_completed",
+            task=crew_task.name,
+            agent=output.agent.strip(),
+            duration=crew_task.execution_duration,
+            output=output.raw,
+        )
+
+    def reset(self) -> None:
+        """Clears the state of the last run, so that the instance can serve another one."""
+        self.report_type = None
+        self.task_cache = None
+        self.event_listener = None
+        self.metrics = None
+        for crew_task in getattr(self, "tasks", None) or []:
+            crew_task.output = None
+            crew_task.start_time = None
+            crew_task.end_time = None
+            crew_task.retry_count = 0
+            crew_task.used_tools = 0
+            crew_task.tools_errors = 0
+            crew_task.delegations = 0
+            crew_task.processed_by_agents = set()
+        for crew_agent in getattr(self, "agents", None) or []:
+            crew_agent.tools_results = []
+            crew_agent._times_executed = 0
+
+    def timeline(self) -> List[Dict]:
+        """Start and end of each task of the last run, in seconds from the first start."""
+        executed = sorted(
+            (task for task in self.tasks if task.start_time and task.end_time),
+            key=lambda task: task.start_time,
+        )
+        if not executed:
+            return []
+        origin = executed[0].start_time
+        return [
+            {
+                "task": task.name,
+                "start": (task.start_time - origin).total_seconds(),
+                "end": (task.end_time - origin).total_seconds(),
+                "duration": task.execution_duration,
+                "concurrent": task.async_execution,
+            }
+            for task in executed
+        ]
 
     @agent
     def transcription_corrector(self) -> Agent:
-        return Agent(
+        return CachedAgent(
             config=self.agents_config["transcription_corrector"],
             verbose=True,
         )
 
     @agent
     def report_classifier(self) -> Agent:
-        return Agent(
+        return CachedAgent(
             config=self.agents_config["report_classifier"],
             tools=[MedicalReportClassifierTool()],
             verbose=True,
@@ -35,7 +209,7 @@ class MedicalReportGenerator:
 
     @agent
     def information_extractor(self) -> Agent:
-        return Agent(
+        return CachedAgent(
             config=self.agents_config["information_extractor"],
             tools=[RAGMedicalReportsTool(knowledge_base_path=self.knowledge_base_path)],
             verbose=True,
@@ -43,7 +217,7 @@ class MedicalReportGenerator:
 
     @agent
     def template_mapper(self) -> Agent:
-        return Agent(
+        return CachedAgent(
             config=self.agents_config["template_mapper"],
             tools=[RAGMedicalReportsTool(knowledge_base_path=self.knowledge_base_path)],
             verbose=True,
@@ -51,7 +225,7 @@ class MedicalReportGenerator:
 
     @agent
     def report_section_generator(self) -> Agent:
-        return Agent(
+        return CachedAgent(
             config=self.agents_config["report_section_generator"],
             tools=[RAGMedicalReportsTool(knowledge_base_path=self.knowledge_base_path)],
             verbose=True,
@@ -59,14 +233,14 @@ class MedicalReportGenerator:
 
     @agent
     def report_finalizer_and_reviewer(self) -> Agent:
-        return Agent(
+        return CachedAgent(
             config=self.agents_config["report_finalizer_and_reviewer"],
             verbose=True,
         )
 
     @agent
     def semantic_validator(self) -> Agent:
-        return Agent(config=self.agents_config["semantic_validator"], verbose=True)
+        return CachedAgent(config=self.agents_config["semantic_validator"], verbose=True)
 
     @task
     def correct_transcription(self) -> Task:
@@ -119,23 +293,72 @@ class MedicalReportGenerator:
         return Task(
             config=self.tasks_config["assemble_and_review_report"],
             agent=self.report_finalizer_and_reviewer(),
-            context=[self.validate_semantic_coherence(), self.classify_report_type()],
+            # classify_report_type est ajouté au contexte par build_crew() s'il s'exécute
+            context=[self.validate_semantic_coherence()],
         )
 
     @crew
     def crew(self) -> Crew:
         """Creates the MedicalReportGenerator crew"""
+        return self.build_crew()
+
+    def build_crew(self) -> Crew:
+        """A new crew over the instance's agents and tasks, for the current ``report_type``.
+
+        crewAI memoizes :meth:`crew`, which instantiates the agents and tasks
+        and returns the first crew: an instance reused for several runs (see
+        ``crew_pool``) builds each run's crew here, after :meth:`reset`.
+        """
+        if getattr(self, "agents", None) is None:
+            return self.crew()
+        self.metrics = RunMetrics()
+        # Les agents sont créés dès l'instanciation, avant que le cache ne soit défini
+        for crew_agent in self.agents:
+            crew_agent.task_cache = self.task_cache
+            crew_agent.event_listener = self.emit
+            crew_agent.step_callback = partial(self._agent_step, crew_agent.role.strip())
+            if self.llm_model and (
+                getattr(crew_agent.llm, "model", None) != self.llm_model
+                or getattr(crew_agent.llm, "base_url", None) != self.llm_base_url
+            ):
+                crew_agent.llm = LLM(
+                    model=self.llm_model,
+                    base_url=self.llm_base_url,
+                    api_key=self.llm_api_key,
+                )
+            # Tous les appels LLM du processus partagent le même quota
+            crew_agent.llm = rate_limited(crew_agent.llm)
+            if hasattr(crew_agent.llm, "event_listener"):
+                crew_agent.llm.event_listener = self.emit
+            for tool in crew_agent.tools or []:
+                if hasattr(tool, "event_listener"):
+                    tool.event_listener = partial(self.emit, agent=crew_agent.role.strip())
+        tasks = [
+            self.correct_transcription(),
+            *([] if self.report_type else [self.classify_report_type()]),
+            self.extract_medical_data(),
+            self.map_data_to_template_sections(),
+            self.generate_section_content(),
+            self.validate_semantic_coherence(),
+            self.assemble_and_review_report(),
+        ]
+        # schedule_tasks() rend les contextes explicites : on repart de ceux déclarés
+        if not hasattr(self, "_declared_contexts"):
+            self._declared_contexts = {
+                crew_task.name: crew_task.context for crew_task in self.tasks
+            }
+        for crew_task in tasks:
+            declared = self._declared_contexts[crew_task.name]
+            crew_task.context = list(declared) if isinstance(declared, list) else declared
+        if not self.report_type:
+            self.assemble_and_review_report().context.append(self.classify_report_type())
+        # Exécution en DAG : les tâches indépendantes tournent en parallèle
+        tasks = schedule_tasks(tasks)
+        for crew_task in tasks:
+            crew_task.callback = partial(self._task_completed, crew_task)
         return Crew(
             agents=self.agents,
-            tasks=[
-                self.correct_transcription(),
-                self.classify_report_type(),
-                self.extract_medical_data(),
-                self.map_data_to_template_sections(),
-                self.generate_section_content(),
-                self.validate_semantic_coherence(),
-                self.assemble_and_review_report(),
-            ],
+            tasks=tasks,
             process=Process.sequential,
             verbose=True,
         )
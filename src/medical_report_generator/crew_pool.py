@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from medical_report_generator.crew import MedicalReportGenerator
+
+
+class CrewPool:
+    """Pool of pre-built MedicalReportGenerator instances, reused from run to run.
+
+    Building an instance parses ``agents.yaml`` and ``tasks.yaml``, creates
+    the seven agents with their LLM clients and tools, and the tasks. A run
+    checks an instance out, builds its crew with
+    :meth:`MedicalReportGenerator.build_crew` and gives it back; the instance
+    is reset in between, so no run state leaks into the next one. When every
+    instance is in use, a new one is built, and kept if the pool holds fewer
+    than ``size`` idle instances.
+    """
+
+    def __init__(self, size: Optional[int] = None):
+        self.size = size or int(os.getenv("CREW_POOL_SIZE", "2"))
+        self._idle: List[MedicalReportGenerator] = []
+        self._lock = threading.Lock()
+        # Incrémentée par drain() : les instances sorties avant n'y reviennent pas
+        self._generation = 0
+        self.checkouts = 0
+        self.builds = 0
+
+    def _build(self) -> Dict:
+        started = time.perf_counter()
+        crew_generator = MedicalReportGenerator()
+        configured = time.perf_counter()
+        # Instancie les agents (LLM, outils) et les tâches, et construit une première équipe
+        crew_generator.crew()
+        built = time.perf_counter()
+        with self._lock:
+            self.builds += 1
+        return {
+            "generator": crew_generator,
+            "configuration": configured - started,
+            "agents_and_tasks": built - configured,
+            "total": built - started,
+        }
+
+    def warm(self) -> List[Dict]:
+        """Fills the pool up to ``size`` idle instances; returns the build timings."""
+        timings = []
+        started = time.perf_counter()
+        while True:
+            with self._lock:
+                if len(self._idle) >= self.size:
+                    break
+            build = self._build()
+            with self._lock:
+                self._idle.append(build.pop("generator"))
+            timings.append(build)
+        if timings:
+            print(
+                f"Pool de {len(timings)} équipe(s) prêt en {time.perf_counter() - started:.2f} s "
+                f"(par équipe : configuration "
+                f"{sum(t['configuration'] for t in timings) / len(timings):.2f} s, "
+                f"agents et tâches {sum(t['agents_and_tasks'] for t in timings) / len(timings):.2f} s)"
+            )
+        return timings
+
+    def drain(self) -> int:
+        """Drops the idle instances, and the ones checked out when they come back,
+        for instance after a change of LLM configuration; returns the number dropped."""
+        with self._lock:
+            dropped = len(self._idle)
+            self._idle.clear()
+            self._generation += 1
+        return dropped
+
+    @contextmanager
+    def checkout(self) -> Iterator[MedicalReportGenerator]:
+        """An instance for one run, reset and returned to the pool afterwards."""
+        with self._lock:
+            crew_generator = self._idle.pop() if self._idle else None
+            generation = self._generation
+            self.checkouts += 1
+        if crew_generator is None:
+            crew_generator = self._build()["generator"]
+        try:
+            yield crew_generator
+        finally:
+            crew_generator.reset()
+            with self._lock:
+                if generation == self._generation and len(self._idle) < self.size:
+                    self._idle.append(crew_generator)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "checkouts": self.checkouts,
+                "builds": self.builds,
+            }
+
+
+crew_pool = CrewPool()
@@ -0,0 +1,57 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+class ReportGenerationError(Exception):
+    """Base class of the errors of a report generation."""
+
+
+class LLMError(ReportGenerationError):
+    """The crew run failed: LLM provider error, exhausted retries or agent failure."""
+
+
+class ReportParseError(ReportGenerationError):
+    """The text produced by the crew is not a report with recognizable sections."""
+
+
+class DocumentWriteError(ReportGenerationError):
+    """The .docx of the report could not be written."""
+
+
+class UnknownTaskError(ValueError):
+    """A task name given to restart a run from (replay) is not a task of the crew.
+
+    A usage error rather than a generation failure: it is raised, not
+    returned in a GenerationResult.
+    """
+
+
+@dataclass
+class GenerationResult:
+    """Outcome of a report generation, successful or not.
+
+    ``timings`` holds the duration in seconds of each stage that ran
+    (``classification``, ``crew``, ``document``, ``total``), ``timeline``
+    the per-task timeline of the crew and ``metrics`` the records of
+    :class:`~medical_report_generator.metrics.RunMetrics` (tasks, LLM calls,
+    tool calls and retrievals).
+    """
+
+    report_text: Optional[str] = None
+    # Chemin du .docx relatif à la racine du projet
+    filename: Optional[str] = None
+    error: Optional[ReportGenerationError] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    timeline: List[Dict] = field(default_factory=list)
+    metrics: List[Dict] = field(default_factory=list)
+
+    @property
+    def is_generated(self) -> bool:
+        return self.error is None and self.filename is not None
+
+    @property
+    def error_message(self) -> Optional[str]:
+        """The error as stored in Report.error_message, prefixed with its type."""
+        if self.error is None:
+            return None
+        return f"{type(self.error).__name__}: {self.error}"
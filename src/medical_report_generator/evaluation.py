@@ -0,0 +1,153 @@
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import yaml
+
+from medical_report_generator.metrics import distribution
+
+DEFAULT_LABELS_PATH = Path("knowledge/testing_report_types.yaml")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words of a text, accents kept."""
+    return re.findall(r"\w+", text.lower())
+
+
+def rouge_l(candidate: List[str], reference: List[str]) -> float:
+    """ROUGE-L F-measure: longest common subsequence of the two token lists."""
+    if not candidate or not reference:
+        return 0.0
+    # Programmation dynamique sur deux lignes : mémoire linéaire
+    previous = [0] * (len(reference) + 1)
+    for candidate_token in candidate:
+        current = [0]
+        for j, reference_token in enumerate(reference, start=1):
+            if candidate_token == reference_token:
+                current.append(previous[j - 1] + 1)
+            else:
+                current.append(max(previous[j], current[j - 1]))
+        previous = current
+    common = previous[-1]
+    if not common:
+        return 0.0
+    precision, recall = common / len(candidate), common / len(reference)
+    return 2 * precision * recall / (precision + recall)
+
+
+def token_f1(candidate: List[str], reference: List[str]) -> float:
+    """F1 of the bag-of-words overlap of the two token lists."""
+    common = sum((Counter(candidate) & Counter(reference)).values())
+    if not common:
+        return 0.0
+    precision, recall = common / len(candidate), common / len(reference)
+    return 2 * precision * recall / (precision + recall)
+
+
+def score_sections(
+    generated: Dict[str, str], reference: Dict[str, str], headers: List[str]
+) -> Dict:
+    """Per-section scores of a generated report against its ground truth.
+
+    ``generated`` and ``reference`` map section headers to their content.
+    A section is *present* when it has content. Presence agrees when both
+    reports fill the section or both leave it empty; ROUGE-L and token F1
+    are only computed when the ground truth fills the section (0 if the
+    generated report leaves it empty).
+    """
+    scores = {}
+    for header in headers:
+        generated_tokens = tokenize(generated.get(header, ""))
+        reference_tokens = tokenize(reference.get(header, ""))
+        section_scores = {
+            "generated_present": bool(generated_tokens),
+            "reference_present": bool(reference_tokens),
+            "presence_agreement": bool(generated_tokens) == bool(reference_tokens),
+            "rouge_l": None,
+            "token_f1": None,
+        }
+        if reference_tokens:
+            section_scores["rouge_l"] = rouge_l(generated_tokens, reference_tokens)
+            section_scores["token_f1"] = token_f1(generated_tokens, reference_tokens)
+        scores[header.rstrip(":")] = section_scores
+    return scores
+
+
+def load_expected_report_types(path: Path = DEFAULT_LABELS_PATH) -> Dict[str, str]:
+    """Expected classifier type of each test report, keyed on the file name without .txt."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            labels = yaml.safe_load(f) or {}
+        return {str(name): str(report_type) for name, report_type in labels.items()}
+    except FileNotFoundError:
+        print(f"Attention : types attendus des rapports de test introuvables : {path}")
+        return {}
+
+
+def _mean(values: List[Optional[float]]) -> Optional[float]:
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+
+def build_scorecard(items: List[Dict]) -> Dict:
+    """Aggregates the per-report evaluations (see main.evaluate_testing_set) into a scorecard.
+
+    Each item has ``sections`` (from :func:`score_sections`, None when the
+    generation failed), ``classification`` (predicted and expected types of
+    the prompt and of the ground truth) and ``timings``.
+    """
+    scored = [item for item in items if item["sections"] is not None]
+    section_names = list(scored[0]["sections"]) if scored else []
+    sections = {
+        name: {
+            "rouge_l": _mean([item["sections"][name]["rouge_l"] for item in scored]),
+            "token_f1": _mean([item["sections"][name]["token_f1"] for item in scored]),
+            "presence_agreement": _mean(
+                [float(item["sections"][name]["presence_agreement"]) for item in scored]
+            ),
+            "reference_present": sum(
+                item["sections"][name]["reference_present"] for item in scored
+            ),
+            "generated_present": sum(
+                item["sections"][name]["generated_present"] for item in scored
+            ),
+        }
+        for name in section_names
+    }
+
+    classification = {}
+    for source in ("prompt", "reference"):
+        labelled = [
+            item["classification"]
+            for item in items
+            if item["classification"]["expected"] is not None
+        ]
+        correct = sum(1 for labels in labelled if labels[source] == labels["expected"])
+        classification[source] = {
+            "labelled": len(labelled),
+            "correct": correct,
+            "accuracy": correct / len(labelled) if labelled else None,
+        }
+
+    stages = sorted({stage for item in items for stage in item["timings"]})
+    return {
+        "count": len(items),
+        "generated": len(scored),
+        "failed": len(items) - len(scored),
+        "overall": {
+            "rouge_l": _mean([sections[name]["rouge_l"] for name in section_names]),
+            "token_f1": _mean([sections[name]["token_f1"] for name in section_names]),
+            "presence_agreement": _mean(
+                [sections[name]["presence_agreement"] for name in section_names]
+            ),
+        },
+        "sections": sections,
+        "classification": classification,
+        "latency": {
+            stage: distribution(
+                item["timings"][stage] for item in items if stage in item["timings"]
+            )
+            for stage in stages
+        },
+    }
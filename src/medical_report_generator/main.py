@@ -5,15 +5,79 @@ from docx import Document
 from docx.shared import Pt
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
 import re
+import json
+import os
 import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
 from medical_report_generator.crew import MedicalReportGenerator
+from medical_report_generator.crew_pool import crew_pool
+from medical_report_generator.errors import (
+    DocumentWriteError,
+    GenerationResult,
+    LLMError,
+    ReportGenerationError,
+    ReportParseError,
+    UnknownTaskError,
+)
+from medical_report_generator.evaluation import (
+    DEFAULT_LABELS_PATH,
+    build_scorecard,
+    load_expected_report_types,
+    score_sections,
+)
+from medical_report_generator.metrics import summarize_metrics
+from medical_report_generator.rate_limit import rate_limiter
+from medical_report_generator.task_cache import TaskOutputCache
+from medical_report_generator.tools import (
+    MedicalReportClassifierTool,
+    RAGMedicalReportsTool,
+)
+from medical_report_generator.tools.report_sections import (
+    SECTION_NAMES,
+    ReportSections,
+    parse_sections,
+)
 
 warnings.filterwarnings("ignore", category=SyntaxWarning, module="pysbd")
 
 
+# En-têtes des sections d'un compte rendu, dans l'ordre du document (hors titre)
+REPORT_SECTION_HEADERS = [f"{name}:" for name in SECTION_NAMES if name != "TITRE"]
+
+
+def clean_report_text(report_text: str) -> str:
+    """The report text without the markdown code fences the LLM may wrap it in."""
+    # Regex to remove markdown code block fences, including 'french'
+    return re.sub(
+        r"^\s*```(?:json|text|french)?\s*[\r\n]*(.*?)\s*```\s*$",
+        r"\1",
+        report_text,
+        flags=re.DOTALL | re.IGNORECASE,
+    ).strip()
+
+
+def parse_report_sections(report_text: str) -> dict:
+    """
+    Maps each header of REPORT_SECTION_HEADERS found in the text to its
+    content: the rest of the header line and the following non-empty lines,
+    up to the next header (see parse_sections). Sections found empty are
+    kept, with an empty content.
+    """
+    return _sections_by_header(parse_sections(report_text))
+
+
+def _sections_by_header(sections: ReportSections) -> dict:
+    return {
+        header: sections.get(header[:-1])
+        for header in REPORT_SECTION_HEADERS
+        if header[:-1] in sections
+    }
+
+
 def create_word_document(report_text: str, filename: str = "radiology_report.docx"):
     """
     Creates a Word document from the structured report text generated by the crew.
@@ -21,6 +85,10 @@ def create_word_document(report_text: str, filename: str = "radiology_report.doc
     Args:
         report_text: The complete structured report text (output from the crew).
         filename: The name of the output .docx file.
+
+    Raises:
+        ReportParseError: No report section was found in report_text.
+        DocumentWriteError: The file could not be saved.
     """
     document = Document()
 
@@ -29,29 +97,11 @@ def create_word_document(report_text: str, filename: str = "radiology_report.doc
     font.name = "Calibri"
     font.size = Pt(11)
 
-    # Regex to remove markdown code block fences, including 'french'
-    cleaned_text = re.sub(
-        r"^\\s*```(?:json|text|french)?\\s*[\\r\\n]*(.*?)\\s*```\\s*$",
-        r"\\1",
-        report_text,
-        flags=re.DOTALL | re.IGNORECASE,
-    ).strip()
-
-    lines = cleaned_text.split("\n")
+    cleaned_text = clean_report_text(report_text)
 
-    title_content = "Compte Rendu Radiologique"
-    lines_for_sections = lines
-
-    if lines:
-        first_line = lines[0].strip()
-        # Case insensitive check for TITRE, supporting French output
-        if first_line.upper().startswith("TITRE:"):
-            title_content = (
-                first_line.split(":", 1)[1].strip()
-                if ":" in first_line
-                else title_content
-            )
-            lines_for_sections = lines[1:]
+    # Une seule analyse du texte : titre et sections
+    sections = parse_sections(cleaned_text)
+    title_content = sections.get("TITRE", separator=" ") or "Compte Rendu Radiologique"
 
     # Add the extracted or default title
     title_paragraph = document.add_paragraph(title_content)
@@ -59,40 +109,15 @@ def create_word_document(report_text: str, filename: str = "radiology_report.doc
     title_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
     document.add_paragraph()  # Add a blank line after the title
 
-    # --- Improved Section Parsing ---
-    section_headers_list = [
-        "Indication:",
-        "Technique:",
-        "Incidences:",
-        "Résultat:",
-        "Conclusion:",
-    ]
-    report_sections_data = {}
-    current_section_header = None
-    current_section_content = []
-
-    # Improved section parsing for potentially multi-line content within sections
-    for line_idx, line_text in enumerate(lines_for_sections):
-        stripped_line = line_text.strip()
-        found_new_header = False
-        for header in section_headers_list:
-            if stripped_line.upper().startswith(header.upper()):
-                if current_section_header:
-                    report_sections_data[current_section_header] = "\n".join(
-                        current_section_content
-                    ).strip()
-                current_section_header = header
-                current_section_content = [stripped_line[len(header) :].strip()]
-                found_new_header = True
-                break
-        if not found_new_header and current_section_header:
-            if stripped_line:
-                current_section_content.append(stripped_line)
-
-        if line_idx == len(lines_for_sections) - 1 and current_section_header:
-            report_sections_data[current_section_header] = "\n".join(
-                current_section_content
-            ).strip()
+    section_headers_list = REPORT_SECTION_HEADERS
+    report_sections_data = _sections_by_header(sections)
+
+    if not report_sections_data:
+        raise ReportParseError(
+            "Aucune section reconnue ("
+            + ", ".join(header.rstrip(":") for header in section_headers_list)
+            + f") dans le texte généré : {cleaned_text[:200]!r}"
+        )
 
     # Add sections to the document in the defined order
     for header in section_headers_list:
@@ -113,17 +138,102 @@ def create_word_document(report_text: str, filename: str = "radiology_report.doc
 
     try:
         document.save(filename)
-        print(f"\nCompte rendu généré avec succès sous le nom '{filename}'")
-        return {"is_generated": True, "filename": filename}
     except Exception as e:
         print(f"\nErreur lors de l'enregistrement du document : {e}")
-        sys.exit(1)
-        return {"is_generated": False, "error": str(e)}
+        raise DocumentWriteError(f"Enregistrement de {filename} impossible : {e}") from e
+    print(f"\nCompte rendu généré avec succès sous le nom '{filename}'")
+    return filename
+
 
+def save_report_document(
+    report_text: str, document_path: Path = None, result: GenerationResult = None
+) -> GenerationResult:
+    """
+    Saves the report text as a .docx, by default uniquely named in generated/reports.
 
-def run(medical_input: str = None):
+    document_path, if given, is relative to the project root. Returns result
+    (a new GenerationResult by default) with the report text, the file name
+    relative to the project root and the document timing, or the error.
+    """
+    result = result or GenerationResult()
+    result.report_text = report_text
+    current_file_path = Path(__file__).resolve()
+    project_root = current_file_path.parent.parent.parent
+    if document_path is None:
+        unique_name = datetime.now().strftime(
+            "radiology_report_%Y-%m-%d-%H-%M-%S-%f.docx"
+        )
+        document_path = Path("generated") / "reports" / unique_name
+    generated_report_path_absolute = project_root / document_path
+    generated_report_path_relative = Path(document_path)
+
+    started = time.perf_counter()
+    try:
+        generated_report_path_absolute.parent.mkdir(parents=True, exist_ok=True)
+        create_word_document(report_text, filename=generated_report_path_absolute)
+        result.filename = str(generated_report_path_relative)
+    except ReportGenerationError as e:
+        result.error = e
+    except OSError as e:
+        result.error = DocumentWriteError(
+            f"Dossier {generated_report_path_absolute.parent} inaccessible : {e}"
+        )
+    except Exception as e:
+        result.error = DocumentWriteError(
+            f"Écriture de {generated_report_path_relative} impossible : {type(e).__name__}: {e}"
+        )
+        result.error.__cause__ = e
+    result.timings["document"] = time.perf_counter() - started
+    return result
+
+
+def print_timeline(timeline: list):
+    """Prints the per-task timeline of a crew run and the time saved by running tasks concurrently."""
+    if not timeline:
+        return
+    print("\n## Chronologie des tâches (secondes):")
+    for entry in timeline:
+        marker = " [parallèle]" if entry["concurrent"] else ""
+        print(
+            f"{entry['start']:8.2f} -> {entry['end']:8.2f}  ({entry['duration']:6.2f})  "
+            f"{entry['task']}{marker}"
+        )
+    wall_clock = max(entry["end"] for entry in timeline)
+    total = sum(entry["duration"] for entry in timeline)
+    print(
+        f"Durée totale : {wall_clock:.2f} s, somme des tâches : {total:.2f} s "
+        f"({total - wall_clock:.2f} s gagnées par l'exécution parallèle)"
+    )
+
+
+def print_metrics(metrics: list):
+    """Prints the LLM calls and tokens per agent and the tool calls of a crew run."""
+    summary = summarize_metrics(metrics)
+    if not summary["llm_calls"] and not summary["tool_calls"]:
+        return
+    print("\n## Appels LLM et outils:")
+    for agent_role, totals in sorted(summary["llm_calls"].items()):
+        print(
+            f"{totals['calls']:4d} appel(s) LLM, {totals['prompt_tokens']:7d} + "
+            f"{totals['completion_tokens']:6d} tokens  {agent_role}"
+        )
+    for tool_name, totals in sorted(summary["tool_calls"].items()):
+        print(f"{totals['calls']:4d} appel(s), {totals['duration']:6.2f} s  outil {tool_name}")
+
+
+def run(
+    medical_input: str = None,
+    no_cache: bool = False,
+    event_listener=None,
+    save_inputs: bool = True,
+) -> GenerationResult:
     """
     Run the crew to generate a medical report.
+    With no_cache, every task is executed even if its output is cached.
+    event_listener, if given, receives the events of the run as they happen
+    (see MedicalReportGenerator.emit). With save_inputs, the inputs are kept
+    as the last run for replay; concurrent callers such as the API pass
+    False. Failures are returned in the result's error, never raised.
     """
     print("## Équipe de Génération de Compte Rendu Médical")
     print("-------------------------------")
@@ -142,47 +252,127 @@ En résumé, l'examen révèle quelques petits foyers d'endométriose superficie
         "raw_input": medical_input if medical_input is not None else raw_medical_input
     }
 
-    # Instantiate the Crew using the CrewBase class, passing the LLM
+    # Every task output is saved, so that a failed run can be replayed
+    task_cache = task_output_cache(read=not no_cache)
+    if save_inputs:
+        try:
+            task_cache.save_inputs(inputs)
+        except OSError as e:
+            print(f"Attention : entrées non sauvegardées pour replay : {e}")
+    result = generate_report(inputs, task_cache, event_listener=event_listener)
+    report_error(result)
+    return result
+
+
+def report_error(result: GenerationResult):
+    """Prints the error of a failed generation, if any, with its type."""
+    if result.error is not None:
+        print(
+            f"\nUne erreur s'est produite lors de la génération du compte rendu : {result.error_message}",
+            file=sys.stderr,
+        )
+
+
+def generate_report(
+    inputs: dict,
+    task_cache: TaskOutputCache,
+    from_task: str = None,
+    event_listener=None,
+    document_path: Path = None,
+) -> GenerationResult:
+    """
+    Runs a crew from the crew pool on the inputs and saves the report as a .docx.
+
+    Task outputs are read from and written to task_cache; tasks from
+    from_task onwards (in crew order) are always re-executed. document_path
+    is passed to save_report_document. A failed crew run is returned as an
+    LLMError in the result, and any other failure as a ReportGenerationError;
+    only an unknown from_task raises (UnknownTaskError), before the crew runs.
+    """
+    result = GenerationResult()
+    started = time.perf_counter()
     try:
-        crew_generator = MedicalReportGenerator()
-        crew = crew_generator.crew()
+        with crew_pool.checkout() as crew_generator:
+            report_text = run_crew(
+                crew_generator, inputs, task_cache, from_task, event_listener, result
+            )
+    except ReportGenerationError as e:
+        result.error = e
+    except UnknownTaskError:
+        raise
+    except Exception as e:
+        result.error = ReportGenerationError(
+            f"Préparation de l'équipe impossible : {type(e).__name__}: {e}"
+        )
+        result.error.__cause__ = e
 
-        # Kick off the crew process
-        print("\nDémarrage du processus de l'équipe...")
-        # Call str() on the result to get the final text output
-        result = str(crew.kickoff(inputs=inputs))
+    if result.error is None:
         print("\nProcessus de l'équipe terminé.")
 
         print("\n## Texte du Compte Rendu Généré:")
-        print(result)
+        print(report_text)
         print("-------------------------------")
-
-        current_file_path = Path(__file__).resolve()
-        project_root = current_file_path.parent.parent.parent
-        unique_name = datetime.now().strftime("radiology_report_%Y-%m-%d-%H-%M-%S.docx")
-        generated_report_path_absolute = (
-            project_root / "generated" / "reports" / unique_name
-        )
-        generated_report_path_relative = Path("generated") / "reports" / unique_name
+        print_timeline(result.timeline)
+        print_metrics(result.metrics)
+        if task_cache.hits:
+            print(f"Tâches reprises du cache : {', '.join(task_cache.hits)}")
 
         # Generate the .doc file from the final report text
-        document_generation_status = create_word_document(
-            result, filename=generated_report_path_absolute
-        )
-
-        # If successful, replace the absolute path with the relative path string in the return value
-        if document_generation_status["is_generated"]:
-            document_generation_status["filename"] = str(generated_report_path_relative)
+        save_report_document(report_text, document_path, result)
+    result.timings["total"] = time.perf_counter() - started
+    return result
+
+
+def run_crew(
+    crew_generator: MedicalReportGenerator,
+    inputs: dict,
+    task_cache: TaskOutputCache,
+    from_task: str,
+    event_listener,
+    result: GenerationResult,
+) -> str:
+    """
+    Runs a checked-out crew instance and returns the report text.
 
-        return document_generation_status
+    The classification and crew timings, the task timeline and the run
+    metrics are recorded in result; a failed crew run raises LLMError.
+    """
+    started = time.perf_counter()
+    crew_generator.task_cache = task_cache
+    crew_generator.event_listener = event_listener
+    # Keyword classification first: the LLM classifier only runs when it is uncertain
+    inputs = crew_generator.prepare_inputs(inputs)
+    result.timings["classification"] = time.perf_counter() - started
+    crew = crew_generator.build_crew()
+
+    if from_task:
+        task_names = [crew_task.name for crew_task in crew.tasks]
+        if from_task not in task_names:
+            raise UnknownTaskError(
+                f"Tâche inconnue : {from_task}. Tâches : {', '.join(task_names)}"
+            )
+        task_cache.refresh = set(task_names[task_names.index(from_task) :])
 
+    # Kick off the crew process
+    print("\nDémarrage du processus de l'équipe...")
+    crew_started = time.perf_counter()
+    try:
+        # Call str() on the result to get the final text output
+        return str(crew.kickoff(inputs=inputs))
     except Exception as e:
-        # Print a more informative error message including the exception type
-        print(
-            f"\nUne erreur s'est produite lors de l'exécution de l'équipe ou de la génération du document : {type(e).__name__}: {e}",
-            file=sys.stderr,
-        )
-        sys.exit(1)  # Exit with a non-zero code to indicate an error
+        raise LLMError(f"Échec de l'exécution de l'équipe : {type(e).__name__}: {e}") from e
+    finally:
+        result.timings["crew"] = time.perf_counter() - crew_started
+        # Avant la remise à zéro de l'instance, à son retour dans le pool
+        result.timeline = crew_generator.timeline()
+        if crew_generator.metrics is not None:
+            result.metrics = crew_generator.metrics.records
+
+
+def task_output_cache(**kwargs) -> TaskOutputCache:
+    """The on-disk task output cache of the project (generated/task_cache)."""
+    project_root = Path(__file__).resolve().parent.parent.parent
+    return TaskOutputCache(project_root / "generated" / "task_cache", **kwargs)
 
 
 # Keep the other functions as placeholders
@@ -199,22 +389,360 @@ def train():
     print("Adjust the train function based on CrewAI and LLM provider documentation.")
 
 
-def replay():
+def replay(from_task: str = None):
     """
-    Replay the crew execution from a specific task.
-    Note: Replay requires logging and persistence setup in CrewAI.
+    Replay the last run from the task output cache.
+    Only the tasks whose configuration or inputs changed since (for instance
+    an edited prompt in tasks.yaml) are executed again, as well as every
+    task from from_task onwards when it is given.
+    """
+    print("## Relecture de la dernière exécution")
+    print("-------------------------------")
+
+    task_cache = task_output_cache()
+    inputs = task_cache.load_inputs()
+    if inputs is None:
+        print(f"Aucune exécution précédente trouvée dans {task_cache.directory}")
+        return None
+
+    try:
+        result = generate_report(inputs, task_cache, from_task)
+    except UnknownTaskError as e:
+        print(f"\n{e}", file=sys.stderr)
+        return None
+    report_error(result)
+    return result
+
+
+def load_batch_inputs(source) -> list:
     """
+    Reads the dictations of a batch as (name, prompt) pairs.
+
+    source is a directory of .txt files (one dictation per file, named after
+    the file) or a JSONL file whose lines are either a JSON string or an
+    object with "prompt_text" (or "prompt") and an optional "name".
+    """
+    source = Path(source)
+    if source.is_dir():
+        return [
+            (txt_file.stem, txt_file.read_text(encoding="utf-8"))
+            for txt_file in sorted(source.glob("*.txt"))
+        ]
+
+    batch_inputs = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"prompt_text": item}
+            prompt = item.get("prompt_text", item.get("prompt"))
+            if not prompt:
+                raise ValueError(f"{source}:{line_number} : dictée manquante")
+            batch_inputs.append((str(item.get("name", f"{len(batch_inputs) + 1:03d}")), prompt))
+    return batch_inputs
+
+
+def generate_batch(
+    batch_inputs: list, concurrency: int = None, no_cache: bool = False
+) -> dict:
+    """
+    Generates one report per (name, prompt) pair, concurrency crews at a time.
+
+    The reports are saved in generated/batches/<date>/ as <name>.docx, next to
+    a manifest.json listing, for each input, its status, file, error and
+    duration, and the throughput of the batch. A failed input does not stop
+    the others. The crews share the knowledge base, its indexes and the
+    classifier vocabulary, which are loaded once per process. The returned
+    manifest also holds the GenerationResult of each input, under "results".
+    """
+    concurrency = max(1, concurrency or int(os.getenv("BATCH_CONCURRENCY", "4")))
+    project_root = Path(__file__).resolve().parent.parent.parent
+    batch_directory = Path("generated") / "batches" / datetime.now().strftime(
+        "%Y-%m-%d-%H-%M-%S-%f"
+    )
+    (project_root / batch_directory).mkdir(parents=True, exist_ok=True)
+
+    # Noms de fichiers uniques, même si deux entrées portent le même nom
+    document_names = []
+    for name, _ in batch_inputs:
+        document_name = re.sub(r"[^\w.-]+", "_", name) or "rapport"
+        while document_name in document_names:
+            document_name += "_"
+        document_names.append(document_name)
+
+    def generate_one(position: int) -> GenerationResult:
+        name = batch_inputs[position][0]
+        result = generate_report(
+            {"raw_input": batch_inputs[position][1]},
+            task_output_cache(read=not no_cache),
+            document_path=batch_directory / f"{document_names[position]}.docx",
+        )
+        print(
+            f"[{position + 1}/{len(batch_inputs)}] {name} : "
+            f"{'généré' if result.is_generated else 'échec'} en {result.timings['total']:.1f} s"
+        )
+        return result
+
+    started_at = datetime.now()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(generate_one, range(len(batch_inputs))))
+    duration = time.perf_counter() - started
+
+    entries = [
+        {
+            "name": name,
+            "prompt_text": prompt,
+            "is_generated": result.is_generated,
+            "filename": result.filename,
+            "error": result.error_message,
+            "duration": result.timings["total"],
+            "timings": result.timings,
+        }
+        for (name, prompt), result in zip(batch_inputs, results)
+    ]
+
+    succeeded = sum(1 for entry in entries if entry["is_generated"])
+    manifest = {
+        "started_at": started_at.isoformat(),
+        "duration": duration,
+        "concurrency": concurrency,
+        "count": len(entries),
+        "succeeded": succeeded,
+        "failed": len(entries) - succeeded,
+        "reports_per_minute": succeeded * 60 / duration if duration > 0 else 0.0,
+        "directory": str(batch_directory),
+        # Attente de quota et nouveaux essais cumulés du processus, pour régler la concurrence
+        "llm": rate_limiter.stats(),
+        "items": entries,
+    }
+    manifest_path = project_root / batch_directory / "manifest.json"
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    manifest["manifest"] = str(batch_directory / "manifest.json")
+    manifest["results"] = results
+    return manifest
+
+
+def batch(source: str = None, concurrency: int = None, no_cache: bool = False):
+    """
+    Generate the reports of a batch of dictations (a directory of .txt files
+    or a JSONL file), see generate_batch.
+    """
+    print("## Génération d'un lot de comptes rendus")
+    print("-------------------------------")
+
+    if source is None:
+        print("Usage : main.py batch <dossier de .txt | fichier .jsonl> [concurrence]")
+        sys.exit(1)
+    try:
+        batch_inputs = load_batch_inputs(source)
+    except (OSError, ValueError) as e:
+        print(f"Erreur : lecture du lot {source} impossible : {e}", file=sys.stderr)
+        sys.exit(1)
+    if not batch_inputs:
+        print(f"Aucune dictée trouvée dans {source}")
+        return None
+
+    manifest = generate_batch(batch_inputs, concurrency, no_cache)
     print(
-        "La relecture de l'équipe n'est pas complètement implémentée ou testée avec cette configuration."
+        f"\n{manifest['succeeded']}/{manifest['count']} comptes rendus générés en "
+        f"{manifest['duration']:.1f} s ({manifest['reports_per_minute']:.1f} par minute, "
+        f"concurrence {manifest['concurrency']})"
     )
-    print("Adjust the replay function based on CrewAI documentation.")
+    print(f"Manifeste : {manifest['manifest']}")
+    return manifest
 
 
-def test():
+def build_index():
+    """
+    Rebuild the prebuilt TF-IDF index of the RAG knowledge base.
+    The index is saved next to the knowledge base and loaded at startup by the RAG tool.
+    """
+    print("## Reconstruction de l'index de la base de connaissances")
+    print("-------------------------------")
+
+    project_root = Path(__file__).resolve().parent.parent.parent
+    knowledge_base_path = project_root / MedicalReportGenerator.knowledge_base_path
+
+    rag_tool = RAGMedicalReportsTool(knowledge_base_path=str(knowledge_base_path))
+    index = rag_tool.rebuild_index()
+    print(f"{len(index)} rapports indexés dans {rag_tool.index_path}")
+
+
+# Invite utilisée quand un rapport de test n'a pas d'indication
+TEST_FALLBACK_PROMPT = (
+    "Patiente consultant pour des douleurs pelviennes et suspicion d'endométriose."
+)
+
+
+def extract_test_prompt(report_text: str) -> str:
+    """
+    The prompt given to the crew for a test report: its "Indication:"
+    section, or TEST_FALLBACK_PROMPT when the section is missing or empty.
+    """
+    prompt_input = parse_sections(report_text).get("Indication", "", separator=" ")
+    return prompt_input or TEST_FALLBACK_PROMPT
+
+
+def write_test_comparison(path: Path, prompt: str, generated_text: str, reference_text: str):
+    """Writes the prompt, the generated report and the ground truth side by side."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("--- INVITE UTILISÉE ---\n")
+        f.write(prompt + "\n\n")
+        f.write("--- COMPTE RENDU GÉNÉRÉ ---\n")
+        f.write(generated_text + "\n\n")
+        f.write("--- COMPTE RENDU DE RÉFÉRENCE (GROUND TRUTH) ---\n")
+        f.write(reference_text)
+
+
+def score_test_report(generated_text: str, reference_text: str) -> dict:
+    """Per-section scores of a generated report against its ground truth (see score_sections)."""
+    return score_sections(
+        parse_report_sections(clean_report_text(generated_text)),
+        parse_report_sections(reference_text),
+        REPORT_SECTION_HEADERS,
+    )
+
+
+def _score(value) -> str:
+    return "     -" if value is None else f"{value:6.3f}"
+
+
+def format_section_scores(section: str, scores: dict) -> str:
+    """One line of section scores; presence_agreement is a bool or a rate."""
+    agreement = scores["presence_agreement"]
+    if isinstance(agreement, bool):
+        presence = "identique" if agreement else "différente"
+    else:
+        presence = f"identique {agreement:.0%}"
+    return (
+        f"{section:<12} ROUGE-L {_score(scores['rouge_l'])}  "
+        f"F1 {_score(scores['token_f1'])}  présence {presence}"
+    )
+
+
+def evaluate_testing_set(concurrency: int = None, no_cache: bool = False) -> dict:
+    """
+    Generates every report of the testing set and scores it against its ground truth.
+
+    The reports are generated concurrency crews at a time (default
+    BATCH_CONCURRENCY) with the prompt of extract_test_prompt. For each one,
+    the sections are compared with those of the ground truth (ROUGE-L, token
+    F1, presence agreement), and the keyword classifier is run on the prompt
+    and on the ground truth and compared with the type expected in
+    knowledge/testing_report_types.yaml. The scorecard, with the latency of
+    each stage, is written to generated/testing_outputs/scorecard_<date>.json,
+    next to the .docx and the .txt comparison of each report, and returned.
+    """
+    concurrency = max(1, concurrency or int(os.getenv("BATCH_CONCURRENCY", "4")))
+    project_root = Path(__file__).resolve().parent.parent.parent
+    test_reports_path = project_root / "knowledge" / "reports" / "testing"
+    output_directory = Path("generated") / "testing_outputs"
+    (project_root / output_directory).mkdir(parents=True, exist_ok=True)
+
+    test_files = sorted(test_reports_path.glob("*.txt"))
+    if not test_files:
+        raise ValueError(f"Aucun fichier de test trouvé dans {test_reports_path}")
+    expected_types = load_expected_report_types(project_root / DEFAULT_LABELS_PATH)
+    classifier = MedicalReportClassifierTool()
+
+    def evaluate_one(test_file: Path) -> dict:
+        reference_text = test_file.read_text(encoding="utf-8")
+        prompt = extract_test_prompt(reference_text)
+        result = generate_report(
+            {"raw_input": prompt},
+            task_output_cache(read=not no_cache),
+            document_path=output_directory / f"generated_{test_file.stem}.docx",
+        )
+        sections = None
+        if result.report_text is not None:
+            write_test_comparison(
+                project_root / output_directory / f"generated_{test_file.stem}.txt",
+                prompt,
+                result.report_text,
+                reference_text,
+            )
+            sections = score_test_report(result.report_text, reference_text)
+        print(
+            f"{test_file.stem} : {'généré' if result.is_generated else 'échec'} "
+            f"en {result.timings['total']:.1f} s"
+        )
+        return {
+            "name": test_file.stem,
+            "prompt_text": prompt,
+            "filename": result.filename,
+            "error": result.error_message,
+            "timings": result.timings,
+            "sections": sections,
+            "classification": {
+                "expected": expected_types.get(test_file.stem),
+                "prompt": classifier.classify(prompt)[0],
+                "reference": classifier.classify(reference_text)[0],
+            },
+        }
+
+    started_at = datetime.now()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        items = list(executor.map(evaluate_one, test_files))
+    duration = time.perf_counter() - started
+
+    scorecard = build_scorecard(items)
+    scorecard.update(
+        started_at=started_at.isoformat(),
+        duration=duration,
+        concurrency=concurrency,
+        reports_per_minute=scorecard["generated"] * 60 / duration if duration > 0 else 0.0,
+        config_version=MedicalReportGenerator.config_version(),
+        items=items,
+    )
+    scorecard_path = output_directory / f"scorecard_{started_at.strftime('%Y-%m-%d-%H-%M-%S')}.json"
+    with open(project_root / scorecard_path, "w", encoding="utf-8") as f:
+        json.dump(scorecard, f, ensure_ascii=False, indent=2)
+    scorecard["scorecard"] = str(scorecard_path)
+    return scorecard
+
+
+def print_scorecard(scorecard: dict):
+    """Prints the quality and latency figures of a scorecard."""
+    print(
+        f"\n## Évaluation : {scorecard['generated']}/{scorecard['count']} comptes rendus générés "
+        f"en {scorecard['duration']:.1f} s ({scorecard['reports_per_minute']:.1f} par minute)"
+    )
+    for section, scores in scorecard["sections"].items():
+        print(format_section_scores(section, scores))
+    if scorecard["overall"]["presence_agreement"] is not None:
+        print(format_section_scores("Global", scorecard["overall"]))
+    for source, label in (("prompt", "invite"), ("reference", "rapport de référence")):
+        classification = scorecard["classification"][source]
+        if classification["accuracy"] is not None:
+            print(
+                f"Classification ({label}) : {classification['correct']}/"
+                f"{classification['labelled']} ({classification['accuracy']:.0%})"
+            )
+    for stage, latency in scorecard["latency"].items():
+        if latency:
+            print(f"Latence {stage:<15} p50 {latency['p50']:7.2f} s  p95 {latency['p95']:7.2f} s")
+    print(f"Tableau de bord : {scorecard['scorecard']}")
+
+
+def test(evaluate: bool = False, concurrency: int = None, no_cache: bool = False):
     """
     Test the crew execution with sample reports from the testing set.
     Evaluates the model's performance on previously unseen examples.
+    By default one random test report is generated and scored; with
+    evaluate, the whole testing set is (see evaluate_testing_set).
     """
+    if evaluate:
+        print("## Évaluation du Générateur de Compte Rendu Médical")
+        print("-------------------------------")
+        scorecard = evaluate_testing_set(concurrency, no_cache)
+        print_scorecard(scorecard)
+        return scorecard
+
     print("## Test du Générateur de Compte Rendu Médical")
     print("-------------------------------")
 
@@ -246,33 +774,11 @@ def test():
         with open(selected_test_file, "r", encoding="utf-8") as f:
             ground_truth_report_text = f.read()
 
-        prompt_input = ""
-        lines = ground_truth_report_text.splitlines()
-        capture = False
-        # Extract "Indication:" section as prompt, case-insensitive, for French
-        for line in lines:
-            stripped_line = line.strip()
-            if stripped_line.upper().startswith("INDICATION:"):
-                prompt_input += stripped_line[len("INDICATION:") :].strip() + " "
-                capture = True
-            elif capture and not any(
-                sh.upper() in stripped_line.upper()
-                for sh in ["TECHNIQUE:", "INCIDENCES:", "RÉSULTAT:", "CONCLUSION:"]
-            ):
-                if stripped_line:
-                    prompt_input += stripped_line + " "
-            elif capture and any(
-                sh.upper() in stripped_line.upper()
-                for sh in ["TECHNIQUE:", "INCIDENCES:", "RÉSULTAT:", "CONCLUSION:"]
-            ):
-                break
-        prompt_input = prompt_input.strip()
-
-        if not prompt_input:
+        prompt_input = extract_test_prompt(ground_truth_report_text)
+        if prompt_input == TEST_FALLBACK_PROMPT:
             print(
                 f"Avertissement : Impossible d'extraire l'indication pour {selected_test_file.name}. Utilisation d'une invite générique."
             )
-            prompt_input = "Patiente consultant pour des douleurs pelviennes et suspicion d'endométriose."  # Generic French fallback
 
         print(f"\nInvite générée pour l'équipe :\n{prompt_input}")
         print("-------------------------------")
@@ -280,6 +786,7 @@ def test():
         inputs = {"raw_input": prompt_input}
         # Use the full crew for testing
         crew_generator = MedicalReportGenerator()
+        inputs = crew_generator.prepare_inputs(inputs)
         crew = crew_generator.crew()
 
         print("\nDémarrage du processus de l'équipe pour le test...")
@@ -288,6 +795,7 @@ def test():
         print("\n## Texte du Compte Rendu Généré (Test):")
         print(generated_report_text)
         print("-------------------------------")
+        print_timeline(crew_generator.timeline())
 
         generated_report_filename_docx = (
             output_test_reports_path / f"generated_{selected_test_file.stem}.docx"
@@ -300,23 +808,24 @@ def test():
             generated_report_text, filename=str(generated_report_filename_docx)
         )
 
-        with open(generated_report_filename_txt, "w", encoding="utf-8") as f:
-            f.write("--- INVITE UTILISÉE ---\n")
-            f.write(prompt_input + "\n\n")
-            f.write("--- COMPTE RENDU GÉNÉRÉ ---\n")
-            f.write(generated_report_text + "\n\n")
-            f.write("--- COMPTE RENDU DE RÉFÉRENCE (GROUND TRUTH) ---\n")
-            f.write(ground_truth_report_text)
+        write_test_comparison(
+            generated_report_filename_txt,
+            prompt_input,
+            generated_report_text,
+            ground_truth_report_text,
+        )
         print(
             f"Rapport de test (comparaison) sauvegardé en .txt : {generated_report_filename_txt}"
         )
 
-        print("\n## Comparaison (Manuelle pour l'instant):")
+        print("\n## Comparaison:")
         print(f"Rapport original (vérité terrain) : {selected_test_file.name}")
         print(
             f"Le rapport généré a été sauvegardé ici : {generated_report_filename_docx}"
         )
-        print("Veuillez comparer manuellement le contenu et la structure.")
+        section_scores = score_test_report(generated_report_text, ground_truth_report_text)
+        for section, scores in section_scores.items():
+            print(format_section_scores(section, scores))
         print("-------------------------------")
 
     except FileNotFoundError:
@@ -333,16 +842,28 @@ if __name__ == "__main__":
     if len(sys.argv) > 1:
         command = sys.argv[1].lower()
         if command == "run":
-            run()
+            if not run().is_generated:
+                sys.exit(1)
         elif command == "train":
             train()
         elif command == "replay":
-            replay()
+            replay(sys.argv[2] if len(sys.argv) > 2 else None)
         elif command == "test":
-            test()
+            if len(sys.argv) > 2 and sys.argv[2].lower() == "evaluate":
+                test(True, int(sys.argv[3]) if len(sys.argv) > 3 else None)
+            else:
+                test()
+        elif command == "build_index":
+            build_index()
+        elif command == "batch":
+            batch(
+                sys.argv[2] if len(sys.argv) > 2 else None,
+                int(sys.argv[3]) if len(sys.argv) > 3 else None,
+            )
         else:
             print(f"Commande inconnue : {command}")
-            print("Commandes disponibles : run, test, train, replay")
+            print("Commandes disponibles : run, test, train, replay, build_index, batch")
     else:
         print("Aucune commande fournie. Exécution de la commande 'run' par défaut.")
-        run()  # Default command
+        if not run().is_generated:  # Default command
+            sys.exit(1)
@@ -0,0 +1,152 @@
+import math
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+class RunMetrics:
+    """Measurements of one crew run, collected from its events.
+
+    Each record is a dict with a ``kind`` (``task``, ``llm``, ``tool`` or
+    ``retrieval``), a ``name`` (the task, or the tool), the ``agent`` when
+    known, a ``duration`` in seconds and, for LLM calls, the prompt and
+    completion tokens. Events come from the threads of concurrent tasks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records: List[Dict] = []
+
+    def _add(
+        self,
+        kind: str,
+        name: Optional[str],
+        duration: Optional[float],
+        agent: Optional[str] = None,
+        prompt_tokens: Optional[int] = None,
+        completion_tokens: Optional[int] = None,
+    ) -> None:
+        if duration is None:
+            return
+        with self._lock:
+            self._records.append(
+                {
+                    "kind": kind,
+                    "name": name or "inconnu",
+                    "agent": agent,
+                    "duration": duration,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                }
+            )
+
+    def observe(self, event: Dict) -> None:
+        """Records the measurements carried by an event of the run, if any."""
+        name = event.get("event")
+        if name == "task_completed":
+            self._add("task", event.get("task"), event.get("duration"), event.get("agent"))
+        elif name == "llm_call":
+            self._add(
+                "llm",
+                event.get("task"),
+                event.get("duration"),
+                event.get("agent"),
+                event.get("prompt_tokens"),
+                event.get("completion_tokens"),
+            )
+        elif name == "tool_call":
+            self._add("tool", event.get("tool"), event.get("duration"), event.get("agent"))
+            self._add("retrieval", event.get("tool"), event.get("retrieval"), event.get("agent"))
+
+    @property
+    def records(self) -> List[Dict]:
+        with self._lock:
+            return list(self._records)
+
+
+def summarize_metrics(records: List[Dict]) -> Dict:
+    """Totals of a run's records: LLM calls and tokens per agent, calls per tool."""
+    llm_calls: Dict[str, Dict] = {}
+    tool_calls: Dict[str, Dict] = {}
+    for record in records:
+        if record["kind"] == "llm":
+            totals = llm_calls.setdefault(
+                record["agent"] or "inconnu",
+                {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0},
+            )
+            totals["calls"] += 1
+            totals["prompt_tokens"] += record["prompt_tokens"] or 0
+            totals["completion_tokens"] += record["completion_tokens"] or 0
+        elif record["kind"] == "tool":
+            totals = tool_calls.setdefault(record["name"], {"calls": 0, "duration": 0.0})
+            totals["calls"] += 1
+            totals["duration"] += record["duration"]
+    return {"llm_calls": llm_calls, "tool_calls": tool_calls}
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Linear interpolation between the closest ranks of already sorted values."""
+    position = (len(sorted_values) - 1) * fraction
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (
+        position - lower
+    )
+
+
+def distribution(values: Iterable[float]) -> Optional[Dict]:
+    """Count, mean, p50, p95, p99 and max of the values (None if there are none)."""
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": values[-1],
+    }
+
+
+def _measure(results: Dict, path: Tuple[str, ...]) -> Optional[float]:
+    for key in path:
+        if not isinstance(results, dict) or results.get(key) is None:
+            return None
+        results = results[key]
+    return results
+
+
+def compare_measures(
+    current: Dict,
+    baseline: Dict,
+    measures: Sequence[Tuple[Tuple[str, ...], bool]],
+    tolerance: float = 0.10,
+) -> List[Dict]:
+    """The measures that got worse than the baseline by more than tolerance.
+
+    ``measures`` lists (path of the value in the results, higher is better);
+    a measure missing from either result is skipped.
+    """
+    regressions = []
+    for path, higher_is_better in measures:
+        value, reference = _measure(current, path), _measure(baseline, path)
+        if value is None or not reference:
+            continue
+        change = (value - reference) / reference
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(
+                {"measure": ".".join(path), "baseline": reference, "current": value, "change": change}
+            )
+    return regressions
+
+
+def print_regressions(regressions: List[Dict], baseline_path: str, tolerance: float) -> None:
+    if not regressions:
+        print(f"\nAucune régression au-delà de {tolerance:.0%} par rapport à {baseline_path}")
+        return
+    print(f"\n## Régressions par rapport à {baseline_path}:")
+    for regression in regressions:
+        print(
+            f"{regression['measure']} : {regression['baseline']:.4f} -> "
+            f"{regression['current']:.4f} ({regression['change']:+.0%})"
+        )
@@ -0,0 +1,373 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from medical_report_generator.metrics import compare_measures, distribution, print_regressions
+from medical_report_generator.tools import (
+    MedicalReportClassifierTool,
+    RAGMedicalReportsTool,
+)
+from medical_report_generator.tools.knowledge_base import (
+    KnowledgeBase,
+    default_backend,
+    extract_report_type_from_filename,
+    read_report,
+)
+
+try:
+    import resource
+except ImportError:  # Windows : pas de getrusage, la mémoire n'est pas mesurée
+    resource = None
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+TRAINING_REPORTS_PATH = PROJECT_ROOT / "knowledge" / "reports" / "training"
+VOCABULARY_PATH = PROJECT_ROOT / "knowledge" / "report_type_keywords.yaml"
+BENCHMARKS_PATH = PROJECT_ROOT / "generated" / "benchmarks"
+
+DEFAULT_SCALES = (1_000, 10_000, 100_000)
+
+# Sections écrites dans les rapports synthétiques, dans l'ordre des rapports réels
+SYNTHETIC_SECTIONS = ("Indication", "Technique", "Incidences", "Résultat", "Conclusion")
+
+# Opérations chronométrées par requête, dans l'ordre d'affichage
+OPERATIONS = (
+    "get_all_reports",
+    "read_report",
+    "filter_reports_by_type",
+    "calculate_similarity",
+    "rag_run",
+    "classifier_run",
+)
+
+
+def _sentences(text: str) -> List[str]:
+    return [sentence for sentence in re.split(r"(?<=[.!?])\s+", text) if sentence.strip()]
+
+
+def _read_text(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def load_sentence_pools(
+    training_path: Path = TRAINING_REPORTS_PATH,
+) -> Dict[str, Dict[str, List[str]]]:
+    """Sentences of each section of the real knowledge base, per report type.
+
+    The ``""`` type pools the sentences of all types, for the sections a
+    type has no sentence for.
+    """
+    pools: Dict[str, Dict[str, List[str]]] = {"": {section: [] for section in SYNTHETIC_SECTIONS}}
+    for file_path in sorted(Path(training_path).glob("*.txt")):
+        report_type = extract_report_type_from_filename(file_path.name)
+        if not report_type:
+            continue
+        content = read_report(str(file_path))
+        type_pools = pools.setdefault(report_type, {section: [] for section in SYNTHETIC_SECTIONS})
+        for section in SYNTHETIC_SECTIONS:
+            sentences = _sentences(content.get(section, ""))
+            type_pools[section].extend(sentences)
+            pools[""][section].extend(sentences)
+    if len(pools) == 1:
+        raise ValueError(f"Aucun rapport exploitable dans {training_path}")
+    return pools
+
+
+def generate_corpus(
+    directory: Path,
+    count: int,
+    pools: Dict[str, Dict[str, List[str]]],
+    seed: int = 0,
+) -> Path:
+    """Writes count synthetic reports ``irm_<type>_<n>.txt`` in directory.
+
+    Each report takes a type of the knowledge base in turn and, for each
+    section, one to three sentences drawn from the reports of that type,
+    so the vocabulary and the type partitions look like the real corpus.
+    A directory already holding count reports is reused as is.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    if sum(1 for name in os.listdir(directory) if name.endswith(".txt")) == count:
+        return directory
+    rng = random.Random(seed)
+    report_types = sorted(report_type for report_type in pools if report_type)
+    for n in range(count):
+        report_type = report_types[n % len(report_types)]
+        lines = [f"TITRE: IRM {report_type.replace('_', ' ').upper()}"]
+        for section in SYNTHETIC_SECTIONS:
+            pool = pools[report_type][section] or pools[""][section]
+            content = " ".join(rng.sample(pool, min(len(pool), rng.randint(1, 3))))
+            lines.append(f"{section}:")
+            lines.append(content)
+            lines.append("")
+        (directory / f"irm_{report_type}_{n:06d}.txt").write_text(
+            "\n".join(lines), encoding="utf-8"
+        )
+    return directory
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of the current process, in MiB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Octets sous macOS, kilo-octets sous Linux
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _timed(function, arguments: Sequence, repeat: int) -> Optional[Dict]:
+    durations = []
+    for _ in range(repeat):
+        for argument in arguments:
+            started = time.perf_counter()
+            function(*argument)
+            durations.append(time.perf_counter() - started)
+    return distribution(durations)
+
+
+def benchmark_scale(
+    corpus_directory: str, queries: int = 50, repeat: int = 3, backend: Optional[str] = None
+) -> Dict:
+    """Load times, per-call latencies and peak RSS on one synthetic corpus.
+
+    Meant to run in a fresh process (see :func:`run_microbenchmark`), so the
+    peak RSS is that of this corpus alone. The cold load parses the corpus
+    and fits the indexes from scratch; the warm load is that of a restarted
+    process, which parses the corpus again but loads the saved indexes. The
+    files stay in the OS page cache in both cases.
+    """
+    corpus_directory = Path(corpus_directory)
+    with tempfile.TemporaryDirectory(prefix="microbenchmark_index_") as index_directory:
+        baseline_rss = peak_rss_mb()
+        started = time.perf_counter()
+        KnowledgeBase(corpus_directory, index_directory, backend=backend).load()
+        cold_load = time.perf_counter() - started
+
+        started = time.perf_counter()
+        rag_tool = RAGMedicalReportsTool(
+            knowledge_base_path=str(corpus_directory), index_path=index_directory, backend=backend
+        )
+        warm_load = time.perf_counter() - started
+        loaded_rss = peak_rss_mb()
+        # Les appels mesurent la méthode, pas le parcours du répertoire de refresh_if_due
+        rag_tool._knowledge_base.refresh_interval = float("inf")
+
+        started = time.perf_counter()
+        classifier = MedicalReportClassifierTool(vocabulary_path=VOCABULARY_PATH)
+        classifier._run("IRM")
+        classifier_load = time.perf_counter() - started
+
+        rng = random.Random(0)
+        reports = rag_tool._knowledge_base.reports
+        sample = rng.sample(reports, min(queries, len(reports)))
+        cases = [
+            (report["path"], report["type"], report["content"].get("Indication", ""))
+            for report in sample
+        ]
+        all_reports = rag_tool._get_all_reports()
+        filtered = {
+            report_type: rag_tool._filter_reports_by_type(all_reports, report_type)
+            for report_type in {report_type for _, report_type, _ in cases}
+        }
+
+        started = time.perf_counter()
+        rag_tool._knowledge_base.refresh()
+        refresh = time.perf_counter() - started
+
+        latencies = {
+            "get_all_reports": _timed(rag_tool._get_all_reports, [()], repeat),
+            "read_report": _timed(rag_tool._read_report, [(path,) for path, _, _ in cases], repeat),
+            "filter_reports_by_type": _timed(
+                rag_tool._filter_reports_by_type,
+                [(all_reports, report_type) for _, report_type, _ in cases],
+                repeat,
+            ),
+            # Copies : _calculate_similarity écrit la similarité dans les rapports
+            "calculate_similarity": _timed(
+                lambda query, report_type: rag_tool._calculate_similarity(
+                    query, [dict(report) for report in filtered[report_type]]
+                ),
+                [(query, report_type) for _, report_type, query in cases],
+                repeat,
+            ),
+            "rag_run": _timed(
+                rag_tool._run, [(query, report_type) for _, report_type, query in cases], repeat
+            ),
+            "classifier_run": _timed(
+                classifier._run, [(_read_text(path),) for path, _, _ in cases], repeat
+            ),
+        }
+        return {
+            "reports": len(reports),
+            "queried_types": len(filtered),
+            "partition_size": distribution(len(partition) for partition in filtered.values()),
+            "load": {
+                "cold": cold_load,
+                "warm": warm_load,
+                "refresh_unchanged": refresh,
+                "classifier": classifier_load,
+            },
+            "latency": latencies,
+            "memory": {
+                "baseline_rss_mb": baseline_rss,
+                "loaded_peak_rss_mb": loaded_rss,
+                "peak_rss_mb": peak_rss_mb(),
+            },
+        }
+
+
+def compared_measures(results: Dict) -> List:
+    """(path, higher is better) of the measures compared between two runs, for each scale."""
+    measures = []
+    for scale in results["scales"]:
+        measures += [
+            (("scales", scale, "load", "cold"), False),
+            (("scales", scale, "load", "warm"), False),
+            (("scales", scale, "memory", "peak_rss_mb"), False),
+        ]
+        measures += [
+            (("scales", scale, "latency", operation, statistic), False)
+            for operation in OPERATIONS
+            for statistic in ("p50", "p95")
+        ]
+    return measures
+
+
+def run_microbenchmark(
+    scales: Sequence[int] = DEFAULT_SCALES,
+    queries: int = 50,
+    repeat: int = 3,
+    seed: int = 0,
+    backend: Optional[str] = None,
+    corpus_directory: Optional[Path] = None,
+    output: Optional[Path] = None,
+) -> Dict:
+    """
+    Benchmarks the retrieval and classification hot paths on synthetic corpora.
+
+    For each scale, a corpus of that many synthetic reports is generated
+    (in corpus_directory/<scale> to keep it between runs, or in a temporary
+    directory) and measured by :func:`benchmark_scale` in a new process.
+    The results are written as JSON to ``output`` (by default
+    generated/benchmarks/micro_<date>.json) and returned.
+    """
+    started_at = datetime.now()
+    output = Path(
+        output or BENCHMARKS_PATH / f"micro_{started_at.strftime('%Y-%m-%d-%H-%M-%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    backend = backend or default_backend()
+    pools = load_sentence_pools()
+
+    results = {
+        "started_at": started_at.isoformat(),
+        "python": platform.python_version(),
+        "config": {"queries": queries, "repeat": repeat, "seed": seed, "rag_backend": backend},
+        "scales": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="microbenchmark_corpus_") as work_directory:
+        for scale in scales:
+            directory = Path(corpus_directory or work_directory) / str(scale)
+            print(f"\n## {scale} rapports synthétiques")
+            started = time.perf_counter()
+            generate_corpus(directory, scale, pools, seed)
+            print(f"Corpus prêt en {time.perf_counter() - started:.1f} s : {directory}")
+            # Un processus neuf par échelle : le pic de mémoire ne cumule pas les échelles
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                results["scales"][str(scale)] = executor.submit(
+                    benchmark_scale, str(directory), queries, repeat, backend
+                ).result()
+            print_scale(results["scales"][str(scale)])
+            if corpus_directory is None:
+                for file_name in os.listdir(directory):
+                    os.remove(directory / file_name)
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    results["output"] = str(output)
+    return results
+
+
+def print_scale(scale_results: Dict) -> None:
+    load, memory = scale_results["load"], scale_results["memory"]
+    print(
+        f"Chargement à froid {load['cold']:.2f} s, à chaud {load['warm']:.2f} s, "
+        f"rafraîchissement sans changement {load['refresh_unchanged']:.3f} s"
+    )
+    if memory["peak_rss_mb"] is not None:
+        print(
+            f"Mémoire (pic RSS) : {memory['baseline_rss_mb']:.0f} Mio avant chargement, "
+            f"{memory['peak_rss_mb']:.0f} Mio au total"
+        )
+    print(f"{'opération':<24} {'p50 (ms)':>10} {'p95 (ms)':>10} {'max (ms)':>10}")
+    for operation in OPERATIONS:
+        stats = scale_results["latency"][operation]
+        if stats:
+            print(
+                f"{operation:<24} {stats['p50'] * 1000:10.3f} "
+                f"{stats['p95'] * 1000:10.3f} {stats['max'] * 1000:10.3f}"
+            )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Micro-benchmarks de la recherche RAG et du classifieur sur corpus synthétiques."
+    )
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_SCALES),
+        help="nombres de rapports synthétiques",
+    )
+    parser.add_argument("--queries", type=int, default=50, help="requêtes mesurées par opération")
+    parser.add_argument("--repeat", type=int, default=3, help="passages des requêtes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", help="backend de recherche (RAG_BACKEND par défaut)")
+    parser.add_argument("--corpus-directory", help="répertoire où garder les corpus générés")
+    parser.add_argument("--output", help="fichier JSON des résultats")
+    parser.add_argument("--baseline", help="résultats JSON de référence à comparer")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.10, help="dégradation relative tolérée (0.10 = 10 %%)"
+    )
+    args = parser.parse_args(argv)
+
+    print("## Micro-benchmarks de la recherche et de la classification")
+    print("-------------------------------")
+    results = run_microbenchmark(
+        args.scales,
+        args.queries,
+        args.repeat,
+        args.seed,
+        args.backend,
+        Path(args.corpus_directory) if args.corpus_directory else None,
+        args.output,
+    )
+    print(f"\nRésultats : {results['output']}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_measures(
+                results, json.load(f), compared_measures(results), args.tolerance
+            )
+        print_regressions(regressions, args.baseline, args.tolerance)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
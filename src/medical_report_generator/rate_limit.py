@@ -0,0 +1,291 @@
+import copy
+import inspect
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from crewai import LLM
+from litellm.exceptions import (
+    APIConnectionError,
+    InternalServerError,
+    RateLimitError,
+    ServiceUnavailableError,
+    Timeout,
+)
+
+from medical_report_generator.tools.snippets import CHARS_PER_TOKEN
+
+# Erreurs transitoires du fournisseur, réessayées avec attente exponentielle
+RETRYABLE_ERRORS = (
+    RateLimitError,
+    ServiceUnavailableError,
+    InternalServerError,
+    APIConnectionError,
+    Timeout,
+)
+
+
+def estimate_tokens(messages: Any) -> int:
+    """Rough token count of a prompt (a string or a list of chat messages)."""
+    if isinstance(messages, str):
+        chars = len(messages)
+    else:
+        chars = sum(len(str(message.get("content") or "")) for message in messages or [])
+    return chars // CHARS_PER_TOKEN + 1
+
+
+class _UsageRecorder:
+    """litellm-style callback passed to LLM.call, keeping the token usage it reports."""
+
+    def __init__(self):
+        self.total_tokens: Optional[int] = None
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+
+    def log_success_event(self, kwargs, response_obj, start_time, end_time):
+        usage = response_obj.get("usage") if isinstance(response_obj, dict) else None
+        for name in ("total_tokens", "prompt_tokens", "completion_tokens"):
+            tokens = getattr(usage, name, None)
+            if tokens is not None:
+                setattr(self, name, (getattr(self, name) or 0) + tokens)
+
+
+class RateLimiter:
+    """Process-wide token buckets for LLM requests and tokens per minute.
+
+    Each call reserves one request and its estimated tokens, possibly putting
+    a bucket in debt, and sleeps until the debt is repaid by the refill: the
+    callers are served in arrival order and the provider sees at most
+    ``requests_per_minute`` requests and ``tokens_per_minute`` tokens per
+    minute on average. Once the call returns, the estimate is replaced by the
+    usage reported by the provider. Transient provider errors (rate limit,
+    unavailability, timeouts) are retried up to ``max_retries`` times with
+    full-jitter exponential backoff. A limit of 0 disables that bucket.
+    ``clock`` and ``sleep`` default to :func:`time.monotonic` and
+    :func:`time.sleep`.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        retry_base_delay: Optional[float] = None,
+        retry_max_delay: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.requests_per_minute = (
+            requests_per_minute
+            if requests_per_minute is not None
+            else float(os.getenv("LLM_REQUESTS_PER_MINUTE", "15"))
+        )
+        self.tokens_per_minute = (
+            tokens_per_minute
+            if tokens_per_minute is not None
+            else float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+        )
+        self.max_retries = (
+            max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", "5"))
+        )
+        self.retry_base_delay = (
+            retry_base_delay
+            if retry_base_delay is not None
+            else float(os.getenv("LLM_RETRY_BASE_DELAY", "2"))
+        )
+        self.retry_max_delay = (
+            retry_max_delay
+            if retry_max_delay is not None
+            else float(os.getenv("LLM_RETRY_MAX_DELAY", "60"))
+        )
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        # Les seaux démarrent pleins : une minute de quota disponible
+        self._requests = self.requests_per_minute
+        self._tokens = self.tokens_per_minute
+        self._refilled_at = self._clock()
+        self._metrics = {
+            "calls": 0,
+            "retries": 0,
+            "failures": 0,
+            "tokens": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def _refill(self) -> None:
+        now = self._clock()
+        elapsed_minutes = (now - self._refilled_at) / 60
+        self._refilled_at = now
+        self._requests = min(
+            self.requests_per_minute, self._requests + elapsed_minutes * self.requests_per_minute
+        )
+        self._tokens = min(
+            self.tokens_per_minute, self._tokens + elapsed_minutes * self.tokens_per_minute
+        )
+
+    def acquire(self, tokens: int) -> float:
+        """Reserves a request and ``tokens``, sleeping as long as needed; returns the wait."""
+        with self._lock:
+            self._refill()
+            wait = 0.0
+            if self.requests_per_minute > 0:
+                self._requests -= 1
+                wait = max(wait, -self._requests * 60 / self.requests_per_minute)
+            if self.tokens_per_minute > 0:
+                self._tokens -= tokens
+                wait = max(wait, -self._tokens * 60 / self.tokens_per_minute)
+            if wait > 0:
+                self._metrics["waits"] += 1
+                self._metrics["wait_seconds_total"] += wait
+                self._metrics["wait_seconds_max"] = max(self._metrics["wait_seconds_max"], wait)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+
+    def settle(self, reserved_tokens: int, used_tokens: int) -> None:
+        """Replaces a reservation by the tokens actually used."""
+        with self._lock:
+            if self.tokens_per_minute > 0:
+                self._tokens += reserved_tokens - used_tokens
+            self._metrics["tokens"] += used_tokens
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Full jitter: uniform between 0 and the exponential delay of the attempt."""
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2**attempt))
+
+    def call(
+        self,
+        request: Callable[[List], str],
+        estimated_tokens: int,
+        usage: Optional[_UsageRecorder] = None,
+    ) -> str:
+        """Runs ``request(callbacks)`` within the limits, retrying transient errors.
+
+        ``request`` receives extra LLM callbacks, used to read the token usage
+        (into ``usage`` when given).
+        """
+        usage = usage or _UsageRecorder()
+        attempt = 0
+        while True:
+            self.acquire(estimated_tokens)
+            try:
+                response = request([usage])
+            except RETRYABLE_ERRORS as e:
+                # La requête refusée a consommé du quota côté fournisseur : la réservation est gardée
+                if attempt >= self.max_retries:
+                    with self._lock:
+                        self._metrics["failures"] += 1
+                    raise
+                delay = self.backoff_delay(attempt)
+                attempt += 1
+                with self._lock:
+                    self._metrics["retries"] += 1
+                print(
+                    f"Appel LLM refusé ({type(e).__name__}), nouvel essai "
+                    f"{attempt}/{self.max_retries} dans {delay:.1f} s"
+                )
+                self._sleep(delay)
+                continue
+            used_tokens = usage.total_tokens
+            if used_tokens is None:
+                used_tokens = estimated_tokens + len(str(response or "")) // CHARS_PER_TOKEN
+            self.settle(estimated_tokens, used_tokens)
+            with self._lock:
+                self._metrics["calls"] += 1
+            return response
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._refill()
+            return dict(
+                self._metrics,
+                requests_per_minute=self.requests_per_minute,
+                tokens_per_minute=self.tokens_per_minute,
+                available_requests=self._requests,
+                available_tokens=self._tokens,
+            )
+
+
+rate_limiter = RateLimiter()
+
+
+# Arguments de LLM.call selon la version de crewAI : from_task et from_agent
+# n'existent pas dans les versions plus anciennes (0.118 dans uv.lock)
+_CALL_CONTEXT_PARAMETERS = frozenset(inspect.signature(LLM.call).parameters) & {
+    "from_task",
+    "from_agent",
+}
+
+
+class RateLimitedLLM(LLM):
+    """crewAI LLM whose calls go through the process-wide :data:`rate_limiter`.
+
+    ``event_listener``, when set, is called with ``("llm_call", ...)`` after
+    each call: task, agent, duration (quota waits and retries included) and
+    prompt and completion tokens, estimated when the provider reports none.
+    """
+
+    event_listener: Optional[Callable[..., None]] = None
+
+    def call(
+        self,
+        messages,
+        tools=None,
+        callbacks=None,
+        available_functions=None,
+        from_task=None,
+        from_agent=None,
+    ):
+        estimated_tokens = estimate_tokens(messages) + (self.max_tokens or 0)
+        usage = _UsageRecorder()
+        context = {
+            name: value
+            for name, value in (("from_task", from_task), ("from_agent", from_agent))
+            if name in _CALL_CONTEXT_PARAMETERS
+        }
+        started = time.perf_counter()
+        response = rate_limiter.call(
+            lambda extra_callbacks: super(RateLimitedLLM, self).call(
+                messages,
+                tools=tools,
+                callbacks=list(callbacks or []) + extra_callbacks,
+                available_functions=available_functions,
+                **context,
+            ),
+            estimated_tokens,
+            usage,
+        )
+        if self.event_listener is not None:
+            prompt_tokens = usage.prompt_tokens
+            if prompt_tokens is None:
+                prompt_tokens = estimate_tokens(messages)
+            completion_tokens = usage.completion_tokens
+            if completion_tokens is None:
+                completion_tokens = len(str(response or "")) // CHARS_PER_TOKEN
+            self.event_listener(
+                "llm_call",
+                task=getattr(from_task, "name", None),
+                # crewAI ne transmet pas toujours from_agent : l'agent de la tâche fait foi
+                agent=(
+                    getattr(from_agent or getattr(from_task, "agent", None), "role", None) or ""
+                ).strip()
+                or None,
+                duration=time.perf_counter() - started,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+            )
+        return response
+
+
+def rate_limited(llm: Any) -> Any:
+    """The same LLM, configuration included, with its calls rate limited."""
+    if not isinstance(llm, LLM) or isinstance(llm, RateLimitedLLM):
+        return llm
+    limited = copy.copy(llm)
+    limited.__class__ = RateLimitedLLM
+    return limited
@@ -0,0 +1,217 @@
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from medical_report_generator.tools.snippets import CHARS_PER_TOKEN
+
+# Nom du modèle à donner à crewAI (LLM_MODEL) : fournisseur compatible OpenAI
+STUB_MODEL = "openai/stub"
+
+REPORT_TEMPLATE = """TITRE: {title}
+Indication: {excerpt}
+Technique: Séquences pondérées T1 et T2 dans les trois plans, sans injection.
+Incidences: Aucune.
+Résultat: Absence d'anomalie de signal significative. {excerpt}
+Conclusion: Examen sans anomalie notable."""
+
+
+def _tool_arguments(tool_name: str, excerpt: str, report_type: str) -> Dict:
+    if tool_name == "classify_report_type":
+        return {"raw_text": excerpt}
+    if tool_name == "retrieve_similar_reports":
+        return {"query": excerpt, "report_type": report_type, "top_k": 3}
+    return {}
+
+
+class StubLLMServer:
+    """Local OpenAI-compatible chat completions server with deterministic answers.
+
+    Stands in for the LLM provider in benchmarks, so that a full crew runs
+    without network and with a controlled latency: each answer takes
+    ``latency`` seconds plus ``latency_per_token`` per completion token.
+    The answer is the first of ``responses`` (substring of the prompt ->
+    answer) found in the prompt; otherwise an agent given tools calls the
+    first one once, then every agent answers with a report built from a
+    template and an excerpt of its task. Token usage is estimated from the
+    text lengths, as the rate limiter does.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        latency_per_token: float = 0.0,
+        responses: Optional[Dict[str, str]] = None,
+    ):
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.responses = responses or {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubLLMServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="stub-llm", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serves in the calling thread until interrupted."""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def complete(self, messages: List[Dict]) -> Tuple[str, int, int]:
+        """The answer to a chat prompt, with its prompt and completion token counts."""
+        prompt = "\n".join(str(message.get("content") or "") for message in messages)
+        content = self._answer(messages, prompt)
+        return content, len(prompt) // CHARS_PER_TOKEN + 1, len(content) // CHARS_PER_TOKEN + 1
+
+    def _answer(self, messages: List[Dict], prompt: str) -> str:
+        for pattern, response in self.responses.items():
+            if pattern in prompt:
+                return response
+
+        last_message = str(messages[-1].get("content") or "") if messages else ""
+        excerpt = " ".join(last_message.split())[:300]
+        tools = re.findall(r"^Tool Name: (\S+)", prompt, flags=re.MULTILINE)
+        # Un seul appel d'outil par tâche : après lui, l'historique contient une réponse
+        already_answered = any(message.get("role") == "assistant" for message in messages)
+        if tools and not already_answered:
+            report_type = re.search(r"\birm_[a-zéèàç_]+", prompt)
+            arguments = _tool_arguments(
+                tools[0], excerpt, report_type.group(0) if report_type else "irm_general"
+            )
+            return (
+                "Thought: Je consulte l'outil avant de répondre.\n"
+                f"Action: {tools[0]}\n"
+                f"Action Input: {json.dumps(arguments, ensure_ascii=False)}"
+            )
+        title = re.search(r"\bIRM[^\n.:]{0,60}", prompt)
+        report = REPORT_TEMPLATE.format(
+            title=title.group(0).strip().upper() if title else "IRM", excerpt=excerpt[:200]
+        )
+        return f"Thought: I now know the final answer\nFinal Answer: {report}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": f"Route inconnue : {self.path}"}})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    request = json.loads(self.rfile.read(length))
+                except ValueError as e:
+                    self._send(400, {"error": {"message": f"JSON invalide : {e}"}})
+                    return
+                if request.get("stream"):
+                    self._send(400, {"error": {"message": "Le streaming n'est pas pris en charge"}})
+                    return
+                content, prompt_tokens, completion_tokens = stub.complete(
+                    request.get("messages") or []
+                )
+                time.sleep(stub.latency + stub.latency_per_token * completion_tokens)
+                with stub._lock:
+                    stub.requests += 1
+                    request_number = stub.requests
+                self._send(
+                    200,
+                    {
+                        "id": f"stub-{request_number}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": request.get("model", "stub"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": {
+                            "prompt_tokens": prompt_tokens,
+                            "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens,
+                        },
+                    },
+                )
+
+            def _send(self, status: int, body: Dict) -> None:
+                payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                # Une ligne par requête noierait la sortie des benchmarks
+                pass
+
+        return Handler
+
+
+def load_responses(path: Optional[str]) -> Dict[str, str]:
+    """Canned answers from a JSON object file mapping a prompt substring to its answer."""
+    if not path:
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        responses = json.load(f)
+    if not isinstance(responses, dict):
+        raise ValueError(f"{path} : objet JSON attendu (extrait du prompt -> réponse)")
+    return {str(pattern): str(response) for pattern, response in responses.items()}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Serveur LLM local compatible OpenAI, à réponses déterministes."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="secondes par réponse")
+    parser.add_argument(
+        "--latency-per-token", type=float, default=0.0, help="secondes par token de réponse"
+    )
+    parser.add_argument("--responses", help="fichier JSON {extrait du prompt: réponse}")
+    args = parser.parse_args(argv)
+
+    server = StubLLMServer(
+        args.host, args.port, args.latency, args.latency_per_token, load_responses(args.responses)
+    )
+    print(f"LLM de substitution sur {server.base_url} (LLM_MODEL={STUB_MODEL})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from crewai import Agent, Task
+from pydantic import Field
+
+
+class _DirectoryEntries:
+    """Entry count of a cache directory, shared by the TaskOutputCache instances of a
+    process: each run creates its own instance, the count must outlive it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # None : jamais compté, le prochain put parcourt le répertoire
+        self.count: Optional[int] = None
+        self.pruned_at = 0.0
+
+
+_directories: Dict[Path, _DirectoryEntries] = {}
+_directories_lock = threading.Lock()
+
+
+def _directory_entries(directory: Path) -> _DirectoryEntries:
+    with _directories_lock:
+        return _directories.setdefault(directory.resolve(), _DirectoryEntries())
+
+
+class TaskOutputCache:
+    """On-disk cache of task outputs, one JSON file per task execution.
+
+    The key of a task execution hashes the task as sent to the LLM (its
+    description, with the inputs interpolated, and expected output), the
+    agent configuration (role, goal, backstory, LLM, tools) and the context
+    passed from upstream tasks. A rerun only re-executes the tasks whose key
+    changed: an edited prompt in ``tasks.yaml`` invalidates that task and,
+    through the context, the tasks whose input then changes.
+
+    Entries expire ``ttl`` after they were written. The directory is only
+    scanned when the process's count of its entries goes past
+    ``max_entries``, or ``prune_interval`` after the last scan: the least
+    recently used entries (by file modification time, refreshed on each hit)
+    are then deleted down to nine tenths of ``max_entries``, with those
+    unused for ``ttl``.
+    """
+
+    INPUTS_FILE = "last_inputs.json"
+
+    def __init__(
+        self,
+        directory,
+        read: bool = True,
+        refresh: Iterable[str] = (),
+        ttl: Optional[timedelta] = None,
+        max_entries: Optional[int] = None,
+        prune_interval: Optional[timedelta] = None,
+    ):
+        self.directory = Path(directory)
+        self.ttl = ttl or timedelta(seconds=int(os.getenv("TASK_CACHE_TTL", str(7 * 24 * 3600))))
+        self.max_entries = max_entries or int(os.getenv("TASK_CACHE_MAX_ENTRIES", "5000"))
+        self.prune_interval = prune_interval or timedelta(hours=1)
+        # read=False : les sorties sont enregistrées mais jamais relues
+        self.read = read
+        # Tâches toujours réexécutées (replay depuis une tâche donnée)
+        self.refresh = set(refresh)
+        self.hits: List[str] = []
+        self.misses: List[str] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(task: Task, agent: Agent, context: Optional[str], tools: Optional[List] = None) -> str:
+        llm = getattr(agent.llm, "model", None) or str(agent.llm)
+        parts = {
+            "task": [task.description, task.expected_output],
+            "agent": [agent.role, agent.goal, agent.backstory, llm],
+            "tools": sorted(tool.name for tool in tools or agent.tools or []),
+            "context": hashlib.sha256((context or "").encode("utf-8")).hexdigest(),
+        }
+        return hashlib.sha256(
+            json.dumps(parts, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def get(self, task_name: str, key: str) -> Optional[str]:
+        output = None
+        if self.read and task_name not in self.refresh:
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+                if datetime.now() - datetime.fromisoformat(entry["created_at"]) > self.ttl:
+                    path.unlink(missing_ok=True)
+                else:
+                    output = entry["output"]
+                    # Date de dernière utilisation, pour l'éviction
+                    os.utime(path)
+            except (OSError, ValueError, KeyError):
+                output = None
+        with self._lock:
+            (self.misses if output is None else self.hits).append(task_name)
+        return output
+
+    def put(self, task_name: str, key: str, output: str) -> None:
+        path = self._path(key)
+        added = not path.exists()
+        self._write(
+            path,
+            {"task": task_name, "created_at": datetime.now().isoformat(), "output": output},
+        )
+        entries = _directory_entries(self.directory)
+        with entries.lock:
+            if entries.count is not None and added:
+                entries.count += 1
+            due = (
+                entries.count is None
+                or entries.count > self.max_entries
+                or time.monotonic() - entries.pruned_at >= self.prune_interval.total_seconds()
+            )
+        if due:
+            self.prune()
+
+    def prune(self) -> int:
+        """Deletes the entries unused for ``ttl`` and, beyond ``max_entries``, the
+        least recently used down to nine tenths of it; returns the number deleted."""
+        entries = []
+        for path in self.directory.glob("*.json"):
+            if path.name == self.INPUTS_FILE:
+                continue
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                # Supprimée entre-temps par une autre exécution
+                continue
+        expired_before = time.time() - self.ttl.total_seconds()
+        # Marge sous le plafond : le parcours suivant n'a pas lieu dès l'écriture suivante
+        kept_at_most = (
+            self.max_entries - self.max_entries // 10
+            if len(entries) > self.max_entries
+            else self.max_entries
+        )
+        entries.sort(reverse=True)
+        deleted = 0
+        for position, (used_at, path) in enumerate(entries):
+            if position >= kept_at_most or used_at < expired_before:
+                path.unlink(missing_ok=True)
+                deleted += 1
+        directory_entries = _directory_entries(self.directory)
+        with directory_entries.lock:
+            directory_entries.count = len(entries) - deleted
+            directory_entries.pruned_at = time.monotonic()
+        return deleted
+
+    def save_inputs(self, inputs: Dict) -> None:
+        """Records the inputs of a run, for :meth:`load_inputs` (replay)."""
+        self._write(self.directory / self.INPUTS_FILE, inputs)
+
+    def load_inputs(self) -> Optional[Dict]:
+        try:
+            with open(self.directory / self.INPUTS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path: Path, content: Dict) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Écriture atomique : les tâches parallèles et les exécutions concurrentes
+        # ne lisent jamais un fichier partiel
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(content, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+class CachedAgent(Agent):
+    """Agent whose task outputs are served from, and saved to, a TaskOutputCache.
+
+    ``event_listener``, when set, is called with ``("task_started", ...)``
+    before each task, crewAI having no callback for the start of a task.
+    """
+
+    task_cache: Any = Field(default=None, exclude=True)
+    event_listener: Any = Field(default=None, exclude=True)
+
+    def execute_task(self, task: Task, context: Optional[str] = None, tools: Optional[List] = None) -> str:
+        task_name = task.name or task.description
+        if self.event_listener is not None:
+            self.event_listener("task_started", task=task_name, agent=self.role.strip())
+        if self.task_cache is None:
+            return super().execute_task(task, context, tools)
+        key = self.task_cache.key(task, self, context, tools)
+        output = self.task_cache.get(task_name, key)
+        if output is not None:
+            print(f"Sortie de la tâche '{task_name}' reprise du cache")
+            if self.event_listener is not None:
+                self.event_listener("task_cache_hit", task=task_name, agent=self.role.strip())
+            return output
+        output = super().execute_task(task, context, tools)
+        self.task_cache.put(task_name, key, output)
+        return output
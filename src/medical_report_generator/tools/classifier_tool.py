@@ -1,6 +1,250 @@
+import os
+import re
+import threading
+import time
+import unicodedata
 from crewai.tools import BaseTool
-from typing import Type, ClassVar
+from pathlib import Path
+from typing import Any, Callable, ClassVar, Dict, List, Optional, Tuple, Type
 from pydantic import BaseModel, Field
+import yaml
+
+
+DEFAULT_VOCABULARY_PATH = Path("knowledge/report_type_keywords.yaml")
+
+# Suffixes retirés par la racinisation, du plus long au plus court
+FRENCH_SUFFIXES = ("ales", "aux", "ale", "al", "es", "s", "x", "e")
+MIN_STEM_LENGTH = 3
+# Mots de quatre lettres ou moins ("foie", "rate", "sein") : ni racinisés ni
+# désaccentués, sans quoi ils deviennent des mots courants ("fois", "raté")
+SHORT_WORD_LENGTH = 4
+
+# Terminaisons acceptées pour chaque suffixe retiré : les autres flexions du
+# même mot, et seulement elles ("hépatique" -> "hépatiques", "dorsal" -> "dorsaux")
+SUFFIX_FAMILIES = {
+    "": ("s", "x", ""),
+    "s": ("s", "x", ""),
+    "x": ("s", "x", ""),
+    "e": ("es", "e"),
+    "es": ("es", "e"),
+    "al": ("ales", "aux", "ale", "al"),
+    "ale": ("ales", "aux", "ale", "al"),
+    "ales": ("ales", "aux", "ale", "al"),
+    "aux": ("ales", "aux", "ale", "al"),
+}
+
+# Clé du vocabulaire listant les expressions dont les mots ne comptent pas ("au sein de")
+IGNORED_PHRASES_KEY = "expressions_ignorees"
+
+_WORD = re.compile(r"\w+")
+
+
+class _AccentFolding(dict):
+    """str.translate table folding each accented character to its base letter, one for one."""
+
+    def __missing__(self, code: int) -> str:
+        base = "".join(
+            c for c in unicodedata.normalize("NFD", chr(code)) if not unicodedata.combining(c)
+        )
+        folded = self[code] = base if len(base) == 1 else chr(code)
+        return folded
+
+
+_ACCENT_FOLDING = _AccentFolding()
+
+
+def lower_text(text: str) -> str:
+    """Lowercased text in composed form (NFC), the reference for accent-sensitive words."""
+    return unicodedata.normalize("NFC", text).lower()
+
+
+def normalize_text(text: str) -> str:
+    """Folds accents and lowercases, keeping the length of :func:`lower_text`."""
+    return lower_text(text).translate(_ACCENT_FOLDING)
+
+
+def split_suffix(word: str) -> Tuple[str, str]:
+    """Light French stemming: (stem, stripped plural, feminine or -al/-aux suffix)."""
+    for suffix in FRENCH_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            return word[: -len(suffix)], suffix
+    return word, ""
+
+
+def stem(word: str) -> str:
+    """Stem of a normalized word (see :func:`split_suffix`)."""
+    return split_suffix(word)[0]
+
+
+def word_key(word: str) -> str:
+    """Key of a lowercased word: the word itself if short, else its stem and suffix family.
+
+    Two words have the same key when they are inflections of one another,
+    accents aside; short words only match themselves, accents included.
+    """
+    folded = word.translate(_ACCENT_FOLDING)
+    if len(folded) <= SHORT_WORD_LENGTH:
+        return word
+    word_stem, suffix = split_suffix(folded)
+    return f"{word_stem}+{SUFFIX_FAMILIES[suffix][0]}"
+
+
+def word_keys(text: str) -> Tuple[str, ...]:
+    """Keys (see :func:`word_key`) of the words of a text."""
+    return tuple(word_key(word) for word in _WORD.findall(lower_text(text)))
+
+
+def _word_units(word: str) -> List[str]:
+    """Trie units of a keyword word in normalized text: its stem characters, then its endings.
+
+    Single characters are literal; longer units are regex fragments.
+    """
+    folded = word.translate(_ACCENT_FOLDING)
+    if len(folded) <= SHORT_WORD_LENGTH:
+        # Les accents sont vérifiés sur le texte d'origine, par word_key
+        return list(folded)
+    word_stem, suffix = split_suffix(folded)
+    endings = [re.escape(ending) for ending in SUFFIX_FAMILIES[suffix] if ending]
+    optional = "?" if "" in SUFFIX_FAMILIES[suffix] else ""
+    return list(word_stem) + ["(?:" + "|".join(endings) + ")" + optional]
+
+
+def _trie_pattern(keywords) -> str:
+    """Regex matching any of the keywords (tuples of lowercased words) in normalized text.
+
+    The alternation is factored as a prefix trie, so the regex engine
+    follows a single branch per character instead of trying every keyword
+    in turn. Each word may only carry the endings of the suffix stripped
+    from it (see SUFFIX_FAMILIES); longer keywords are tried before their
+    prefixes.
+    """
+    trie: Dict = {}
+    for keyword in keywords:
+        node = trie
+        for position, word in enumerate(keyword):
+            for unit in ([r"\W+"] if position else []) + _word_units(word):
+                node = node.setdefault(unit, {})
+        node[""] = {}
+
+    def pattern(node: Dict) -> str:
+        branches = [
+            (re.escape(unit) if len(unit) == 1 else unit) + pattern(child)
+            for unit, child in sorted(node.items())
+            if unit
+        ]
+        if "" in node:
+            branches.append(r"(?!\w)")
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    return pattern(trie)
+
+
+class KeywordMatcher:
+    """All report-type keywords compiled into one regex, matched in a single pass.
+
+    Text and keywords are normalized the same way (accent folding, lowercase,
+    light stemming), so 'ménisques' or 'hepatique' match 'ménisque' and
+    'hépatique'; words of four letters or fewer are matched as written
+    ('foie' doesn't match 'fois', nor 'rate' 'raté'). Keywords match whole
+    words. When a match spans several keywords ('intestin grêle' contains
+    'intestin' and 'grêle'), each of them is counted. The words of an
+    ignored phrase ('au sein de') count for no type.
+    """
+
+    def __init__(
+        self,
+        keywords_by_type: Dict[str, List[str]],
+        ignored_phrases: Optional[List[str]] = None,
+    ):
+        self.report_types = list(keywords_by_type)
+        self._types_by_keyword: Dict[Tuple[str, ...], List[str]] = {}
+        keywords: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        for report_type, type_keywords in keywords_by_type.items():
+            for keyword in type_keywords or []:
+                words = tuple(_WORD.findall(lower_text(keyword)))
+                if words:
+                    keywords[word_keys(keyword)] = words
+                    types = self._types_by_keyword.setdefault(word_keys(keyword), [])
+                    if report_type not in types:
+                        types.append(report_type)
+        self._ignored = set()
+        for phrase in ignored_phrases or []:
+            words = tuple(_WORD.findall(lower_text(phrase)))
+            if words:
+                keywords[word_keys(phrase)] = words
+                self._ignored.add(word_keys(phrase))
+        self._pattern = (
+            re.compile(r"(?<!\w)" + _trie_pattern(keywords.values())) if keywords else None
+        )
+        self._contributions: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def from_file(cls, path: Path) -> "KeywordMatcher":
+        with open(path, "r", encoding="utf-8") as f:
+            vocabulary = yaml.safe_load(f) or {}
+        ignored_phrases = vocabulary.pop(IGNORED_PHRASES_KEY, None)
+        return cls(vocabulary, ignored_phrases)
+
+    def _contribution(self, matched: str) -> Dict[str, int]:
+        """Keyword counts per type within a matched span (cached per distinct span)."""
+        contribution = self._contributions.get(matched)
+        if contribution is None:
+            contribution = {}
+            words = word_keys(matched)
+            if words not in self._ignored:
+                for start in range(len(words)):
+                    for end in range(start + 1, len(words) + 1):
+                        for report_type in self._types_by_keyword.get(words[start:end], []):
+                            contribution[report_type] = contribution.get(report_type, 0) + 1
+            self._contributions[matched] = contribution
+        return contribution
+
+    def scores(self, text: str) -> Dict[str, int]:
+        """Keyword occurrence counts per report type, in declaration order (zero scores omitted)."""
+        if self._pattern is None:
+            return {}
+        totals = dict.fromkeys(self.report_types, 0)
+        lowered = lower_text(text)
+        # Texte normalisé de même longueur : les positions valent pour le texte d'origine
+        for match in self._pattern.finditer(lowered.translate(_ACCENT_FOLDING)):
+            for report_type, count in self._contribution(
+                lowered[match.start() : match.end()]
+            ).items():
+                totals[report_type] += count
+        return {report_type: score for report_type, score in totals.items() if score > 0}
+
+
+_matchers: Dict[Path, Tuple[Optional[Tuple[int, int]], KeywordMatcher]] = {}
+_matchers_lock = threading.Lock()
+
+
+def get_keyword_matcher(path: Optional[Path] = None) -> KeywordMatcher:
+    """Returns the compiled matcher of a vocabulary file, recompiled when the file changes."""
+    path = Path(path or DEFAULT_VOCABULARY_PATH).resolve()
+    try:
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        signature = None
+
+    with _matchers_lock:
+        cached = _matchers.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        if signature is None:
+            print(f"Attention: vocabulaire du classifieur introuvable: {path}")
+            matcher = KeywordMatcher({})
+        else:
+            try:
+                matcher = KeywordMatcher.from_file(path)
+            except (OSError, yaml.YAMLError, AttributeError, TypeError) as e:
+                if cached is None:
+                    raise
+                # Fichier en cours d'édition : on garde le dernier vocabulaire valide
+                print(f"Vocabulaire du classifieur illisible ({e}), version précédente conservée")
+                return cached[1]
+        _matchers[path] = (signature, matcher)
+        return matcher
 
 
 class ClassifyReportInput(BaseModel):
@@ -16,76 +260,43 @@ class MedicalReportClassifierTool(BaseTool):
         "based on the raw medical text input."
     )
     args_schema: Type[BaseModel] = ClassifyReportInput
+    vocabulary_path: Path = DEFAULT_VOCABULARY_PATH
+    # Reçoit un événement "tool_call" par appel de l'agent (durée), défini par l'équipe
+    event_listener: Optional[Callable[..., Any]] = Field(default=None, exclude=True)
 
     # Make sure the tool is properly registered with crewAI
     tool_name: ClassVar[str] = "classify_report_type"
 
-    def _run(self, raw_text: str) -> str:
-        """Classifies the type of medical report based on the raw text."""
+    def classify(self, raw_text: str) -> Tuple[str, float, Dict[str, int]]:
+        """Returns the best report type, its confidence margin and the scores per type.
+
+        The margin is the relative lead of the best score over the second one,
+        from 0 (tie, or no keyword found) to 1 (no other type matched).
+        """
         # This is a simplified classification approach
         # In a production system, you would use a more sophisticated ML model
 
-        # Dictionary mapping keywords to report types
-        report_type_keywords = {
-            "irm_hepatique": ["foie", "hépatique", "liver", "hepatic", "biliaire", "cholangio-irm", "bili-irm"],
-            "irm_genou": [
-                "genou",
-                "knee",
-                "ménisque", "ménisques",
-                "ligament croisé", "ligaments croisés", "lca", "lcp",
-                "tibia",
-                "fémur", "fémoral", "condyle"
-            ],
-            "irm_cerebrale": [
-                "cerveau", "cérébral", "encéphale", "encéphalique",
-                "brain",
-                "crâne", "crânien",
-                "skull",
-                "neurologique", "neuro", "avc"
-            ],
-            "irm_prostate": ["prostate", "prostatique", "psa"],
-            "irm_cardiaque": [
-                "cœur", "cardiaque",
-                "heart", "cardiac",
-                "myocarde", "myocardique",
-                "ventricule", "vg", "vd"
-            ],
-            "irm_rachis": [
-                "rachis", "colonne vertébrale", "vertèbre", "vertébral", "disque intervertébral",
-                "spine",
-                "lombaire", "lombalgie",
-                "cervical", "cervicalgie",
-                "dorsal", "moelle épinière"
-            ],
-            "irm_epaule": ["épaule", "shoulder", "coiffe des rotateurs", "humérus", "rotateur", "tendon", "supra-épineux", "infra-épineux"],
-            "irm_sein": ["sein", "mammaire", "breast", "mammographie", "nodule mammaire", "tumeur du sein"],
-            "irm_pelvis": ["pelvis", "pelvien", "bassin", "endométriose", "utérus", "ovaires"],
-            "irm_abdominale": [
-                "abdomen", "abdominal",
-                "estomac", "gastrique",
-                "intestin", "grêle", "côlon", "pancréas", "rate"
-            ],
-            "irm_entero_mici": ["crohn", "mici", "intestin grêle", "iléon", "jéjunum", "entéro", "entérographie par irm", "maladie inflammatoire chronique de l'intestin"],
-            "irm_epilepsie": ["épilepsie", "crise épileptique", "crises", "activité épileptiforme", "sclérose hippocampique", "dysplasie corticale", "EEG"],
-            # Add more report types as needed
-        }
-
-        # Normalize the input text (lowercase)
-        normalized_text = raw_text.lower()
-
-        # Count occurrences of keywords for each report type
-        type_scores = {}
-        for report_type, keywords in report_type_keywords.items():
-            score = 0
-            for keyword in keywords:
-                score += normalized_text.count(keyword)
-            if score > 0:
-                type_scores[report_type] = score
+        # Count occurrences of keywords for each report type, in one pass
+        type_scores = get_keyword_matcher(self.vocabulary_path).scores(raw_text)
 
         # Determine the report type with the highest score
         if type_scores:
             best_match = max(type_scores.items(), key=lambda x: x[1])
-            return best_match[0]
+            runner_up = max(
+                (score for report_type, score in type_scores.items() if report_type != best_match[0]),
+                default=0,
+            )
+            return best_match[0], (best_match[1] - runner_up) / best_match[1], type_scores
         else:
             # Default if no keywords match
-            return "irm_general"
+            return "irm_general", 0.0, type_scores
+
+    def _run(self, raw_text: str) -> str:
+        """Classifies the type of medical report based on the raw text."""
+        started = time.perf_counter()
+        report_type = self.classify(raw_text)[0]
+        if self.event_listener is not None:
+            self.event_listener(
+                "tool_call", tool=self.name, duration=time.perf_counter() - started
+            )
+        return report_type
@@ -0,0 +1,246 @@
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from medical_report_generator.tools.rag_index import ReportIndex, replace_file, top_k_rows
+
+DEFAULT_EMBEDDING_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
+
+
+class HashingEmbedder:
+    """Deterministic, training-free embedding of hashed character n-grams (for tests)."""
+
+    name = "hashing"
+
+    def __init__(self, dimension: int = 512):
+        self._vectorizer = HashingVectorizer(
+            n_features=dimension,
+            analyzer="char_wb",
+            ngram_range=(3, 5),
+            alternate_sign=False,
+            norm="l2",
+        )
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        return self._vectorizer.transform(texts).toarray().astype(np.float32)
+
+
+class SentenceTransformerEmbedder:
+    """Local CPU sentence-embedding model, from the optional sentence-transformers package."""
+
+    def __init__(self, model_name: str):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                f"Le modèle d'embedding '{model_name}' nécessite le paquet "
+                "sentence-transformers (uv sync --extra embeddings), "
+                "ou RAG_EMBEDDING_MODEL=hashing."
+            ) from e
+        self.name = model_name
+        self._model = SentenceTransformer(model_name, device="cpu")
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        embeddings = self._model.encode(
+            list(texts), normalize_embeddings=True, convert_to_numpy=True
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+_embedders: Dict[str, object] = {}
+_embedders_lock = threading.Lock()
+
+
+def get_embedder(model: Optional[str] = None):
+    """Returns the process-wide embedder for a model name ('hashing' or a sentence-transformers model)."""
+    model = model or os.getenv("RAG_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+    with _embedders_lock:
+        embedder = _embedders.get(model)
+        if embedder is None:
+            embedder = (
+                HashingEmbedder() if model == "hashing" else SentenceTransformerEmbedder(model)
+            )
+            _embedders[model] = embedder
+        return embedder
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index over normalised vectors.
+
+    Vectors are assigned to the closest of ``sqrt(n)`` spherical k-means
+    centroids; a query only scans the lists of its ``nprobe`` closest centroids.
+    """
+
+    TRAINING_SAMPLE = 20000
+    CHUNK = 8192
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int64)
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(
+            self.assignments[order], np.arange(len(self.centroids) + 1)
+        )
+        self._lists = [order[bounds[i] : bounds[i + 1]] for i in range(len(self.centroids))]
+
+    @classmethod
+    def train(cls, vectors: np.ndarray, iterations: int = 10, seed: int = 0) -> "IVFIndex":
+        rng = np.random.default_rng(seed)
+        n = len(vectors)
+        sample = vectors
+        if n > cls.TRAINING_SAMPLE:
+            sample = vectors[np.sort(rng.choice(n, cls.TRAINING_SAMPLE, replace=False))]
+        sample = np.asarray(sample, dtype=np.float32)
+
+        nlist = max(1, int(np.sqrt(n)))
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assignments == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    if norm > 0:
+                        centroids[c] = centroid / norm
+        return cls(centroids, cls._assign(centroids, vectors))
+
+    @classmethod
+    def _assign(cls, centroids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        if not len(vectors):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(
+            [
+                np.argmax(np.asarray(vectors[i : i + cls.CHUNK]) @ centroids.T, axis=1)
+                for i in range(0, len(vectors), cls.CHUNK)
+            ]
+        )
+
+    def updated(self, kept_rows: Sequence[int], new_vectors: Optional[np.ndarray]) -> "IVFIndex":
+        """Keeps the centroids; drops removed rows and assigns the new vectors."""
+        assignments = [self.assignments[kept_rows]]
+        if new_vectors is not None:
+            assignments.append(self._assign(self.centroids, new_vectors))
+        return IVFIndex(self.centroids, np.concatenate(assignments))
+
+    def search(
+        self, matrix: np.ndarray, query_vector: np.ndarray, top_k: int, nprobe: int
+    ) -> List[Tuple[int, float]]:
+        probes = np.argsort(-(self.centroids @ query_vector))[:nprobe]
+        candidates = np.sort(np.concatenate([self._lists[c] for c in probes]))
+        if not len(candidates):
+            return []
+        similarities = np.asarray(matrix[candidates]) @ query_vector
+        return top_k_rows(candidates, similarities, top_k)
+
+
+class EmbeddingReportIndex(ReportIndex):
+    """Dense sentence embeddings of the knowledge base with an IVF index for top-k search.
+
+    Embeddings are saved as a float32 ``.npy`` file and memory-mapped on load.
+    """
+
+    backend = "embedding"
+    MATRIX_FILE = "embeddings.npy"
+    CENTROIDS_FILE = "ivf_centroids.npy"
+    ASSIGNMENTS_FILE = "ivf_assignments.npy"
+
+    def __init__(
+        self,
+        embedder,
+        matrix: Optional[np.ndarray] = None,
+        doc_ids: Sequence[str] = (),
+        metadata: Optional[Dict] = None,
+        ivf: Optional[IVFIndex] = None,
+    ):
+        super().__init__(matrix, doc_ids, metadata)
+        self.embedder = embedder
+        self.ivf = ivf
+        self.nprobe = int(os.getenv("RAG_IVF_NPROBE", "8"))
+
+    @classmethod
+    def build(cls, documents: Dict[str, str], model: Optional[str] = None) -> "EmbeddingReportIndex":
+        embedder = get_embedder(model)
+        if not documents:
+            return cls(embedder)
+        matrix = embedder.encode(list(documents.values()))
+        return cls(embedder, matrix, list(documents), ivf=IVFIndex.train(matrix))
+
+    @property
+    def options(self) -> Dict:
+        return {"model": self.embedder.name}
+
+    @property
+    def approximate(self) -> bool:
+        return self.is_fitted and self.ivf is not None
+
+    def encode(self, texts: Sequence[str]) -> np.ndarray:
+        return self.embedder.encode(texts)
+
+    def similarities(self, query_vectors, matrix=None) -> np.ndarray:
+        matrix = np.asarray(self.matrix if matrix is None else matrix)
+        query_vectors = np.atleast_2d(query_vectors)
+        if len(query_vectors) == 1:
+            return query_vectors @ matrix.T
+        # Un produit matrice-vecteur par requête : un produit matrice-matrice
+        # arrondit différemment, et un lot ne donnerait pas exactement les
+        # scores des requêtes isolées
+        return np.vstack([query_vectors[i : i + 1] @ matrix.T for i in range(len(query_vectors))])
+
+    def search(self, query_vector, top_k: int) -> List[Tuple[int, float]]:
+        if not self.is_fitted or self.ivf is None:
+            return super().search(query_vector, top_k)
+        return self.ivf.search(self.matrix, np.asarray(query_vector)[0], top_k, self.nprobe)
+
+    def _updated(self, kept_rows, new_vectors, doc_ids) -> "EmbeddingReportIndex":
+        blocks = [np.asarray(self.matrix[kept_rows])]
+        if new_vectors is not None:
+            blocks.append(new_vectors)
+        return EmbeddingReportIndex(
+            self.embedder,
+            np.vstack(blocks).astype(np.float32, copy=False),
+            doc_ids,
+            self.metadata,
+            self.ivf.updated(kept_rows, new_vectors) if self.ivf is not None else None,
+        )
+
+    def _save_arrays(self, directory: Path) -> None:
+        matrix_path = directory / self.MATRIX_FILE
+        replace_file(matrix_path, lambda f: np.save(f, np.asarray(self.matrix)))
+        if self.ivf is not None:
+            replace_file(
+                directory / self.CENTROIDS_FILE, lambda f: np.save(f, self.ivf.centroids)
+            )
+            replace_file(
+                directory / self.ASSIGNMENTS_FILE,
+                lambda f: np.save(f, self.ivf.assignments),
+            )
+        # Libère la copie en mémoire au profit du fichier mappé
+        self.matrix = np.load(matrix_path, mmap_mode="r")
+
+    @classmethod
+    def _load_arrays(
+        cls, directory: Path, manifest: Dict, model: Optional[str] = None
+    ) -> Optional["EmbeddingReportIndex"]:
+        embedder = get_embedder(model)
+        if manifest.get("options", {}).get("model") != embedder.name:
+            return None
+        if not manifest["doc_ids"]:
+            return cls(embedder, doc_ids=[], metadata=manifest.get("metadata"))
+        ivf = None
+        if (directory / cls.CENTROIDS_FILE).exists():
+            ivf = IVFIndex(
+                np.load(directory / cls.CENTROIDS_FILE),
+                np.load(directory / cls.ASSIGNMENTS_FILE),
+            )
+        return cls(
+            embedder,
+            np.load(directory / cls.MATRIX_FILE, mmap_mode="r"),
+            manifest["doc_ids"],
+            manifest.get("metadata"),
+            ivf,
+        )
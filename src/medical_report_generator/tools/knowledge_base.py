@@ -0,0 +1,364 @@
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from medical_report_generator.tools.embedding_index import EmbeddingReportIndex
+from medical_report_generator.tools.rag_index import (
+    ReportIndex,
+    TfidfReportIndex,
+    default_index_path,
+)
+from medical_report_generator.tools.report_sections import parse_sections
+from medical_report_generator.tools.report_types import SECTION_SEPARATOR, TypePartitions
+
+
+# Backends de recherche disponibles, sélectionnés par RAG_BACKEND
+RETRIEVAL_BACKENDS = {
+    TfidfReportIndex.backend: TfidfReportIndex,
+    EmbeddingReportIndex.backend: EmbeddingReportIndex,
+}
+
+
+# Granularités indexées : rapports entiers et sections individuelles
+GRANULARITIES = ("reports", "sections")
+
+
+def default_backend() -> str:
+    return os.getenv("RAG_BACKEND", TfidfReportIndex.backend).lower()
+
+
+def read_report(file_path: str) -> Dict[str, str]:
+    """Reads a medical report and extracts its sections."""
+    try:
+        with open(file_path, "r", encoding="utf-8") as f:
+            content = f.read()
+    except (FileNotFoundError, UnicodeDecodeError) as e:
+        print(f"Erreur lecture fichier {file_path}: {e}")
+        return {}
+
+    # Sections non vides uniquement, nommées sans les deux-points
+    return parse_sections(content).to_dict(include_empty=False)
+
+
+def extract_report_type_from_filename(filename: str) -> Optional[str]:
+    """Extracts the report type from the filename."""
+    basename = os.path.basename(filename)
+
+    # Essayer plusieurs patterns
+    patterns = [
+        r"irm_([\w\-+’']+?)_\d+\.txt",  # irm_type_number.txt (type can have _, letters, numbers, -)
+        r"irm_([\w\-+’']+?)\.txt",  # irm_type.txt
+        r"([\w\-+’']+?)_irm_\d+\.txt",  # type_irm_number.txt
+        r"([\w\-+’']+?)\.txt",  # type.txt (generic, less specific)
+    ]
+
+    for pattern in patterns:
+        match = re.match(pattern, basename, re.IGNORECASE)
+        if match:
+            # Ensure we capture the correct group, usually the first one
+            # For patterns like ([^_]+)_irm_\d+\.txt, group(1) is the type
+            # For irm_([^_]+)\.txt, group(1) is the type
+            # Check if match.groups() is not empty
+            if match.groups():
+                return match.group(1).lower()
+
+    return None
+
+
+def report_text(report: Dict) -> str:
+    """Combines all sections of a report into the text indexed for similarity."""
+    content = report.get("content")
+    if not isinstance(content, dict):
+        return ""
+    return " ".join(
+        f"{section_name}: {section_content_value}"
+        for section_name, section_content_value in content.items()
+        if section_content_value
+        and isinstance(section_content_value, str)
+        and section_content_value.strip()
+    )
+
+
+class KnowledgeBase:
+    """Parsed reports and similarity index of one knowledge-base directory.
+
+    Instances are obtained through :func:`get_knowledge_base`, which returns the
+    same object for a given path, so the corpus is parsed and indexed once per
+    process whatever the number of tools, crews and requests using it.
+
+    Files are tracked by (path, mtime, size): :meth:`refresh` only re-parses new
+    or changed files, drops deleted ones and updates the index rows in place.
+    """
+
+    def __init__(
+        self,
+        path,
+        index_path=None,
+        refresh_interval: Optional[float] = None,
+        backend: Optional[str] = None,
+    ):
+        self.path = Path(path)
+        self.backend = backend or default_backend()
+        if self.backend not in RETRIEVAL_BACKENDS:
+            raise ValueError(
+                f"Backend de recherche inconnu: {self.backend} "
+                f"(disponibles: {', '.join(RETRIEVAL_BACKENDS)})"
+            )
+        self._index_class = RETRIEVAL_BACKENDS[self.backend]
+        self.index_path = (
+            Path(index_path)
+            if index_path is not None
+            else default_index_path(self.path, self.backend)
+        )
+        self.refresh_interval = (
+            float(os.getenv("RAG_REFRESH_INTERVAL", "10"))
+            if refresh_interval is None
+            else refresh_interval
+        )
+        self._lock = threading.RLock()
+        self._reports: Dict[str, Dict] = {}
+        self._signatures: Dict[str, Tuple[int, int]] = {}
+        # Une partition par granularité ("reports", "sections"), chacune liée à son index
+        self._partitions: Dict[str, TypePartitions] = {}
+        self._last_refresh = 0.0
+
+    @property
+    def reports(self) -> List[Dict]:
+        """All loaded reports; treat as read-only, they are shared between threads."""
+        self.load()
+        return list(self._reports.values())
+
+    @property
+    def index(self) -> ReportIndex:
+        """Index of whole reports."""
+        return self.partitions.index
+
+    @property
+    def partitions(self) -> TypePartitions:
+        """Per-type partitions of the report index (they reference the index they slice)."""
+        self.load()
+        return self._partitions["reports"]
+
+    @property
+    def section_partitions(self) -> TypePartitions:
+        """Per-type and per-section partitions of the section index."""
+        self.load()
+        return self._partitions["sections"]
+
+    def report(self, doc_id: str) -> Optional[Dict]:
+        """Returns the report indexed under the given file name (or section doc id)."""
+        file_name = doc_id.partition(SECTION_SEPARATOR)[0]
+        return self._reports.get(os.path.join(self.path, file_name))
+
+    def load(self) -> None:
+        """Parses the corpus and loads (or builds) its indexes, once."""
+        if self._partitions:
+            return
+        with self._lock:
+            if self._partitions:
+                return
+            if not self.path.exists():
+                print(f"Attention: Le chemin {self.path} n'existe pas.")
+            self._signatures = self._stat_files()
+            self._reports = self._parse(self._signatures)
+
+            indexes = {}
+            for granularity in GRANULARITIES:
+                index = self._index_class.load(self._index_path(granularity))
+                if index is None or not index.is_fitted:
+                    index = self._build_index(granularity)
+                else:
+                    # Rattraper les modifications faites depuis la sauvegarde de l'index
+                    indexed = index.metadata.get("signatures", {})
+                    changed = [
+                        file_path
+                        for file_path, signature in self._signatures.items()
+                        if indexed.get(os.path.basename(file_path)) != list(signature)
+                    ]
+                    current = {os.path.basename(p) for p in self._signatures}
+                    deleted = [name for name in indexed if name not in current]
+                    if changed or deleted:
+                        index = self._update_index(index, granularity, changed, deleted)
+                indexes[granularity] = index
+            self._set_indexes(indexes)
+            self._last_refresh = time.monotonic()
+
+    def refresh(self) -> bool:
+        """Picks up new, changed and deleted files. Returns True if anything changed."""
+        self.load()
+        with self._lock:
+            signatures = self._stat_files()
+            self._last_refresh = time.monotonic()
+            changed = [
+                file_path
+                for file_path, signature in signatures.items()
+                if self._signatures.get(file_path) != signature
+            ]
+            deleted = [p for p in self._signatures if p not in signatures]
+            if not changed and not deleted:
+                return False
+
+            # Copie puis remplacement : les lecteurs sans verrou gardent un état cohérent
+            reports = dict(self._reports)
+            for file_path in changed + deleted:
+                reports.pop(file_path, None)
+            reports.update(self._parse(changed))
+            self._reports = reports
+            self._signatures = signatures
+            deleted_names = [os.path.basename(p) for p in deleted]
+            self._set_indexes(
+                {
+                    granularity: self._update_index(
+                        partitions.index, granularity, changed, deleted_names
+                    )
+                    for granularity, partitions in self._partitions.items()
+                }
+            )
+            print(
+                f"Base de connaissances {self.path}: {len(changed)} rapport(s) "
+                f"nouveau(x) ou modifié(s), {len(deleted)} supprimé(s)"
+            )
+            return True
+
+    def refresh_if_due(self) -> None:
+        """Refreshes the knowledge base if ``refresh_interval`` seconds have elapsed."""
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+
+    def rebuild_index(self) -> ReportIndex:
+        """Re-parses the whole corpus, refits the indexes and saves them to disk."""
+        with self._lock:
+            self._signatures = self._stat_files()
+            self._reports = self._parse(self._signatures)
+            self._set_indexes(
+                {granularity: self._build_index(granularity) for granularity in GRANULARITIES}
+            )
+            self._last_refresh = time.monotonic()
+            return self._partitions["reports"].index
+
+    def documents(
+        self, file_paths: Optional[Iterable[str]] = None, granularity: str = "reports"
+    ) -> Dict[str, str]:
+        """Returns the indexable texts of the reports (all by default).
+
+        Whole reports are keyed by file name; sections by ``<file name>#<section>``.
+        """
+        if file_paths is None:
+            file_paths = list(self._reports)
+        documents = {}
+        for file_path in file_paths:
+            report = self._reports.get(file_path)
+            if not report:
+                continue
+            file_name = os.path.basename(file_path)
+            if granularity == "sections":
+                for section_name, section_content_value in report["content"].items():
+                    if section_content_value and section_content_value.strip():
+                        doc_id = f"{file_name}{SECTION_SEPARATOR}{section_name}"
+                        documents[doc_id] = section_content_value
+            else:
+                text = report_text(report)
+                if text:  # Seulement si le rapport a du contenu
+                    documents[file_name] = text
+        return documents
+
+    def _index_path(self, granularity: str) -> Path:
+        return self.index_path if granularity == "reports" else self.index_path / granularity
+
+    def _set_indexes(self, indexes: Dict[str, ReportIndex]) -> None:
+        doc_types = {
+            os.path.basename(file_path): report["type"]
+            for file_path, report in self._reports.items()
+        }
+        # Partitions d'abord : les index ne sont publiés qu'une fois découpés par type
+        self._partitions = {
+            granularity: TypePartitions(index, doc_types)
+            for granularity, index in indexes.items()
+        }
+
+    def _build_index(self, granularity: str) -> ReportIndex:
+        index = self._index_class.build(self.documents(granularity=granularity))
+        return self._save_index(index, granularity)
+
+    def _update_index(
+        self, index: ReportIndex, granularity: str, changed: List[str], deleted: List[str]
+    ) -> ReportIndex:
+        """Re-vectorizes the changed files and drops the deleted file names from an index."""
+        if not index.is_fitted:
+            # Aucun vocabulaire appris jusqu'ici : un ajustement complet est nécessaire
+            return self._build_index(granularity)
+        removed_files = set(deleted) | {os.path.basename(p) for p in changed}
+        removed = [
+            doc_id
+            for doc_id in index.doc_ids
+            if doc_id.partition(SECTION_SEPARATOR)[0] in removed_files
+        ]
+        documents = self.documents(changed, granularity)
+        return self._save_index(index.update(removed, documents), granularity)
+
+    def _save_index(self, index: ReportIndex, granularity: str) -> ReportIndex:
+        index.metadata["signatures"] = {
+            os.path.basename(file_path): list(signature)
+            for file_path, signature in self._signatures.items()
+        }
+        index_path = self._index_path(granularity)
+        try:
+            index.save(index_path)
+        except OSError as e:
+            print(f"Erreur sauvegarde index {index_path}: {e}")
+        return index
+
+    def _stat_files(self) -> Dict[str, Tuple[int, int]]:
+        """Returns the (mtime, size) signature of every report file, keyed by path."""
+        signatures = {}
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    if (
+                        entry.name.endswith(".txt")
+                        and not entry.name.startswith(".")
+                        and entry.is_file()
+                    ):
+                        stat = entry.stat()
+                        signatures[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            if self.path.exists():
+                print(f"Erreur lors du parcours de {self.path}: {e}")
+        return dict(sorted(signatures.items()))
+
+    def _parse(self, file_paths: Iterable[str]) -> Dict[str, Dict]:
+        """Parses the given report files, keyed by path."""
+        reports = {}
+        for file_path in file_paths:
+            try:
+                report_type = extract_report_type_from_filename(file_path)
+                if report_type:
+                    report_content = read_report(file_path)
+                    if report_content:  # Seulement si le contenu a été lu avec succès
+                        reports[file_path] = {
+                            "path": file_path,
+                            "type": report_type,
+                            "content": report_content,
+                        }
+            except Exception as e:
+                print(f"Erreur lors du chargement du rapport {file_path}: {e}")
+        return reports
+
+
+_knowledge_bases: Dict[Tuple[Path, str], KnowledgeBase] = {}
+_knowledge_bases_lock = threading.Lock()
+
+
+def get_knowledge_base(path, index_path=None, backend: Optional[str] = None) -> KnowledgeBase:
+    """Returns the process-wide knowledge base for a directory and retrieval backend."""
+    backend = backend or default_backend()
+    key = (Path(path).resolve(), backend)
+    with _knowledge_bases_lock:
+        knowledge_base = _knowledge_bases.get(key)
+        if knowledge_base is None:
+            knowledge_base = KnowledgeBase(key[0], index_path, backend=backend)
+            _knowledge_bases[key] = knowledge_base
+        return knowledge_base
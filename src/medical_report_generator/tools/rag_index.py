@@ -0,0 +1,368 @@
+import json
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import joblib
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# Basic list of French stopwords
+FRENCH_STOPWORDS = [
+    "au",
+    "aux",
+    "avec",
+    "ce",
+    "ces",
+    "dans",
+    "de",
+    "des",
+    "du",
+    "elle",
+    "en",
+    "et",
+    "eux",
+    "il",
+    "ils",
+    "je",
+    "la",
+    "le",
+    "les",
+    "leur",
+    "lui",
+    "ma",
+    "mais",
+    "me",
+    "même",
+    "mes",
+    "moi",
+    "mon",
+    "ne",
+    "nos",
+    "notre",
+    "nous",
+    "on",
+    "ou",
+    "par",
+    "pas",
+    "pour",
+    "qu",
+    "que",
+    "qui",
+    "sa",
+    "se",
+    "ses",
+    "son",
+    "sur",
+    "ta",
+    "te",
+    "tes",
+    "toi",
+    "ton",
+    "tu",
+    "un",
+    "une",
+    "vos",
+    "votre",
+    "vous",
+    "c",
+    "d",
+    "j",
+    "l",
+    "à",
+    "m",
+    "n",
+    "s",
+    "t",
+    "y",
+    "été",
+    "étée",
+    "étées",
+    "étés",
+    "étant",
+    "étante",
+    "étants",
+    "étantes",
+    "suis",
+    "es",
+    "est",
+    "sommes",
+    "êtes",
+    "sont",
+    "serai",
+    "seras",
+    "sera",
+    "serons",
+    "serez",
+    "seront",
+    "aurais",
+    "aura",
+    "aurons",
+    "aurez",
+    "auront",
+    "avais",
+    "avait",
+    "avions",
+    "aviez",
+    "avaient",
+    "eut",
+    "eûmes",
+    "eûtes",
+    "eurent",
+    "ai",
+    "as",
+    "avons",
+    "avez",
+    "ont",
+    "aurai",
+    "auras",
+    "aura",
+    "aurons",
+    "aurez",
+    "auront",
+    "fus",
+    "fut",
+    "fûmes",
+    "fûtes",
+    "furent",
+]
+
+
+INDEX_VERSION = 4
+
+
+def default_index_path(knowledge_base_path, backend: str = "tfidf") -> Path:
+    """Returns the directory holding the prebuilt index of a knowledge base."""
+    knowledge_base_path = Path(knowledge_base_path)
+    suffix = "index" if backend == "tfidf" else f"{backend}_index"
+    return knowledge_base_path.parent / f"{knowledge_base_path.name}_{suffix}"
+
+
+def top_k_rows(
+    rows: Sequence[int], similarities: np.ndarray, top_k: int
+) -> List[Tuple[int, float]]:
+    """Returns the top_k (row, similarity) pairs by decreasing similarity."""
+    if top_k <= 0 or not len(rows):
+        return []
+    if top_k < len(similarities):
+        candidates = np.argpartition(-similarities, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(len(similarities))
+    # Tri stable : à similarité égale, l'ordre de l'index est conservé
+    candidates = candidates[np.lexsort((candidates, -similarities[candidates]))]
+    return [(int(rows[i]), float(similarities[i])) for i in candidates]
+
+
+def replace_file(path: Path, write: Callable) -> None:
+    """Writes a file through a temporary file and an atomic rename.
+
+    Readers that memory-mapped or opened the previous version keep reading it.
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+class ReportIndex:
+    """Similarity index over the documents (doc_id -> text) of a knowledge base.
+
+    Subclasses define how texts are encoded and rows scored; rows are
+    L2-normalised, so similarities are cosine similarities. Indexes are
+    immutable once published: :meth:`update` returns a new index.
+    """
+
+    backend = ""
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, matrix=None, doc_ids: Sequence[str] = (), metadata: Optional[Dict] = None):
+        self.matrix = matrix
+        self.doc_ids: List[str] = list(doc_ids)
+        self.metadata: Dict = dict(metadata or {})
+        self._rows = {doc_id: row for row, doc_id in enumerate(self.doc_ids)}
+
+    @classmethod
+    def build(cls, documents: Dict[str, str]) -> "ReportIndex":
+        raise NotImplementedError
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.matrix is not None
+
+    @property
+    def options(self) -> Dict:
+        """Build options saved in the manifest; a saved index is reused only if they match."""
+        return {}
+
+    @property
+    def approximate(self) -> bool:
+        """Whether :meth:`search` is approximate rather than an exact scan."""
+        return False
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def row(self, doc_id: str) -> Optional[int]:
+        return self._rows.get(doc_id)
+
+    def encode(self, texts: Sequence[str]):
+        """Encodes texts into query vectors (one row per text)."""
+        raise NotImplementedError
+
+    def slice(self, rows: Sequence[int]):
+        return self.matrix[rows]
+
+    def similarities(self, query_vectors, matrix=None) -> np.ndarray:
+        """Dense (n_queries, n_rows) similarities against ``matrix`` (all rows by default)."""
+        raise NotImplementedError
+
+    def score(self, query: str, rows: Optional[Sequence[int]] = None) -> np.ndarray:
+        """Cosine similarity of the query against all rows, or only the given rows."""
+        if not self.is_fitted:
+            return np.zeros(len(rows) if rows is not None else 0, dtype=np.float32)
+        matrix = self.matrix if rows is None else self.slice(rows)
+        return self.similarities(self.encode([query]), matrix)[0]
+
+    def search(self, query_vector, top_k: int) -> List[Tuple[int, float]]:
+        """Top-k (row, similarity) pairs over the whole index for one query vector."""
+        if not self.is_fitted:
+            return []
+        similarities = self.similarities(query_vector)[0]
+        return top_k_rows(np.arange(len(self)), similarities, top_k)
+
+    def update(self, removed: Iterable[str], documents: Dict[str, str]) -> "ReportIndex":
+        """Returns a copy without the ``removed`` rows and with ``documents`` (re)encoded.
+
+        The encoder is not refitted: rebuild the index to learn new terms.
+        """
+        dropped = set(removed) | set(documents)
+        kept_rows = [
+            row for row, doc_id in enumerate(self.doc_ids) if doc_id not in dropped
+        ]
+        new_vectors = self.encode(list(documents.values())) if documents else None
+        return self._updated(
+            kept_rows,
+            new_vectors,
+            [self.doc_ids[row] for row in kept_rows] + list(documents),
+        )
+
+    def _updated(self, kept_rows, new_vectors, doc_ids) -> "ReportIndex":
+        raise NotImplementedError
+
+    def save(self, directory) -> None:
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        if self.is_fitted:
+            self._save_arrays(directory)
+        manifest = {
+            "version": INDEX_VERSION,
+            "backend": self.backend,
+            "options": self.options,
+            "doc_ids": self.doc_ids,
+            "metadata": self.metadata,
+        }
+        replace_file(
+            directory / self.MANIFEST_FILE,
+            lambda f: f.write(json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")),
+        )
+
+    def _save_arrays(self, directory: Path) -> None:
+        raise NotImplementedError
+
+    @classmethod
+    def load(cls, directory, **options) -> Optional["ReportIndex"]:
+        """Loads a saved index, or returns None if it is missing, outdated or built differently."""
+        directory = Path(directory)
+        if not (directory / cls.MANIFEST_FILE).exists():
+            return None
+        try:
+            with open(directory / cls.MANIFEST_FILE, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if (
+                manifest.get("version") != INDEX_VERSION
+                or manifest.get("backend") != cls.backend
+            ):
+                return None
+            return cls._load_arrays(directory, manifest, **options)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Index introuvable ou illisible dans {directory}: {e}")
+            return None
+
+    @classmethod
+    def _load_arrays(cls, directory: Path, manifest: Dict, **options) -> Optional["ReportIndex"]:
+        raise NotImplementedError
+
+
+class TfidfReportIndex(ReportIndex):
+    """Fitted TF-IDF vectorizer and sparse document matrix of a knowledge base.
+
+    The vectorizer is fitted once on the whole knowledge base; queries are then
+    scored with a single ``transform`` and one sparse dot product.
+    """
+
+    backend = "tfidf"
+    VECTORIZER_FILE = "vectorizer.joblib"
+    MATRIX_FILE = "matrix.npz"
+
+    def __init__(
+        self,
+        vectorizer: Optional[TfidfVectorizer] = None,
+        matrix: Optional[sparse.csr_matrix] = None,
+        doc_ids: Sequence[str] = (),
+        metadata: Optional[Dict] = None,
+    ):
+        super().__init__(matrix, doc_ids, metadata)
+        self.vectorizer = vectorizer
+
+    @staticmethod
+    def new_vectorizer() -> TfidfVectorizer:
+        return TfidfVectorizer(stop_words=FRENCH_STOPWORDS, max_features=5000)
+
+    @classmethod
+    def build(cls, documents: Dict[str, str]) -> "TfidfReportIndex":
+        """Fits the vectorizer on the documents (doc_id -> text) and vectorizes them."""
+        doc_ids = list(documents)
+        vectorizer = cls.new_vectorizer()
+        try:
+            matrix = vectorizer.fit_transform([documents[d] for d in doc_ids])
+        except ValueError as e:
+            # Base vide ou vocabulaire vide après filtrage des stopwords
+            print(f"Attention: index TF-IDF vide ({e})")
+            return cls(doc_ids=[])
+        return cls(vectorizer, sparse.csr_matrix(matrix, dtype=np.float32), doc_ids)
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.vectorizer is not None and self.matrix is not None
+
+    def encode(self, texts: Sequence[str]) -> sparse.csr_matrix:
+        return sparse.csr_matrix(self.vectorizer.transform(texts), dtype=np.float32)
+
+    def similarities(self, query_vectors, matrix=None) -> np.ndarray:
+        matrix = self.matrix if matrix is None else matrix
+        return (query_vectors @ matrix.T).toarray()
+
+    def _updated(self, kept_rows, new_vectors, doc_ids) -> "TfidfReportIndex":
+        blocks = [self.matrix[kept_rows]]
+        if new_vectors is not None:
+            blocks.append(new_vectors)
+        return TfidfReportIndex(
+            self.vectorizer, sparse.vstack(blocks, format="csr"), doc_ids, self.metadata
+        )
+
+    def _save_arrays(self, directory: Path) -> None:
+        replace_file(
+            directory / self.VECTORIZER_FILE, lambda f: joblib.dump(self.vectorizer, f)
+        )
+        replace_file(
+            directory / self.MATRIX_FILE, lambda f: sparse.save_npz(f, self.matrix)
+        )
+
+    @classmethod
+    def _load_arrays(cls, directory: Path, manifest: Dict, **options) -> "TfidfReportIndex":
+        if not manifest["doc_ids"]:
+            return cls(doc_ids=[], metadata=manifest.get("metadata"))
+        vectorizer = joblib.load(directory / cls.VECTORIZER_FILE)
+        matrix = sparse.load_npz(directory / cls.MATRIX_FILE).tocsr()
+        return cls(vectorizer, matrix, manifest["doc_ids"], manifest.get("metadata"))
@@ -0,0 +1,75 @@
+import re
+from typing import Dict, Iterator, Optional, Tuple
+
+# Sections d'un compte rendu, dans l'ordre du document
+SECTION_NAMES = ("TITRE", "Indication", "Technique", "Incidences", "Résultat", "Conclusion")
+
+_CANONICAL_NAMES = {name.lower(): name for name in SECTION_NAMES}
+
+# En-tête en début de ligne (indentation permise), sans espace avant les deux-points
+_HEADER = re.compile(
+    r"^[ \t]*(" + "|".join(map(re.escape, SECTION_NAMES)) + r"):",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+class ReportSections:
+    """Sections of a report text, kept as offsets into it.
+
+    ``spans`` maps each section found to the (start, end) offsets of its
+    content in ``text``: from the end of its header to the start of the next
+    header, or the end of the text. Section texts are only built when asked
+    for, by :meth:`get`.
+    """
+
+    __slots__ = ("text", "spans")
+
+    def __init__(self, text: str, spans: Dict[str, Tuple[int, int]]):
+        self.text = text
+        self.spans = spans
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.spans
+
+    def __iter__(self) -> Iterator[str]:
+        """Section names, in the order of the document."""
+        return iter(self.spans)
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def get(self, name: str, default: Optional[str] = None, separator: str = "\n") -> Optional[str]:
+        """The non-empty lines of a section, stripped and joined by separator."""
+        span = self.spans.get(name)
+        if span is None:
+            return default
+        start, end = span
+        return separator.join(
+            line.strip() for line in self.text[start:end].splitlines() if line.strip()
+        )
+
+    def to_dict(self, include_empty: bool = True, separator: str = "\n") -> Dict[str, str]:
+        """The text of every section by name, optionally without the empty ones."""
+        sections = {name: self.get(name, separator=separator) for name in self.spans}
+        if include_empty:
+            return sections
+        return {name: content for name, content in sections.items() if content}
+
+
+def parse_sections(text: str) -> ReportSections:
+    """Finds the sections of a report in one pass of a compiled regex.
+
+    Headers (``SECTION_NAMES`` followed by a colon) are recognized at the
+    start of a line, whatever their case, and named as in ``SECTION_NAMES``.
+    Text before the first header is ignored; a section repeated later in the
+    text replaces the earlier one.
+    """
+    spans: Dict[str, Tuple[int, int]] = {}
+    name, start = None, 0
+    for match in _HEADER.finditer(text):
+        if name is not None:
+            spans[name] = (start, match.start())
+        name, start = _CANONICAL_NAMES[match.group(1).lower()], match.end()
+    if name is not None:
+        spans[name] = (start, len(text))
+    return ReportSections(text, spans)
@@ -0,0 +1,233 @@
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from medical_report_generator.tools.rag_index import ReportIndex, top_k_rows
+
+# Types produits par le classifieur -> types présents dans la base de connaissances
+TYPE_ALIASES: Dict[str, List[str]] = {
+    "hepatique": ["foie", "biliaire"],
+    "abdominale": ["foie", "biliaire", "reins", "entero"],
+    "cerebrale": [
+        "avc",
+        "crane",
+        "cephalees",
+        "sep",
+        "hypophyse",
+        "epilepsie",
+        "demence",
+        "psy",
+        "stereotaxie",
+        "conduits_auditifs_internes",
+    ],
+    "cardiaque": [
+        "cardiomyopathie",
+        "myocardite",
+        "amylose",
+        "dysplasie_arythmogene",
+        "insuffisance_aortique",
+        "aorte",
+    ],
+    "sein": ["mammaire"],
+    "pelvis": ["pelvis", "endometriose", "myomes", "cancer_de_l_endometre"],
+    "entero_mici": ["entero"],
+}
+
+MAX_CACHED_LOOKUPS = 1024
+
+# Nombre de requêtes scorées par produit matriciel dans search_batch
+BATCH_CHUNK = 256
+
+# Séparateur entre nom de fichier et nom de section dans les doc ids de l'index des sections
+SECTION_SEPARATOR = "#"
+
+
+def normalize_report_type(report_type: str) -> str:
+    """Normalizes a report type: no accents, lowercase, '_' separators, no 'irm_' prefix."""
+    folded = unicodedata.normalize("NFKD", report_type)
+    folded = "".join(c for c in folded if not unicodedata.combining(c)).lower()
+    folded = re.sub(r"[^a-z0-9]+", "_", folded).strip("_")
+    if folded.startswith("irm_"):
+        folded = folded[len("irm_") :]
+    return folded
+
+
+def normalize_section(section: str) -> str:
+    """Normalizes a section name: 'Résultats:' and 'resultat' give the same key."""
+    return normalize_report_type(section.strip().rstrip(":")).rstrip("s")
+
+
+def type_keys(report_type: str) -> List[str]:
+    """Returns the normalized type and all its '_'-separated prefixes."""
+    parts = normalize_report_type(report_type).split("_")
+    return ["_".join(parts[: i + 1]) for i in range(len(parts)) if parts[0]]
+
+
+class TypePartitions:
+    """Inverted index from normalized report type (and section) to rows of a ReportIndex.
+
+    The inverted index is built eagerly; the matrix slice of each requested
+    (type, section) pair is built on first use and cached, so a filtered query
+    only scores the rows of its partition. Section rows have doc ids of the form
+    ``<file name>#<section>``.
+    """
+
+    def __init__(self, index: ReportIndex, doc_types: Dict[str, str]):
+        self.index = index
+        rows_by_key = defaultdict(list)
+        rows_by_section = defaultdict(list)
+        for row, doc_id in enumerate(index.doc_ids):
+            file_name, _, section = doc_id.partition(SECTION_SEPARATOR)
+            report_type = doc_types.get(file_name)
+            if report_type:
+                for key in type_keys(report_type):
+                    rows_by_key[key].append(row)
+            if section:
+                rows_by_section[normalize_section(section)].append(row)
+        self._rows_by_key = {
+            key: np.asarray(rows, dtype=np.int64) for key, rows in rows_by_key.items()
+        }
+        self._rows_by_section = {
+            key: np.asarray(rows, dtype=np.int64) for key, rows in rows_by_section.items()
+        }
+        self._lookups: Dict[Tuple[str, str], Tuple[np.ndarray, object]] = {}
+
+    @property
+    def keys(self) -> List[str]:
+        return sorted(self._rows_by_key)
+
+    @property
+    def sections(self) -> List[str]:
+        return sorted(self._rows_by_section)
+
+    def rows(
+        self, report_type: Optional[str], section: Optional[str] = None
+    ) -> Optional[np.ndarray]:
+        """Rows of the given type and section, or None when every row matches."""
+        key = self._key(report_type, section)
+        if key is None:
+            return None
+        return self._lookup(key)[0]
+
+    def score(
+        self, query: str, report_type: Optional[str], section: Optional[str] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Scores the query against the rows of a partition; returns (rows, similarities)."""
+        if not self.index.is_fitted:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        key = self._key(report_type, section)
+        if key is None:
+            rows = np.arange(len(self.index), dtype=np.int64)
+            matrix = self.index.matrix
+        else:
+            rows, matrix = self._lookup(key)
+            if not len(rows):
+                return rows, np.empty(0, dtype=np.float32)
+        query_vectors = self.index.encode([query])
+        return rows, self.index.similarities(query_vectors, matrix)[0]
+
+    def search(
+        self,
+        query: str,
+        report_type: Optional[str],
+        top_k: int,
+        section: Optional[str] = None,
+    ) -> List[Tuple[int, float]]:
+        """Top-k (row, similarity) pairs for the query within a partition.
+
+        Unfiltered queries go through the index's own top-k search (approximate
+        for ANN backends); filtered queries are scored exactly on their partition.
+        """
+        if not self.index.is_fitted:
+            return []
+        if self._key(report_type, section) is None:
+            return self.index.search(self.index.encode([query]), top_k)
+        rows, similarities = self.score(query, report_type, section)
+        return top_k_rows(rows, similarities, top_k)
+
+    def search_batch(
+        self,
+        queries: Sequence[str],
+        report_types: Sequence[Optional[str]],
+        top_k: int,
+        section: Optional[str] = None,
+    ) -> List[List[Tuple[int, float]]]:
+        """Top-k (row, similarity) pairs for each query, as :meth:`search` would return.
+
+        Queries are encoded together, then the queries of each partition are
+        scored with one product against that partition's cached matrix slice
+        (per chunk of ``BATCH_CHUNK`` queries), i.e. the very operands of the
+        single-query path, so scores and ties are identical.
+        """
+        if not self.index.is_fitted:
+            return [[] for _ in queries]
+        keys = [self._key(report_type, section) for report_type in report_types]
+        groups = defaultdict(list)
+        for i, key in enumerate(keys):
+            groups[key].append(i)
+
+        results: List[List[Tuple[int, float]]] = [[] for _ in queries]
+        for key, positions in groups.items():
+            if key is None:
+                rows = np.arange(len(self.index), dtype=np.int64)
+                matrix = self.index.matrix
+            else:
+                rows, matrix = self._lookup(key)
+                if not len(rows):
+                    continue
+            for start in range(0, len(positions), BATCH_CHUNK):
+                chunk = positions[start : start + BATCH_CHUNK]
+                query_vectors = self.index.encode([queries[i] for i in chunk])
+                if key is None and self.index.approximate:
+                    # Recherche ANN sur toute la base, comme search()
+                    for j, i in enumerate(chunk):
+                        results[i] = self.index.search(query_vectors[j : j + 1], top_k)
+                    continue
+                similarities = self.index.similarities(query_vectors, matrix)
+                for j, i in enumerate(chunk):
+                    results[i] = top_k_rows(rows, similarities[j], top_k)
+        return results
+
+    @staticmethod
+    def _key(report_type: Optional[str], section: Optional[str]) -> Optional[Tuple[str, str]]:
+        type_key = (
+            ""
+            if not report_type or report_type.lower() == "all"
+            else normalize_report_type(report_type)
+        )
+        section_key = normalize_section(section) if section else ""
+        if not type_key and not section_key:
+            return None
+        return type_key, section_key
+
+    def _lookup(self, key: Tuple[str, str]):
+        cached = self._lookups.get(key)
+        if cached is not None:
+            return cached
+
+        type_key, section_key = key
+        rows = self._type_rows(type_key) if type_key else None
+        if section_key:
+            section_rows = self._rows_by_section.get(
+                section_key, np.empty(0, dtype=np.int64)
+            )
+            rows = section_rows if rows is None else np.intersect1d(rows, section_rows)
+        matrix = self.index.slice(rows) if self.index.is_fitted else None
+
+        if len(self._lookups) >= MAX_CACHED_LOOKUPS:
+            self._lookups.clear()
+        self._lookups[key] = (rows, matrix)
+        return rows, matrix
+
+    def _type_rows(self, key: str) -> np.ndarray:
+        matched = [key] if key in self._rows_by_key else []
+        matched += [alias for alias in TYPE_ALIASES.get(key, []) if alias in self._rows_by_key]
+        if not matched:
+            # Repli : même sémantique que l'ancien filtrage par sous-chaîne, sur les clés
+            matched = [k for k in self._rows_by_key if key in k]
+        if not matched:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate([self._rows_by_key[k] for k in matched]))
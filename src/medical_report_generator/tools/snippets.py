@@ -0,0 +1,89 @@
+import re
+import unicodedata
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from medical_report_generator.tools.rag_index import ReportIndex
+
+# Approximation courante pour le français avec les tokenizers des LLM
+CHARS_PER_TOKEN = 4
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?;])\s+|\n+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Splits section text into sentences (and list lines)."""
+    return [s.strip() for s in _SENTENCE_BOUNDARY.split(text) if s and s.strip()]
+
+
+def sentence_key(sentence: str) -> str:
+    """Dedup key: accent-folded, lowercase, punctuation and spacing removed."""
+    folded = unicodedata.normalize("NFKD", sentence)
+    folded = "".join(c for c in folded if not unicodedata.combining(c)).lower()
+    return re.sub(r"\W+", " ", folded).strip()
+
+
+def select_snippets(
+    query: str,
+    reports: Sequence[Dict],
+    sections: Sequence[Sequence[str]],
+    index: ReportIndex,
+    budget_chars: int,
+) -> Tuple[List[Dict[str, List[str]]], Dict[str, int]]:
+    """Extractive selection of the sentences of ``reports`` most similar to the query.
+
+    Sentences already seen in a better-ranked report (boilerplate such as
+    "Absence d'épanchement") are dropped, then the remaining ones are taken by
+    decreasing similarity to the query until ``budget_chars`` is spent.
+    ``sections`` lists, for each report, the sections to draw from. Returns,
+    for each report, the kept sentences per section in their original order,
+    and counters describing what was left out.
+    """
+    candidates = []  # (report position, section, sentence position, sentence)
+    seen = set()
+    duplicates = 0
+    for report_position, (report, report_sections) in enumerate(zip(reports, sections)):
+        for section in report_sections:
+            text = report["content"].get(section)
+            if not text:
+                continue
+            for sentence_position, sentence in enumerate(split_sentences(text)):
+                key = sentence_key(sentence)
+                if not key:
+                    continue
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                candidates.append((report_position, section, sentence_position, sentence))
+
+    selected = set()
+    used_chars = 0
+    if candidates and index.is_fitted:
+        sentences = [candidate[3] for candidate in candidates]
+        similarities = index.similarities(
+            index.encode([query]), index.encode(sentences)
+        )[0]
+        # Similarité décroissante, puis rang du rapport et ordre d'apparition
+        order = np.lexsort((np.arange(len(candidates)), -similarities))
+        for i in order:
+            cost = len(candidates[i][3]) + 1
+            if used_chars + cost > budget_chars:
+                continue
+            selected.add(int(i))
+            used_chars += cost
+
+    snippets: List[Dict[str, List[str]]] = [{} for _ in reports]
+    for i, (report_position, section, _, sentence) in enumerate(candidates):
+        if i in selected:
+            snippets[report_position].setdefault(section, []).append(sentence)
+
+    stats = {
+        "sentences": len(candidates) + duplicates,
+        "kept": len(selected),
+        "omitted": len(candidates) - len(selected),
+        "duplicates": duplicates,
+        "chars": used_chars,
+    }
+    return snippets, stats
@@ -0,0 +1,61 @@
+import pytest
+
+from medical_report_generator import benchmark
+from medical_report_generator.crew import MedicalReportGenerator
+from medical_report_generator.crew_pool import CrewPool
+from medical_report_generator.rate_limit import rate_limiter
+
+
+class _Crew:
+    def crew(self):
+        pass
+
+    def reset(self):
+        pass
+
+
+def _build():
+    return {"generator": _Crew(), "configuration": 0.0, "agents_and_tasks": 0.0, "total": 0.0}
+
+
+def test_run_benchmark_restores_the_process_settings(monkeypatch, tmp_path):
+    pool = CrewPool(size=1)
+    monkeypatch.setattr(pool, "_build", _build)
+    monkeypatch.setattr(benchmark, "crew_pool", pool)
+    monkeypatch.setattr(benchmark, "load_test_cases", lambda: [("a", "prompt", "rapport")])
+
+    def benchmark_pipeline(*args):
+        assert MedicalReportGenerator.llm_model == benchmark.STUB_MODEL
+        assert rate_limiter.requests_per_minute == 0
+        raise RuntimeError("interrompu")
+
+    monkeypatch.setattr(benchmark, "benchmark_pipeline", benchmark_pipeline)
+    settings = (
+        MedicalReportGenerator.llm_model,
+        MedicalReportGenerator.llm_base_url,
+        MedicalReportGenerator.llm_api_key,
+        rate_limiter.requests_per_minute,
+        rate_limiter.tokens_per_minute,
+    )
+    with pytest.raises(RuntimeError):
+        benchmark.run_benchmark(concurrency=3, output=tmp_path / "bench.json")
+
+    assert settings == (
+        MedicalReportGenerator.llm_model,
+        MedicalReportGenerator.llm_base_url,
+        MedicalReportGenerator.llm_api_key,
+        rate_limiter.requests_per_minute,
+        rate_limiter.tokens_per_minute,
+    )
+    # Aucune équipe liée au serveur local arrêté ne reste dans le pool
+    assert pool.size == 1
+    assert pool.stats()["idle"] == 0
+
+
+def test_drained_instances_do_not_return_to_the_pool(monkeypatch):
+    pool = CrewPool(size=1)
+    monkeypatch.setattr(pool, "_build", _build)
+    pool.warm()
+    with pool.checkout():
+        pool.drain()
+    assert pool.stats()["idle"] == 0
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import pytest
+
+from medical_report_generator.tools.classifier_tool import (
+    KeywordMatcher,
+    MedicalReportClassifierTool,
+)
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+VOCABULARY_PATH = PROJECT_ROOT / "knowledge" / "report_type_keywords.yaml"
+
+
+@pytest.fixture
+def matcher():
+    return KeywordMatcher.from_file(VOCABULARY_PATH)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Contrôle une fois par an.",
+        "Étude menée chez les rats.",
+        "Premier examen raté, patient agité.",
+        "Lésion au sein du parenchyme.",
+        "Nodule au sein d’un ganglion.",
+    ],
+)
+def test_common_words_are_not_keywords(matcher, text):
+    assert matcher.scores(text) == {}
+
+
+@pytest.mark.parametrize(
+    "text, report_type",
+    [
+        ("Ménisques fissurés", "irm_genou"),
+        ("Lésions hepatiques", "irm_hepatique"),
+        ("Arthrose des disques dorsaux", "irm_rachis"),
+        ("Stéatose du FOIE", "irm_hepatique"),
+        ("Rate de taille normale", "irm_abdominale"),
+    ],
+)
+def test_keywords_match_their_inflections(matcher, text, report_type):
+    assert report_type in matcher.scores(text)
+
+
+def test_suffix_only_matches_its_own_inflections():
+    matcher = KeywordMatcher({"irm_rachis": ["cervical"], "irm_cerebrale": ["céphalée"]})
+    assert matcher.scores("douleurs cervicales") == {"irm_rachis": 1}
+    assert matcher.scores("cervicalgie") == {}
+    assert matcher.scores("céphalées") == {"irm_cerebrale": 1}
+    assert matcher.scores("céphalés") == {}
+
+
+def test_ankle_report_is_not_classified_as_shoulder():
+    report = (PROJECT_ROOT / "knowledge" / "reports" / "testing" / "irm_cheville_007.txt").read_text(
+        encoding="utf-8"
+    )
+    classifier = MedicalReportClassifierTool(vocabulary_path=VOCABULARY_PATH)
+    assert classifier.classify(report)[0] == "irm_general"
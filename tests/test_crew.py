@@ -0,0 +1,27 @@
+from pathlib import Path
+
+import pytest
+
+from medical_report_generator.crew import CLASSIFIER_TASK_REPORT_TYPE, MedicalReportGenerator
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    # Le classifieur lit knowledge/report_type_keywords.yaml depuis la racine du projet
+    monkeypatch.chdir(Path(__file__).resolve().parent.parent)
+    return MedicalReportGenerator()
+
+
+def test_single_keyword_hit_goes_through_the_llm_classifier(generator):
+    # Un seul mot-clé, aucun autre type : marge de 1, mais score trop faible
+    inputs = generator.prepare_inputs({"raw_input": "Douleur hépatique depuis deux jours."})
+    assert generator.report_type is None
+    assert inputs["report_type"] == CLASSIFIER_TASK_REPORT_TYPE
+
+
+def test_clear_keyword_classification_skips_the_llm_classifier(generator):
+    inputs = generator.prepare_inputs(
+        {"raw_input": "IRM du genou : fissure du ménisque interne, LCA intact."}
+    )
+    assert generator.report_type == "irm_genou"
+    assert inputs["report_type"] == "irm_genou"
@@ -0,0 +1,183 @@
+import asyncio
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from api import jobs
+from api.database import Base
+from api.jobs import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JobQueue
+from api.models import Job
+from medical_report_generator.errors import GenerationResult
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(jobs, "SessionLocal", factory)
+    return factory
+
+
+def _add_job(factory, job_id, status, heartbeat_at=None):
+    db = factory()
+    db.add(
+        Job(
+            id=job_id,
+            prompt_text="IRM du genou",
+            status=status,
+            created_at=datetime.utcnow(),
+            heartbeat_at=heartbeat_at,
+        )
+    )
+    db.commit()
+    db.close()
+
+
+def _status(factory, job_id):
+    db = factory()
+    try:
+        return db.get(Job, job_id).status
+    finally:
+        db.close()
+
+
+def test_a_job_is_claimed_once(session_factory):
+    _add_job(session_factory, "a", JOB_QUEUED)
+    first, second = JobQueue(workers=1), JobQueue(workers=1)
+    assert first._claim() == "a"
+    assert second._claim() is None
+
+
+def test_recovery_leaves_jobs_of_live_processes_running(session_factory):
+    _add_job(session_factory, "vivant", JOB_RUNNING, heartbeat_at=datetime.utcnow())
+    _add_job(
+        session_factory, "abandonne", JOB_RUNNING,
+        heartbeat_at=datetime.utcnow() - timedelta(minutes=10),
+    )
+    assert JobQueue(workers=1)._recover_stale() == 1
+    assert _status(session_factory, "vivant") == JOB_RUNNING
+    assert _status(session_factory, "abandonne") == JOB_QUEUED
+
+
+def test_a_job_whose_report_cannot_be_saved_fails(monkeypatch, session_factory):
+    def save_report(*args):
+        raise OSError("disque plein")
+
+    monkeypatch.setattr(jobs, "run", lambda *args, **kwargs: GenerationResult())
+    monkeypatch.setattr(jobs, "save_report", save_report)
+    _add_job(session_factory, "a", JOB_QUEUED)
+    queue = JobQueue(workers=1)
+    queue._execute(queue._claim())
+    assert _status(session_factory, "a") == JOB_FAILED
+
+
+def test_a_batch_runs_at_most_its_concurrency(session_factory):
+    db = session_factory()
+    for job_id in ("a", "b"):
+        db.add(
+            Job(
+                id=job_id,
+                prompt_text="IRM du genou",
+                status=JOB_QUEUED,
+                batch_id="lot",
+                batch_concurrency=1,
+                created_at=datetime.utcnow(),
+            )
+        )
+    db.commit()
+    db.close()
+    queue = JobQueue(workers=2)
+    assert queue._claim() == "a"
+    assert queue._claim() is None
+
+
+def test_a_cache_write_failure_does_not_fail_the_job(monkeypatch, session_factory):
+    def put(*args):
+        raise RuntimeError("UNIQUE constraint failed")
+
+    report = type("Report", (), {"id": 1, "generated_report_path": "a.docx", "error_message": None})
+    monkeypatch.setattr(jobs, "run", lambda *args, **kwargs: GenerationResult())
+    monkeypatch.setattr(jobs, "save_report", lambda *args: report)
+    monkeypatch.setattr(jobs.report_cache, "put", put)
+    _add_job(session_factory, "a", JOB_QUEUED)
+    queue = JobQueue(workers=1)
+    queue._execute(queue._claim())
+    assert _status(session_factory, "a") == JOB_SUCCEEDED
+
+
+def test_an_unsaved_report_is_not_cached(monkeypatch, session_factory):
+    def save_report(*args):
+        raise OSError("disque plein")
+
+    puts = []
+    monkeypatch.setattr(
+        jobs, "run", lambda *args, **kwargs: GenerationResult(report_text="x", filename="a.docx")
+    )
+    monkeypatch.setattr(jobs, "save_report", save_report)
+    monkeypatch.setattr(jobs.report_cache, "put", lambda *args: puts.append(args))
+    _add_job(session_factory, "a", JOB_QUEUED)
+    queue = JobQueue(workers=1)
+    queue._execute(queue._claim())
+    assert _status(session_factory, "a") == JOB_FAILED
+    assert puts == []
+
+
+def test_putting_the_same_prompt_twice_updates_the_entry(monkeypatch, session_factory):
+    # La version de configuration du cache lit les YAML depuis la racine du projet
+    monkeypatch.chdir(Path(__file__).resolve().parent.parent)
+    db = session_factory()
+    jobs.report_cache.put(db, "IRM du genou", "premier")
+    jobs.report_cache.put(db, "IRM  du genou ", "second")
+    assert jobs.report_cache.get(db, "IRM du genou") == "second"
+    db.close()
+
+
+def _finish_elsewhere(factory, job_id):
+    # Job terminé par un autre processus : seule la base le sait
+    db = factory()
+    job = db.get(Job, job_id)
+    job.status = JOB_SUCCEEDED
+    job.finished_at = datetime.utcnow()
+    db.commit()
+    db.close()
+
+
+def test_wait_sees_a_job_finished_by_another_process(session_factory):
+    _add_job(session_factory, "a", JOB_RUNNING, heartbeat_at=datetime.utcnow())
+    queue = JobQueue(workers=1)
+    queue.poll_interval = 0.05
+
+    async def wait():
+        asyncio.get_running_loop().call_later(0.1, _finish_elsewhere, session_factory, "a")
+        return await queue.wait("a", timeout=5)
+
+    assert asyncio.run(wait())
+
+
+def test_wait_gives_up_after_its_timeout(session_factory):
+    _add_job(session_factory, "a", JOB_RUNNING, heartbeat_at=datetime.utcnow())
+    queue = JobQueue(workers=1)
+    queue.poll_interval = 0.05
+    assert not asyncio.run(queue.wait("a", timeout=0.2))
+    assert queue._waiters == {}
+
+
+def test_events_end_when_another_process_finishes_the_job(session_factory):
+    _add_job(session_factory, "a", JOB_RUNNING, heartbeat_at=datetime.utcnow())
+    queue = JobQueue(workers=1)
+    queue.poll_interval = 0.05
+
+    async def events():
+        asyncio.get_running_loop().call_later(0.1, _finish_elsewhere, session_factory, "a")
+        return [event async for event in queue.events("a")]
+
+    events = asyncio.run(asyncio.wait_for(events(), 5))
+    assert [event["event"] for event in events] == ["job_finished"]
+    assert events[0]["status"] == JOB_SUCCEEDED
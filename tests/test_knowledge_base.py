@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from medical_report_generator.tools.knowledge_base import KnowledgeBase
+from medical_report_generator.tools.rag_index import TfidfReportIndex
+
+
+def _report(conclusion: str) -> str:
+    return (
+        "TITRE: IRM\n"
+        "Indication: Douleur.\n"
+        "Résultat: Examen réalisé sans injection.\n"
+        f"Conclusion: {conclusion}\n"
+    )
+
+
+@pytest.fixture
+def knowledge_base(tmp_path):
+    path = tmp_path / "training"
+    path.mkdir()
+    (path / "irm_genou_001.txt").write_text(_report("Fissure méniscale interne."), encoding="utf-8")
+    (path / "irm_epaule_002.txt").write_text(_report("Tendinopathie du supra-épineux."), encoding="utf-8")
+    (path / "irm_rachis_003.txt").write_text(_report("Hernie discale L4-L5."), encoding="utf-8")
+    knowledge_base = KnowledgeBase(path, refresh_interval=0, backend="tfidf")
+    knowledge_base.load()
+    return knowledge_base
+
+
+def test_refresh_encodes_only_the_changed_files(monkeypatch, knowledge_base):
+    path = knowledge_base.path
+    unchanged_vector = knowledge_base.index.matrix[
+        knowledge_base.index.row("irm_epaule_002.txt")
+    ].toarray()
+    parsed, encoded = [], []
+    parse = KnowledgeBase._parse
+    encode = TfidfReportIndex.encode
+
+    def spy_parse(self, file_paths):
+        file_paths = list(file_paths)
+        parsed.extend(file_paths)
+        return parse(self, file_paths)
+
+    def spy_encode(self, texts):
+        encoded.append(len(texts))
+        return encode(self, texts)
+
+    monkeypatch.setattr(KnowledgeBase, "_parse", spy_parse)
+    monkeypatch.setattr(TfidfReportIndex, "encode", spy_encode)
+    (path / "irm_genou_001.txt").write_text(
+        _report("Fissure méniscale interne et épanchement."), encoding="utf-8"
+    )
+    (path / "irm_foie_004.txt").write_text(_report("Angiome hépatique."), encoding="utf-8")
+    (path / "irm_rachis_003.txt").unlink()
+
+    assert knowledge_base.refresh()
+    assert sorted(parsed) == [str(path / "irm_foie_004.txt"), str(path / "irm_genou_001.txt")]
+    # Un encodage par granularité : les deux rapports, puis leurs 8 sections
+    assert encoded == [2, 8]
+    index = knowledge_base.index
+    assert sorted(index.doc_ids) == ["irm_epaule_002.txt", "irm_foie_004.txt", "irm_genou_001.txt"]
+    assert np.array_equal(
+        index.matrix[index.row("irm_epaule_002.txt")].toarray(), unchanged_vector
+    )
+
+
+def test_refresh_without_changes_does_nothing(monkeypatch, knowledge_base):
+    monkeypatch.setattr(
+        TfidfReportIndex, "update", lambda *args: pytest.fail("index mis à jour sans changement")
+    )
+    assert not knowledge_base.refresh()
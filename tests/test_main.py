@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+
+import pytest
+from pydantic import TypeAdapter, ValidationError
+
+from medical_report_generator import main
+from medical_report_generator.errors import ReportGenerationError, UnknownTaskError
+from medical_report_generator.task_cache import TaskOutputCache
+
+
+class _Pool:
+    @contextmanager
+    def checkout(self):
+        yield None
+
+
+def _validation_error() -> ValidationError:
+    try:
+        TypeAdapter(int).validate_python("pas un entier")
+    except ValidationError as e:
+        return e
+
+
+@pytest.fixture
+def task_cache(tmp_path):
+    return TaskOutputCache(tmp_path / "task_cache", read=False)
+
+
+def test_validation_error_becomes_a_failed_result(monkeypatch, task_cache):
+    # ValidationError hérite de ValueError : elle ne doit pas sortir de generate_report
+    def run_crew(*args):
+        raise _validation_error()
+
+    monkeypatch.setattr(main, "crew_pool", _Pool())
+    monkeypatch.setattr(main, "run_crew", run_crew)
+    result = main.generate_report({"raw_input": "x"}, task_cache)
+    assert isinstance(result.error, ReportGenerationError)
+    assert isinstance(result.error.__cause__, ValidationError)
+    assert not result.is_generated
+
+
+def test_unknown_task_is_raised(monkeypatch, task_cache):
+    def run_crew(*args):
+        raise UnknownTaskError("Tâche inconnue : x")
+
+    monkeypatch.setattr(main, "crew_pool", _Pool())
+    monkeypatch.setattr(main, "run_crew", run_crew)
+    with pytest.raises(UnknownTaskError):
+        main.generate_report({"raw_input": "x"}, task_cache, from_task="x")
+
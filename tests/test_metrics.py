@@ -0,0 +1,62 @@
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from api import metrics
+from api.database import Base
+from api.metrics import GenerationMetrics, prometheus_text
+from medical_report_generator.errors import GenerationResult, ReportGenerationError
+
+
+def _llm_record(duration):
+    return {
+        "kind": "llm",
+        "name": "classify_report_type",
+        "agent": "Classifieur",
+        "duration": duration,
+        "prompt_tokens": 100,
+        "completion_tokens": 5,
+    }
+
+
+@pytest.fixture
+def db(monkeypatch):
+    # La version de configuration du cache lit les YAML depuis la racine du projet
+    monkeypatch.chdir(Path(__file__).resolve().parent.parent)
+    monkeypatch.setattr(metrics, "generation_metrics", GenerationMetrics())
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+
+def test_counters_are_kept_in_process(db):
+    metrics.generation_metrics.record(
+        GenerationResult(
+            filename="generated/a.docx",
+            timings={"total": 0.3},
+            metrics=[_llm_record(0.07), _llm_record(2.0)],
+        )
+    )
+    metrics.generation_metrics.record(
+        GenerationResult(error=ReportGenerationError("échec"), timings={"total": 0.04})
+    )
+    text = prometheus_text(db)
+
+    assert 'medical_report_reports_total{status="generated"} 1' in text
+    assert 'medical_report_reports_total{status="failed"} 1' in text
+    assert 'medical_report_llm_calls_total{task="classify_report_type",agent="Classifieur"} 2' in text
+    bucket = 'medical_report_duration_seconds_bucket{kind="stage",name="total",le="%s"} %d'
+    assert bucket % ("0.05", 1) in text
+    assert bucket % ("0.5", 2) in text
+    assert bucket % ("+Inf", 2) in text
+    assert (
+        'medical_report_duration_seconds_bucket{kind="llm",name="classify_report_type",le="1"} 1'
+        in text
+    )
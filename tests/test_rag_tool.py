@@ -0,0 +1,55 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+from medical_report_generator.tools.rag_tool import RAGMedicalReportsTool
+
+TRAINING_PATH = Path(__file__).resolve().parent.parent / "knowledge" / "reports" / "training"
+
+QUERIES = [
+    ("Fissure du ménisque interne, épanchement articulaire", "irm_genou"),
+    ("Hernie discale L4-L5 avec conflit radiculaire", "irm_rachis"),
+    ("Tendinopathie du supra-épineux", "irm_epaule"),
+    ("Lésion hépatique hypervasculaire", "irm_foie"),
+    ("Contrôle sans particularité", "type_inconnu"),
+]
+
+
+@pytest.fixture(scope="module")
+def tool(tmp_path_factory):
+    # Copie : l'index est construit et enregistré à côté de la base, hors du projet
+    knowledge_base_path = tmp_path_factory.mktemp("knowledge") / "training"
+    shutil.copytree(TRAINING_PATH, knowledge_base_path)
+    return RAGMedicalReportsTool(knowledge_base_path=str(knowledge_base_path), backend="tfidf")
+
+
+def _single(tool, query, report_type, top_k, section):
+    # Ce que _retrieve met en forme pour une requête
+    partitions = tool._partitions(section)
+    return tool._reports_for_hits(
+        partitions, partitions.search(query, report_type, top_k, section)
+    )
+
+
+@pytest.mark.parametrize("section", [None, "Conclusion"])
+def test_retrieve_batch_matches_single_queries(tool, section):
+    queries = [query for query, _ in QUERIES]
+    report_types = [report_type for _, report_type in QUERIES]
+    batch = tool.retrieve_batch(queries, report_types, top_k=3, section=section)
+
+    assert len(batch) == len(QUERIES)
+    assert batch[0]
+    for (query, report_type), reports in zip(QUERIES, batch):
+        expected = _single(tool, query, report_type, 3, section)
+        assert [(r["path"], r["section"]) for r in reports] == [
+            (r["path"], r["section"]) for r in expected
+        ]
+        assert [r["similarity"] for r in reports] == pytest.approx(
+            [r["similarity"] for r in expected]
+        )
+
+
+def test_retrieve_batch_checks_the_number_of_report_types(tool):
+    with pytest.raises(ValueError):
+        tool.retrieve_batch(["a", "b"], ["irm_genou"])
@@ -0,0 +1,110 @@
+import pytest
+from litellm.exceptions import RateLimitError
+
+from medical_report_generator.rate_limit import RateLimiter, _UsageRecorder
+
+
+class _Clock:
+    """Horloge manuelle ; sleep() ne fait qu'enregistrer l'attente, sauf avec advance=True."""
+
+    def __init__(self, advance: bool = False):
+        self.now = 0.0
+        self.advance = advance
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        if self.advance:
+            self.now += seconds
+
+
+def _limiter(clock: _Clock, **kwargs) -> RateLimiter:
+    settings = dict(requests_per_minute=0, tokens_per_minute=0, max_retries=0)
+    settings.update(kwargs)
+    return RateLimiter(clock=clock, sleep=clock.sleep, **settings)
+
+
+def test_callers_beyond_the_quota_wait_in_arrival_order():
+    clock = _Clock()
+    limiter = _limiter(clock, requests_per_minute=2)
+    # Seau plein pour deux requêtes, puis chaque requête ajoute 30 s de dette
+    assert [limiter.acquire(0) for _ in range(4)] == [0.0, 0.0, 30.0, 60.0]
+    assert clock.sleeps == [30.0, 60.0]
+
+
+def test_the_bucket_refills_with_time():
+    clock = _Clock()
+    limiter = _limiter(clock, requests_per_minute=2)
+    limiter.acquire(0)
+    limiter.acquire(0)
+    clock.now += 30
+    assert limiter.acquire(0) == 0.0
+    assert limiter.acquire(0) == 30.0
+
+
+def test_a_large_prompt_waits_for_its_tokens():
+    clock = _Clock()
+    limiter = _limiter(clock, tokens_per_minute=100)
+    assert limiter.acquire(150) == 30.0
+
+
+def test_reported_usage_replaces_the_estimate():
+    clock = _Clock()
+    limiter = _limiter(clock, tokens_per_minute=1000)
+
+    def request(callbacks):
+        usage = type("Usage", (), {"total_tokens": 20, "prompt_tokens": 15, "completion_tokens": 5})
+        for callback in callbacks:
+            callback.log_success_event({}, {"usage": usage}, None, None)
+        return "réponse"
+
+    limiter.call(request, estimated_tokens=300)
+    stats = limiter.stats()
+    assert stats["tokens"] == 20
+    # 300 réservés, 20 consommés : les 280 restants sont rendus au seau
+    assert stats["available_tokens"] == 980
+
+
+def test_the_estimate_grows_with_the_response_when_no_usage_is_reported():
+    limiter = _limiter(_Clock())
+    limiter.call(lambda callbacks: "x" * 40, estimated_tokens=100)
+    assert limiter.stats()["tokens"] == 110
+
+
+def test_transient_errors_are_retried_with_backoff(monkeypatch):
+    clock = _Clock(advance=True)
+    limiter = _limiter(clock, max_retries=3, retry_base_delay=1, retry_max_delay=60)
+    monkeypatch.setattr("random.uniform", lambda low, high: high)
+    failures = [RateLimitError("quota", llm_provider="gemini", model="x")] * 2
+
+    def request(callbacks):
+        if failures:
+            raise failures.pop()
+        return "réponse"
+
+    assert limiter.call(request, estimated_tokens=1) == "réponse"
+    assert clock.sleeps == [1, 2]
+    assert limiter.stats()["retries"] == 2
+
+
+def test_the_last_transient_error_is_raised():
+    limiter = _limiter(_Clock(), max_retries=1, retry_base_delay=0)
+
+    def request(callbacks):
+        raise RateLimitError("quota", llm_provider="gemini", model="x")
+
+    with pytest.raises(RateLimitError):
+        limiter.call(request, estimated_tokens=1)
+    stats = limiter.stats()
+    assert (stats["retries"], stats["failures"], stats["calls"]) == (1, 1, 0)
+
+
+def test_usage_recorder_adds_up_several_responses():
+    usage = _UsageRecorder()
+    reported = type("Usage", (), {"total_tokens": 10, "prompt_tokens": 8, "completion_tokens": 2})
+    usage.log_success_event({}, {"usage": reported}, None, None)
+    usage.log_success_event({}, {"usage": reported}, None, None)
+    assert (usage.total_tokens, usage.prompt_tokens, usage.completion_tokens) == (20, 16, 4)
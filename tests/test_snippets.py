@@ -0,0 +1,55 @@
+import pytest
+
+from medical_report_generator.tools.rag_index import TfidfReportIndex
+from medical_report_generator.tools.snippets import select_snippets
+
+REPORTS = [
+    {
+        "content": {
+            "Résultat": "Fissure horizontale de la corne postérieure du ménisque interne. "
+            "Absence d'épanchement articulaire.",
+            "Conclusion": "Fissure méniscale interne.",
+        }
+    },
+    {
+        "content": {
+            "Résultat": "Absence d'épanchement  articulaire ! Ligament croisé antérieur intact.",
+        }
+    },
+]
+SECTIONS = [["Résultat", "Conclusion"], ["Résultat"]]
+
+
+@pytest.fixture
+def index():
+    return TfidfReportIndex.build(
+        {
+            "a": "fissure ménisque interne corne postérieure épanchement articulaire",
+            "b": "ligament croisé antérieur intact épanchement",
+        }
+    )
+
+
+def test_sentences_repeated_in_a_lower_ranked_report_are_dropped(index):
+    snippets, stats = select_snippets("ménisque", REPORTS, SECTIONS, index, budget_chars=10_000)
+    assert snippets[1] == {"Résultat": ["Ligament croisé antérieur intact."]}
+    assert stats["duplicates"] == 1
+    assert stats["sentences"] == 5
+    assert stats["omitted"] == 0
+
+
+def test_the_budget_keeps_the_most_similar_sentences(index):
+    query = "fissure corne postérieure du ménisque interne"
+    first = "Fissure horizontale de la corne postérieure du ménisque interne."
+    snippets, stats = select_snippets(query, REPORTS, SECTIONS, index, budget_chars=len(first) + 1)
+    assert snippets == [{"Résultat": [first]}, {}]
+    assert stats["kept"] == 1
+    assert stats["chars"] <= len(first) + 1
+
+
+def test_kept_sentences_stay_in_report_order(index):
+    snippets, _ = select_snippets("épanchement", REPORTS, SECTIONS, index, budget_chars=10_000)
+    assert snippets[0]["Résultat"] == [
+        "Fissure horizontale de la corne postérieure du ménisque interne.",
+        "Absence d'épanchement articulaire.",
+    ]
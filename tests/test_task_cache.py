@@ -0,0 +1,51 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from medical_report_generator.task_cache import TaskOutputCache
+
+
+def test_expired_output_is_a_miss(tmp_path):
+    cache = TaskOutputCache(tmp_path, ttl=timedelta(hours=1))
+    cache.put("classify_report_type", "ancienne", "irm_genou")
+    path = tmp_path / "ancienne.json"
+    entry = json.loads(path.read_text(encoding="utf-8"))
+    entry["created_at"] = (datetime.now() - timedelta(hours=2)).isoformat()
+    path.write_text(json.dumps(entry), encoding="utf-8")
+
+    assert cache.get("classify_report_type", "ancienne") is None
+    assert not path.exists()
+
+
+def test_least_recently_used_outputs_are_evicted(tmp_path):
+    cache = TaskOutputCache(tmp_path, max_entries=2)
+    cache.save_inputs({"raw_input": "IRM du genou"})
+    now = time.time()
+    for age, key in ((30, "a"), (20, "b")):
+        cache.put("t", key, key)
+        os.utime(tmp_path / f"{key}.json", (now - age, now - age))
+    # "a" relu : c'est "b" qui devient la plus ancienne utilisation
+    assert cache.get("t", "a") == "a"
+    cache.put("t", "c", "c")
+
+    assert sorted(path.stem for path in tmp_path.glob("*.json")) == ["a", "c", "last_inputs"]
+
+
+def test_the_directory_is_scanned_only_past_the_cap(monkeypatch, tmp_path):
+    scans = []
+    prune = TaskOutputCache.prune
+
+    def counted_prune(self):
+        scans.append(self)
+        return prune(self)
+
+    monkeypatch.setattr(TaskOutputCache, "prune", counted_prune)
+    for key in range(10):
+        # Une instance par exécution, comme run() : le compte est partagé par répertoire
+        TaskOutputCache(tmp_path, max_entries=10).put("t", str(key), "sortie")
+    assert len(scans) == 1
+
+    TaskOutputCache(tmp_path, max_entries=10).put("t", "10", "sortie")
+    assert len(scans) == 2
+    assert len(list(tmp_path.glob("*.json"))) == 9